@@ -0,0 +1,283 @@
+"""
+Modo de execução assíncrono (ASGI)
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+`POST /validate` roda nativamente no event loop: a busca de regra no Firestore
+(`AsyncClient`) e a chamada ao GA4 (`httpx.AsyncClient`) são aguardadas em
+paralelo, então uma instância mantém centenas de validações em andamento sem
+depender de threads. Índice em memória e snapshots continuam sendo consultados
+antes de qualquer I/O. As demais rotas (/loadmap, /validate/batch, Swagger...)
+são servidas pelo app Flask via `WsgiToAsgi`, com o mesmo contrato do modo
+síncrono.
+"""
+import asyncio
+import logging
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import codec
+import main
+from ga4_client import AsyncGA4Client
+from lookup_cache import AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+# o httpx registra cada requisição em INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+wsgi_app = WsgiToAsgi(main.app)
+
+ga4_client = AsyncGA4Client(main.GA4_MP_BASE_URL, timeout=main.GA4_MP_TIMEOUT,
+                            pool_size=main.GA4_ASYNC_POOL_SIZE, max_events=main.GA4_MP_MAX_EVENTS)
+
+_async_db = None
+# coalescência das leituras de regra no event loop (ver lookup_cache.py)
+schema_flight = AsyncSingleFlight()
+
+
+async def get_async_db():
+    """`firestore.AsyncClient` criado no event loop do worker (None se indisponível)."""
+    global _async_db
+    if _async_db is None:
+        # o cliente síncrono é criado sob demanda; a busca de credenciais
+        # bloqueia, então roda fora do event loop
+        db = main.get_db() if main.firestore_client.initialized else await asyncio.to_thread(main.get_db)
+        if db is not None:
+            try:
+                from google.cloud import firestore
+                _async_db = firestore.AsyncClient(project=db.project)
+            except Exception as e:
+                logger.error(f"Erro ao inicializar Firestore AsyncClient: {e}")
+    return _async_db
+
+
+# --- LAYERS ASSÍNCRONAS ---
+
+async def resolve_rule(payload, lookup_key):
+    """Versão assíncrona de `main._resolve_rule` (mesmos resultados)."""
+    event_name = payload.get('event_name')
+    params = payload.get('params', {}) or {}
+    kind, key, scope = lookup_key
+
+    index_version = main.rule_index.version
+    doc_dict = main._rule_from_memory(kind, key, scope, event_name, params)
+    if doc_dict is not None:
+        return doc_dict, None
+    db = await get_async_db()
+    if db is None:
+        return None, dict(main._FIRESTORE_OFFLINE)
+
+    flight_key = (index_version, lookup_key)
+    try:
+        hash(flight_key)
+    except TypeError:
+        flight_key = None
+
+    if flight_key is not None and main.negative_cache.get(flight_key):
+        return None, main._not_documented(kind, event_name)
+    shed = main._shed_schema_read()
+    if shed:
+        return None, shed
+    if flight_key is None:
+        return await _read_rule(db, kind, key, scope, event_name, params, index_version)
+    return await schema_flight.do(
+        flight_key, lambda: _read_rule(db, kind, key, scope, event_name, params, index_version, flight_key))
+
+
+async def _read_rule(db, kind, key, scope, event_name, params, index_version, negative_key=None):
+    collection = db.collection(main.COLLECTION_NAME)
+    with main.load_shedder.measure("schema"):
+        if kind == 'doc_id':
+            doc = await collection.document(key).get()
+            doc_id, doc_dict = (key, doc.to_dict()) if doc.exists else (None, None)
+        else:
+            found = await _lookup_rule(collection, key, scope) if main.RULE_LOOKUP_KEYS else None
+            if found is None and main._use_rule_query(scope):
+                docs = [(doc.id, doc.to_dict()) async for doc in
+                        main._rule_query(collection, event_name, params).stream()]
+                found = main.map_registry.pick(docs, scope)
+            doc_id, doc_dict = found or (None, None)
+
+    if doc_dict is None:
+        if negative_key is not None:
+            main.negative_cache.put(negative_key, True)
+        return None, main._not_documented(kind, event_name)
+
+    main.rule_index.put(doc_id, doc_dict, index_version)
+    return doc_dict, None
+
+
+async def _lookup_rule(collection, lookup, view):
+    """Versão assíncrona de `main._lookup_rule`: as consultas da visão rodam em paralelo."""
+    scoped, unknown = main._rule_lookup_queries(collection, lookup, view)
+    results = await asyncio.gather(*(query.get() for query in scoped))
+    found = [(doc.id, doc.to_dict()) for docs in results for doc in docs]
+    if found:
+        return main._pick_lookup(found, None, view)
+    docs = await unknown.get()
+    return main._pick_lookup([], (docs[0].id, docs[0].to_dict()) if docs else None, view)
+
+
+async def validate_schema(payload, client_id=None):
+    """Layer 3 assíncrona: mesma comparação de `main.validate_schema`."""
+    try:
+        doc_dict, result = await resolve_rule(payload, main._schema_lookup_key(payload, client_id))
+        if doc_dict is None:
+            return result
+        return main.check_params(doc_dict, payload.get('params', {}) or {})
+    except Exception as e:
+        logger.error(f"Erro ao ler Firestore: {e}")
+        return {"status": "ERROR", "layer": "Schema", "message": str(e)}
+
+
+async def validate_google_mp(payload):
+    """Layer 4 assíncrona."""
+    if not payload.get('measurement_id') or not payload.get('api_secret'):
+        return dict(main._GA4_SKIPPED)
+    with main.load_shedder.measure("google_mp"):
+        return (await ga4_client.validate_chunk([payload]))[0]
+
+
+async def timed_layer(layer, coro, timings=None):
+    """Equivalente assíncrono de `main.timed_layer`."""
+    if not main.metrics.enabled and timings is None:
+        return await coro
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        elapsed = time.perf_counter() - start
+        main.metrics.observe(layer, elapsed)
+        if timings is not None:
+            timings[layer] = round(elapsed * 1000, 3)
+
+
+async def build_report(raw_payload, payload, client_id=None, with_timings=False):
+    """Mesmo relatório de `main.build_report`; Layers 3 e 4 aguardadas em paralelo."""
+    report = await _dedup_report(raw_payload, payload, client_id, with_timings)
+    if not report["valid"]:
+        return report
+    timings = report.get("timings")
+    skipped = main.skipped_layers(raw_payload, payload, client_id)
+
+    mp_task = None
+    if "google_mp" not in skipped:
+        mp_task = asyncio.ensure_future(timed_layer("google_mp", validate_google_mp(payload), timings))
+    try:
+        main.set_layer(report, "taxonomy",
+                       main.timed_layer("taxonomy", main.validate_taxonomy, payload, timings=timings))
+        schema_res = skipped.get("schema") or await timed_layer("schema", validate_schema(payload, client_id), timings)
+    except BaseException:
+        if mp_task is not None:
+            mp_task.cancel()
+        raise
+    main.set_layer(report, "schema", schema_res)
+    main.set_layer(report, "google_mp", await mp_task if mp_task is not None else skipped["google_mp"])
+    return report
+
+
+async def _dedup_report(raw_payload, payload, client_id, with_timings):
+    if main.DEDUP_BACKEND != 'redis':
+        return main.dedup_report(raw_payload, payload, client_id, with_timings)
+    return await asyncio.to_thread(main.dedup_report, raw_payload, payload, client_id, with_timings)
+
+
+# --- ROTA NATIVA ---
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def _is_json(content_type):
+    # mesma regra do `request.is_json` do Flask
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+_EXPOSE_HEADERS = ", ".join(main.CORS_EXPOSE_HEADERS).encode('latin-1')
+
+
+async def _send_json(send, status, data, origin=None, extra_headers=()):
+    body = codec.dumps(data) + b"\n"
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        *extra_headers,
+    ]
+    # mesma política do Flask-CORS em main.py (todas as origens)
+    if origin:
+        headers += [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    else:
+        headers.append((b'access-control-allow-origin', b'*'))
+    headers.append((b'access-control-expose-headers', _EXPOSE_HEADERS))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def validate(scope, receive, send):
+    """POST /validate assíncrono (contrato idêntico à rota Flask)."""
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+    origin = headers.get('origin')
+    # mesma admissão das rotas Flask (`main._admit_validation`)
+    if not main.load_shedder.try_acquire():
+        return await _send_json(send, 429, main.OVERLOADED, origin,
+                                [(b'retry-after', str(main.SHED_RETRY_AFTER).encode())])
+    try:
+        await _handle_validate(scope, receive, send, headers, origin)
+    finally:
+        main.load_shedder.release()
+
+
+async def _handle_validate(scope, receive, send, headers, origin):
+    body = await _read_body(receive)
+    if body is None:
+        return
+
+    try:
+        if not _is_json(headers.get('content-type', '')):
+            return await _send_json(send, 400, {"error": "JSON required"}, origin)
+
+        # um único parse; os bytes do corpo vão direto para o hash da deduplicação
+        raw_payload = body
+        payload = codec.loads(body)
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        with_timings = main.REPORT_TIMINGS or query.get('timings', [''])[0].lower() in ('1', 'true')
+
+        report = await build_report(raw_payload, payload, headers.get('x-client-id'), with_timings)
+        main.report_sink.record(report, main.event_client_id(payload, headers.get('x-client-id')))
+        await _send_json(send, 200, report, origin)
+
+    except Exception as e:
+        logger.error(f"Erro Fatal no validate_full: {e}", exc_info=True)
+        await _send_json(send, 500, {"error": "Erro interno no servidor", "details": str(e)}, origin)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await ga4_client.aclose()
+            if _async_db is not None:
+                _async_db.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http' and scope['path'] == '/validate' and scope['method'] == 'POST':
+        return await validate(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
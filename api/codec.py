@@ -0,0 +1,59 @@
+"""
+JSON e hash do caminho de validação
+
+O corpo do `/validate` é lido uma vez como bytes: `loads()` faz o único parse,
+os mesmos bytes vão para o hash da deduplicação (`digest()`) e o relatório
+volta por `dumps()`, sem passar pelo `jsonify`.
+
+- `orjson` (se instalado) serializa e faz o parse; sem ele, cai no `json` da
+  stdlib com a mesma saída do orjson: chaves ordenadas e compacto, como o
+  provider do Flask, mas em UTF-8 sem escapes `\\uXXXX` (o `jsonify` usa
+  `ensure_ascii`). O JSON é equivalente; só a representação dos não ASCII muda.
+- `xxhash` (xxh3 de 128 bits, se instalado) gera o digest de 16 bytes da
+  deduplicação; sem ele, `blake2b` com o mesmo tamanho.
+"""
+import hashlib
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+JSON_BACKEND = 'orjson' if orjson else 'json'
+DIGEST_BACKEND = 'xxh3_128' if xxhash else 'blake2b'
+
+if orjson:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+    _ORJSON_SORTED = _ORJSON_OPTIONS | orjson.OPT_SORT_KEYS
+
+
+def loads(data):
+    """Parse de `bytes` ou `str` (ValueError se o JSON for inválido)."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, sort_keys=True):
+    """Serializa em bytes UTF-8 (sem escapes ASCII), compacto; por padrão com chaves ordenadas."""
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=str, option=_ORJSON_SORTED if sort_keys else _ORJSON_OPTIONS)
+        except TypeError:
+            # ex.: inteiros acima de 64 bits ou chaves de tipos mistos na ordenação
+            pass
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':'),
+                      default=str).encode('utf-8')
+
+
+def digest(data):
+    """Digest de 16 bytes (não criptográfico quando há xxhash) de `data` (bytes)."""
+    if xxhash:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
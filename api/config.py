@@ -6,3 +6,22 @@ __version__ = "0.0.2"
 
 APP_NAME = "Tagging Validation API"
 APP_DESCRIPTION = "API para validação de eventos de Analytics (Schema, Taxonomia e Google MP)"
+
+# Regras de nomenclatura (Layer 2 - Taxonomia).
+# Podem ser sobrescritas por um JSON apontado em TAXONOMY_RULES_FILE.
+# Limites padrão seguem a documentação do GA4 (nomes até 40 caracteres,
+# até 25 parâmetros por evento, valores até 100 caracteres).
+TAXONOMY_RULES = {
+    "name_pattern": r"[a-z0-9_]+",
+    "reserved_prefixes": ["ga_", "google_", "firebase_"],
+    "event_name_max_length": 40,
+    "param_name_max_length": 40,
+    "max_params": 25,
+    "param_value_max_length": 100,
+    "param_value_max_length_overrides": {
+        "page_location": 1000,
+        "page_referrer": 420,
+        "page_title": 300,
+    },
+    "cache_size": 8192,
+}
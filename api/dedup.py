@@ -0,0 +1,82 @@
+"""
+Store de deduplicação (Layer 1)
+
+`ShardedDedupStore` divide as chaves em N shards com lock próprio, então
+threads concorrentes raramente disputam o mesmo lock. As chaves viram
+digests fixos de 16 bytes (`codec.digest`: xxh3 ou blake2b) e expiram apenas
+pelo TTL (não há eviction por tamanho, então duplicados não escapam em
+rajadas).
+
+`RedisDedupStore` compartilha o estado entre workers do gunicorn e instâncias
+do Cloud Run usando `SET NX PX` em qualquer servidor compatível com Redis.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from codec import digest as _digest
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedDedupStore:
+    """Dedup em memória do processo, particionado por hash."""
+
+    def __init__(self, ttl, shards=64):
+        self.ttl = ttl
+        # OrderedDict por shard: ordem de inserção == ordem de expiração (TTL fixo)
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(max(1, shards))]
+
+    def seen(self, key):
+        """Registra `key` (bytes) e retorna True se ela já foi vista dentro do TTL."""
+        digest = _digest(key)
+        lock, entries = self._shards[int.from_bytes(digest[:4], 'little') % len(self._shards)]
+        now = time.monotonic()
+        with lock:
+            # remove expirados do início (amortizado O(1) por chamada)
+            while entries:
+                oldest, expires = next(iter(entries.items()))
+                if expires > now:
+                    break
+                entries.popitem(last=False)
+
+            if digest in entries:
+                return True
+            entries[digest] = now + self.ttl
+            return False
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._shards)
+
+
+class RedisDedupStore:
+    """Dedup compartilhado entre processos/instâncias via Redis (ou compatível)."""
+
+    def __init__(self, url, ttl, prefix="tagging:dedup:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("DEDUP_BACKEND=redis requer o pacote 'redis'.") from e
+
+        self.ttl_ms = max(1, int(ttl * 1000))
+        self.prefix = prefix.encode('utf-8')
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def seen(self, key):
+        try:
+            created = self._client.set(self.prefix + _digest(key), b"1", nx=True, px=self.ttl_ms)
+        except Exception as e:
+            # falha aberta: indisponibilidade do Redis não bloqueia a validação
+            logger.warning(f"Dedup Redis indisponível: {e}")
+            return False
+        return not created
+
+
+def create_store(backend, ttl, shards=64, redis_url=None):
+    if backend == 'redis':
+        if not redis_url:
+            raise ValueError("DEDUP_REDIS_URL é obrigatório para DEDUP_BACKEND=redis")
+        logger.info("Deduplicação compartilhada via Redis (%s)", redis_url.split('@')[-1])
+        return RedisDedupStore(redis_url, ttl)
+    return ShardedDedupStore(ttl, shards)
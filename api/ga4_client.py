@@ -0,0 +1,156 @@
+"""
+Cliente do Google Analytics 4 Measurement Protocol (Layer 4)
+
+Usa uma `requests.Session` compartilhada com pool de conexões keep-alive e
+envia até `max_events` eventos por chamada ao endpoint de debug. A URL base é
+configurável para permitir testes de carga contra um stub local.
+"""
+import logging
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LAYER = "Google Protocol"
+
+# Limite de eventos por requisição do Measurement Protocol
+MP_MAX_EVENTS = 25
+
+# Índice do evento nas mensagens de validação: vem na `description`, ex.:
+# {"fieldPath": "events", "description": "Event at index: [3] has invalid name [...]..."}
+_EVENT_INDEX_RE = re.compile(r'\bindex: \[(\d+)\]')
+
+
+def _group_key(payload):
+    """Eventos só podem ir na mesma chamada se compartilham credenciais e usuário."""
+    return (
+        payload.get('measurement_id'),
+        payload.get('api_secret'),
+        payload.get('client_id', 'test_user'),
+        payload.get('timestamp_micros'),
+    )
+
+
+class GA4Client:
+    def __init__(self, base_url="https://www.google-analytics.com", timeout=3.0,
+                 pool_size=16, max_events=MP_MAX_EVENTS):
+        self.url = base_url.rstrip('/') + "/debug/mp/collect"
+        self.timeout = timeout
+        self.max_events = max(1, min(max_events, MP_MAX_EVENTS))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def plan(self, payloads):
+        """Agrupa eventos com credenciais em chamadas de até `max_events`.
+
+        Retorna uma lista de `(posições, payloads)`; eventos sem credenciais
+        ficam de fora (o chamador os marca como SKIPPED).
+        """
+        groups = {}
+        for pos, payload in enumerate(payloads):
+            if not payload.get('measurement_id') or not payload.get('api_secret'):
+                continue
+            groups.setdefault(_group_key(payload), []).append(pos)
+
+        chunks = []
+        for positions in groups.values():
+            for i in range(0, len(positions), self.max_events):
+                part = positions[i:i + self.max_events]
+                chunks.append((part, [payloads[p] for p in part]))
+        return chunks
+
+    def validate_chunk(self, payloads):
+        """Valida eventos de um mesmo grupo em uma chamada. Retorna um resultado por evento."""
+        query, body = build_request(payloads)
+        try:
+            response = self.session.post(self.url, params=query, json=body, timeout=self.timeout)
+            return parse_response(response.status_code, response.json, len(payloads))
+        except Exception as e:
+            return _errors(str(e), len(payloads))
+
+
+class AsyncGA4Client(GA4Client):
+    """Mesma validação do `GA4Client` sobre `httpx.AsyncClient` (modo ASGI).
+
+    O cliente HTTP é criado na primeira chamada, dentro do event loop que vai usá-lo.
+    """
+
+    def __init__(self, base_url="https://www.google-analytics.com", timeout=3.0,
+                 pool_size=100, max_events=MP_MAX_EVENTS):
+        self.url = base_url.rstrip('/') + "/debug/mp/collect"
+        self.timeout = timeout
+        self.max_events = max(1, min(max_events, MP_MAX_EVENTS))
+        self.pool_size = pool_size
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size),
+            )
+        return self._client
+
+    async def validate_chunk(self, payloads):
+        query, body = build_request(payloads)
+        try:
+            response = await self._http().post(self.url, params=query, json=body)
+            return parse_response(response.status_code, response.json, len(payloads))
+        except Exception as e:
+            return _errors(str(e), len(payloads))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def build_request(payloads):
+    """Query string e corpo da chamada ao Measurement Protocol para um grupo de eventos."""
+    first = payloads[0]
+    body = {
+        "client_id": first.get("client_id", "test_user"),
+        "timestamp_micros": first.get("timestamp_micros"),
+        "events": [{
+            "name": payload.get("event_name"),
+            "params": payload.get("params", {})
+        } for payload in payloads]
+    }
+    query = {"measurement_id": first.get('measurement_id'), "api_secret": first.get('api_secret')}
+    return query, body
+
+
+def _errors(message, count):
+    """Um resultado de erro por evento (dicionários independentes)."""
+    return [{"status": "ERROR", "layer": LAYER, "message": message} for _ in range(count)]
+
+
+def parse_response(status_code, read_json, count):
+    """Converte a resposta do endpoint de debug em um resultado por evento."""
+    # O endpoint de debug retorna 200 mesmo com erros de validação no corpo
+    if status_code != 200:
+        return _errors(f"⚠️ sHTTP {status_code}", count)
+    validation_messages = read_json().get('validationMessages', [])
+
+    # Distribui as mensagens pelo índice do evento citado na `description`;
+    # mensagens sem índice (ex.: client_id) valem para todos os eventos da chamada
+    feedback = [[] for _ in range(count)]
+    for message in validation_messages:
+        match = _EVENT_INDEX_RE.search(message.get('description') or '')
+        index = int(match.group(1)) if match else None
+        if index is not None and index < count:
+            feedback[index].append(message)
+        else:
+            for messages in feedback:
+                messages.append(message)
+
+    return [
+        {"status": "ERROR", "layer": LAYER, "google_feedback": messages} if messages else None
+        for messages in feedback
+    ]
@@ -0,0 +1,155 @@
+"""
+Jobs assíncronos de carga de mapa (/loadmap)
+
+`JobRegistry` executa cargas em background e mantém o estado de cada job
+(fase, linhas lidas, documentos gravados, throughput e erros). Cargas
+concorrentes do mesmo `map_id` com os mesmos parâmetros (`map_version` e
+`mode`) são colapsadas no job que já está em andamento (single-flight); com
+parâmetros diferentes, o chamador recebe o job em andamento para recusar a
+carga. O single-flight vale por processo. O estado pode ser espelhado em um
+armazenamento externo (`persist`) para que qualquer instância responda ao
+polling.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Fases em que o job ainda está ativo
+ACTIVE_PHASES = ('queued', 'fetching', 'deleting', 'writing', 'publishing')
+
+
+class LoadJob:
+    """Estado de uma carga de mapa."""
+
+    def __init__(self, map_id, map_version=None, mode=None):
+        self.job_id = uuid.uuid4().hex
+        self.map_id = map_id
+        self.map_version = map_version
+        self.mode = mode
+        # parâmetros pedidos (map_version é resolvido durante a carga)
+        self.requested = (map_version, mode)
+        self.phase = 'queued'
+        self.status = 'PENDING'
+        self.rows_read = 0
+        self.docs_written = 0
+        self.docs_deleted = 0
+        self.retries = 0
+        self.errors = []
+        self.changes = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._saved_at = 0.0
+
+    @property
+    def active(self):
+        return self.phase in ACTIVE_PHASES
+
+    def matches(self, map_version, mode):
+        """True se o job foi criado com esses parâmetros."""
+        return self.requested == (map_version, mode)
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.job_id,
+            "map_id": self.map_id,
+            "map_version": self.map_version,
+            "mode": self.mode,
+            "phase": self.phase,
+            "status": self.status,
+            "rows_read": self.rows_read,
+            "docs_written": self.docs_written,
+            "docs_deleted": self.docs_deleted,
+            "retries": self.retries,
+            "changes": dict(self.changes),
+            "errors": list(self.errors),
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_second": round(self.docs_written / elapsed, 1) if elapsed else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    def __init__(self, max_workers=2, keep=100, persist=None, persist_interval=2.0):
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active_by_map = {}
+        self._keep = keep
+        self._persist = persist
+        self._persist_interval = persist_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loadmap")
+
+    def submit(self, map_id, map_version, run, mode=None):
+        """Enfileira `run(job)`; retorna `(job, created)`.
+
+        Se já existe um job ativo para o `map_id`, retorna esse job com
+        `created=False` em vez de iniciar outra carga; cabe ao chamador
+        conferir com `job.matches()` se ele atende ao pedido.
+        """
+        with self._lock:
+            current = self._active_by_map.get(map_id)
+            if current is not None and current.active:
+                return current, False
+
+            job = LoadJob(map_id, map_version, mode)
+            self._jobs[job.job_id] = job
+            self._active_by_map[map_id] = job
+            while len(self._jobs) > self._keep:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.active:
+                    break
+                del self._jobs[oldest_id]
+
+        self.save(job, force=True)
+        self._executor.submit(self._run, job, run)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def set_phase(self, job, phase):
+        job.phase = phase
+        self.save(job, force=True)
+
+    def save(self, job, force=False):
+        """Espelha o estado no armazenamento externo (limitado a 1x por intervalo)."""
+        if not self._persist:
+            return
+        now = time.monotonic()
+        if not force and now - job._saved_at < self._persist_interval:
+            return
+        job._saved_at = now
+        try:
+            self._persist(job.to_dict())
+        except Exception as e:
+            logger.warning(f"Falha ao persistir status do job {job.job_id}: {e}")
+
+    def _run(self, job, run):
+        job.started_at = time.time()
+        job.status = 'RUNNING'
+        try:
+            run(job)
+            if job.status == 'RUNNING':
+                job.status = 'SUCCESS'
+        except Exception as e:
+            logger.error(f"Erro no job de carga {job.job_id} ({job.map_id}): {e}", exc_info=True)
+            job.status = 'ERROR'
+            job.errors.append(str(e))
+        finally:
+            job.finished_at = time.time()
+            job.phase = 'done' if job.status in ('SUCCESS', 'EMPTY') else 'failed'
+            with self._lock:
+                if self._active_by_map.get(job.map_id) is job:
+                    del self._active_by_map[job.map_id]
+            self.save(job, force=True)
+            logger.info("Job de carga %s finalizado: %s", job.job_id, job.to_dict())
@@ -0,0 +1,116 @@
+"""
+Coalescência e cache negativo das buscas de regra (Layer 3)
+
+`SingleFlight` garante que buscas idênticas simultâneas (mesmo `doc_id` ou
+mesma tupla de filtros) façam uma única leitura no Firestore: a primeira
+thread executa a busca e as demais aguardam e recebem o mesmo resultado.
+`AsyncSingleFlight` faz o mesmo para o modo ASGI.
+
+`NegativeCache` guarda por pouco tempo os resultados "não documentado", para
+que eventos desconhecidos não consultem o Firestore a cada requisição. As
+chaves incluem a versão do índice de regras, então uma nova publicação de
+regras descarta o cache negativo.
+"""
+import asyncio
+import threading
+
+from cachetools import TTLCache
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Executa `fn()` uma vez por `key` entre chamadas concorrentes."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Versão para um único event loop (um por worker no modo ASGI)."""
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield: o cancelamento de um seguidor não cancela a busca dos demais
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.ensure_future(coro_fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._calls.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+
+class NegativeCache:
+    """Cache com TTL curto para buscas sem regra (`maxsize` limita a memória)."""
+
+    def __init__(self, ttl, maxsize=10000):
+        self.enabled = ttl > 0 and maxsize > 0
+        self._lock = threading.Lock()
+        self._entries = TTLCache(maxsize=max(1, maxsize), ttl=max(ttl, 0.001))
+        self.hits = 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if self.enabled:
+            with self._lock:
+                self._entries[key] = result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,17 +1,33 @@
+# primeiro import: o perfil de inicialização mede o tempo dos demais
+from startup import LazyClient, LazySwagger, startup_profile
 import os
 import logging
-import json
-import hashlib
-import requests
-import re
-from flask import Flask, request, jsonify
+import itertools
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context, has_request_context
 from flask_cors import CORS
-from google.cloud import firestore
-from google.cloud import bigquery
-from cachetools import TTLCache
-from flasgger import Swagger
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import codec
 from config import __version__, APP_NAME, APP_DESCRIPTION
+from rule_index import (LOOKUP_KEYS_FIELD, RuleIndex, doc_lookup_keys, doc_scope, lookup_hash, lookup_tuple,
+                        map_scope, new_token)
+from rule_keys import metadata_doc_id, row_doc_id
+from ga4_client import GA4Client, MP_MAX_EVENTS
+from taxonomy import TaxonomyEngine, load_rules
+from dedup import create_store as create_dedup_store
+from jobs import JobRegistry
+from snapshot import SnapshotStore
+from snapshot_mirror import GCSSnapshotMirror
+from map_registry import MapRegistry, load_pins
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from lookup_cache import NegativeCache, SingleFlight
+from validators import ValidatorCache
+from shedding import LoadShedder, Sampler, load_sampling_rules
+from report_sink import create_sink as create_report_sink
+from map_manifest import (LookupKeysVersions, clear_manifests, content_hash, delete_manifest, load_manifest,
+                          save_manifest)
+startup_profile.mark("imports")
 
 # --- CONFIGURAÇÃO ---
 logging.basicConfig(level=logging.INFO)
@@ -20,83 +36,324 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # Configurar CORS
+# Headers de resposta legíveis no navegador (Retry-After do 429 no backoff do tagging.js)
+CORS_EXPOSE_HEADERS = ["Retry-After"]
+# Tempo (s) em que o navegador reaproveita o preflight (Access-Control-Max-Age)
+CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE', 3600))
 CORS(app, resources={
     r"/*": {
         "origins": "*",  # Permite todas as origens em produção. Para restringir, use: ["https://seudominio.com"]
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "X-CLIENT-ID", "X-ADMIN-KEY"]
+        "allow_headers": ["Content-Type", "X-CLIENT-ID", "X-ADMIN-KEY"],
+        "expose_headers": CORS_EXPOSE_HEADERS,
+        "max_age": CORS_MAX_AGE
     }
 })
 
-# Configuração do Swagger
+# Configuração do Swagger (montado no primeiro acesso a /apidocs; ver startup.py)
 app.config['SWAGGER'] = {
     'title': APP_NAME,
     'uiversion': 3,
     'description': APP_DESCRIPTION,
     'version': __version__
 }
-swagger = Swagger(app)
+swagger = LazySwagger(app)
 
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 COLLECTION_NAME = 'analytics_event_rules'
+# Status dos jobs de /loadmap (espelhado para polling entre instâncias)
+LOADMAP_JOBS_COLLECTION = 'analytics_event_rules_jobs'
+# Documento de controle com o token da última publicação de regras
+RULES_CONTROL_COLLECTION = 'analytics_event_rules_meta'
+RULES_CONTROL_DOC = 'rule_index'
 BQ_TABLE = "tagging-api-481123.tagging_maps.collection_maps"
-
-# Inicialização de Clientes (Robusta)
-db = None
-bq_client = None
-
-try:
-    db = firestore.Client(project="tagging-api-481123")
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    logger.info(f"{APP_NAME} v{__version__} - Clientes GCP inicializados.")
-except Exception as e:
-    logger.error(f"Erro ao inicializar GCP Clients (Verifique key.json): {e}")
-
-# Cache para Deduplicação (Layer 1) - TTL de 2 segundos
+# Linhas por página lida do BigQuery durante o /loadmap
+BQ_PAGE_SIZE = int(os.environ.get('BQ_PAGE_SIZE', 5000))
+# Escrita em massa no Firestore (/loadmap e /clear-cache)
+FIRESTORE_BATCH_SIZE = int(os.environ.get('FIRESTORE_BATCH_SIZE', 400))
+FIRESTORE_WRITE_CONCURRENCY = int(os.environ.get('FIRESTORE_WRITE_CONCURRENCY', 8))
+FIRESTORE_MAX_RETRIES = int(os.environ.get('FIRESTORE_MAX_RETRIES', 5))
+# Jobs de /loadmap executados em background
+LOADMAP_MAX_JOBS = int(os.environ.get('LOADMAP_MAX_JOBS', 2))
+# Modo padrão do /loadmap: incremental (diff por hash) ou full (apaga e regrava)
+LOADMAP_DEFAULT_MODE = os.environ.get('LOADMAP_DEFAULT_MODE', 'incremental')
+
+# Inicialização de Clientes (Robusta e sob demanda): as bibliotecas do GCP são
+# importadas e os clientes criados no primeiro uso, fora do cold start.
+# get_db()/get_bq_client() retornam None se a criação falhar.
+# GCP_CLIENTS_ENABLED=false desativa os dois (validação offline, só com snapshots).
+GCP_CLIENTS_ENABLED = os.environ.get('GCP_CLIENTS_ENABLED', 'true').lower() == 'true'
+
+def _firestore_client():
+    from google.cloud import firestore
+    return firestore.Client(project="tagging-api-481123")
+
+def _bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client(project=PROJECT_ID)
+
+def _storage_client():
+    from google.cloud import storage
+    return storage.Client(project=PROJECT_ID)
+
+firestore_client = LazyClient("Firestore", _firestore_client, enabled=GCP_CLIENTS_ENABLED)
+bigquery_client = LazyClient("BigQuery", _bigquery_client, enabled=GCP_CLIENTS_ENABLED)
+storage_client = LazyClient("Cloud Storage", _storage_client, enabled=GCP_CLIENTS_ENABLED)
+get_db = firestore_client.get
+get_bq_client = bigquery_client.get
+
+# Snapshots locais das regras (mmap), publicados pelo /loadmap
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '/tmp/tagging-snapshots')
+SNAPSHOT_POLL_INTERVAL = float(os.environ.get('SNAPSHOT_POLL_INTERVAL', 30.0))
+# Versões residentes em memória: limite (MB) dos arquivos mapeados; versões frias são fechadas
+SNAPSHOT_MEMORY_BUDGET_MB = float(os.environ.get('SNAPSHOT_MEMORY_BUDGET_MB', 256))
+# Versões mantidas em disco por mapa (abertas sob demanda, ex.: clientes fixados)
+SNAPSHOT_KEEP_VERSIONS = int(os.environ.get('SNAPSHOT_KEEP_VERSIONS', 5))
+# Bucket do GCS onde o /loadmap publica os snapshots; as demais instâncias baixam
+# as versões ativas (vazio = snapshots só na instância que fez a carga)
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET', '')
+SNAPSHOT_BUCKET_PREFIX = os.environ.get('SNAPSHOT_BUCKET_PREFIX', 'snapshots')
+snapshot_mirror = (GCSSnapshotMirror(storage_client.get, SNAPSHOT_BUCKET, SNAPSHOT_BUCKET_PREFIX)
+                   if SNAPSHOT_BUCKET and GCP_CLIENTS_ENABLED else None)
+snapshot_store = SnapshotStore(SNAPSHOT_DIR, budget=int(SNAPSHOT_MEMORY_BUDGET_MB * 1024 * 1024),
+                               keep_versions=SNAPSHOT_KEEP_VERSIONS, mirror=snapshot_mirror)
+with startup_profile.phase("snapshots"):
+    snapshot_store.load()
+snapshot_store.start_poller(SNAPSHOT_POLL_INTERVAL)
+
+# Índice de regras em memória (Layer 3) - Firestore só em caso de miss.
+# Com snapshots válidos (gravados com o token publicado) o índice não é aquecido
+# a partir do Firestore; uma nova publicação descarta os snapshots anteriores.
+RULE_INDEX_WARM = os.environ.get('RULE_INDEX_WARM', 'true').lower() == 'true'
+RULE_INDEX_POLL_INTERVAL = float(os.environ.get('RULE_INDEX_POLL_INTERVAL', 30.0))
+# Fallback sem metadata pelo campo `lookup_keys` (consulta pontual com limit 1);
+# false volta aos `where` encadeados
+RULE_LOOKUP_KEYS = os.environ.get('RULE_LOOKUP_KEYS', 'true').lower() == 'true'
+# Sem resultado por `lookup_keys`, repete a busca com os `where` encadeados: documentos
+# gravados antes do campo não o têm. auto: só se a visão do cliente tem versões cujo
+# manifesto não marca `lookup_keys`; true: sempre; false: nunca
+RULE_LOOKUP_LEGACY_FALLBACK = os.environ.get('RULE_LOOKUP_LEGACY_FALLBACK', 'auto').lower()
+lookup_keys_versions = LookupKeysVersions()
+# Limite (MB) dos documentos no índice, no mesmo critério dos snapshots: versões frias
+# (não as mais novas de cada mapa) saem do índice e voltam pelo Firestore
+RULE_INDEX_MEMORY_BUDGET_MB = float(os.environ.get('RULE_INDEX_MEMORY_BUDGET_MB', SNAPSHOT_MEMORY_BUDGET_MB))
+rule_index = RuleIndex(budget=int(RULE_INDEX_MEMORY_BUDGET_MB * 1024 * 1024))
+
+# Versão ativa de cada mapa para buscas sem metadata: a mais nova, ou a fixada
+# para o cliente (X-CLIENT-ID) em MAP_PINS_FILE
+map_registry = MapRegistry(rule_index, snapshot_store, load_pins())
+
+def _rules_control_ref(db):
+    return db.collection(RULES_CONTROL_COLLECTION).document(RULES_CONTROL_DOC)
+
+def _rule_index_should_warm():
+    return RULE_INDEX_WARM and not snapshot_store.loaded
+
+def _on_rules_token(token):
+    # nova publicação: snapshots de outro token deixam de valer e os manifestos
+    # dizem quais versões já têm `lookup_keys` (RULE_LOOKUP_LEGACY_FALLBACK=auto)
+    snapshot_store.sync(token)
+    if RULE_LOOKUP_KEYS and RULE_LOOKUP_LEGACY_FALLBACK == 'auto':
+        lookup_keys_versions.reload(get_db())
+
+def _start_rule_index():
+    # em background: criar o cliente do Firestore não atrasa o worker ficar pronto.
+    # A primeira leitura do token já descarta snapshots de publicações anteriores
+    # e baixa do bucket (SNAPSHOT_BUCKET) as versões ativas antes de decidir o aquecimento.
+    db = get_db()
+    if db:
+        try:
+            rule_index.refresh(db, COLLECTION_NAME, _rules_control_ref(db), force=True,
+                               warm=_rule_index_should_warm, on_token=_on_rules_token)
+        except Exception as e:
+            logger.error(f"Erro no warm-up do índice de regras: {e}")
+        rule_index.start_poller(db, COLLECTION_NAME, _rules_control_ref(db), RULE_INDEX_POLL_INTERVAL,
+                                should_warm=_rule_index_should_warm, on_token=_on_rules_token)
+
+if GCP_CLIENTS_ENABLED:
+    threading.Thread(target=_start_rule_index, name="rule-index-start", daemon=True).start()
+
+# Misses do índice: leituras idênticas simultâneas são coalescidas e eventos
+# sem regra ficam em cache negativo (0 desativa)
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 30.0))
+NEGATIVE_CACHE_SIZE = int(os.environ.get('NEGATIVE_CACHE_SIZE', 10000))
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_SIZE)
+schema_flight = SingleFlight()
+
+# Regras compiladas em validadores (tipo/regex/enum), uma vez por documento
+VALIDATOR_CACHE_SIZE = int(os.environ.get('VALIDATOR_CACHE_SIZE', 8192))
+validator_cache = ValidatorCache(VALIDATOR_CACHE_SIZE)
+
+# Store para Deduplicação (Layer 1) - TTL de 2 segundos
+# DEDUP_BACKEND=memory (shards por processo) ou redis (compartilhado entre workers/instâncias)
 DEDUP_TTL = float(os.environ.get('DEDUP_TTL', 2.0))
-DEDUP_MAXSIZE = int(os.environ.get('DEDUP_MAXSIZE', 1000))
-dedup_cache = TTLCache(maxsize=DEDUP_MAXSIZE, ttl=DEDUP_TTL)
-dedup_lock = threading.Lock()
+DEDUP_BACKEND = os.environ.get('DEDUP_BACKEND', 'memory').lower()
+DEDUP_SHARDS = int(os.environ.get('DEDUP_SHARDS', 64))
+DEDUP_REDIS_URL = os.environ.get('DEDUP_REDIS_URL')
+dedup_store = create_dedup_store(DEDUP_BACKEND, DEDUP_TTL, shards=DEDUP_SHARDS, redis_url=DEDUP_REDIS_URL)
+
+# Regras de taxonomia (Layer 2) - compiladas uma vez na inicialização
+with startup_profile.phase("taxonomy"):
+    taxonomy_engine = TaxonomyEngine(load_rules())
+
+# Google MP (Layer 4) - sessão keep-alive compartilhada e pool de threads
+GA4_MP_BASE_URL = os.environ.get('GA4_MP_BASE_URL', 'https://www.google-analytics.com')
+GA4_MP_TIMEOUT = float(os.environ.get('GA4_MP_TIMEOUT', 3.0))
+GA4_MP_MAX_EVENTS = int(os.environ.get('GA4_MP_MAX_EVENTS', MP_MAX_EVENTS))
+GA4_MAX_WORKERS = int(os.environ.get('GA4_MAX_WORKERS', 16))
+ga4_client = GA4Client(GA4_MP_BASE_URL, timeout=GA4_MP_TIMEOUT,
+                       pool_size=GA4_MAX_WORKERS, max_events=GA4_MP_MAX_EVENTS)
+ga4_executor = ThreadPoolExecutor(max_workers=GA4_MAX_WORKERS, thread_name_prefix="ga4")
+# Conexões simultâneas ao GA4 no modo ASGI (asgi.py)
+GA4_ASYNC_POOL_SIZE = int(os.environ.get('GA4_ASYNC_POOL_SIZE', 100))
+
+# Tamanho da janela de eventos processada por vez em /validate/batch
+BATCH_WINDOW_SIZE = int(os.environ.get('BATCH_WINDOW_SIZE', 100))
+
+# Amostragem e descarte de carga das Layers 3 e 4 (ver shedding.py; 0 desativa)
+sampler = Sampler(load_sampling_rules())
+SHED_MAX_INFLIGHT = int(os.environ.get('SHED_MAX_INFLIGHT', 0))
+SHED_DEGRADE_INFLIGHT = int(os.environ.get('SHED_DEGRADE_INFLIGHT', 0))
+SHED_SCHEMA_LATENCY_MS = float(os.environ.get('SHED_SCHEMA_LATENCY_MS', 0))
+SHED_GA4_LATENCY_MS = float(os.environ.get('SHED_GA4_LATENCY_MS', 0))
+SHED_RETRY_AFTER = int(os.environ.get('SHED_RETRY_AFTER', 1))
+load_shedder = LoadShedder(SHED_MAX_INFLIGHT, SHED_DEGRADE_INFLIGHT,
+                           {"schema": SHED_SCHEMA_LATENCY_MS, "google_mp": SHED_GA4_LATENCY_MS},
+                           retry_after=SHED_RETRY_AFTER)
+OVERLOADED = {"error": "Servidor sobrecarregado, tente novamente.", "retry_after": SHED_RETRY_AFTER}
+
+# Gravação dos relatórios em lote, em background (REPORT_SINK=bigquery|ndjson; vazio desativa)
+REPORT_SINK = os.environ.get('REPORT_SINK', '').lower()
+REPORT_SINK_TABLE = os.environ.get('REPORT_SINK_TABLE', "tagging-api-481123.tagging_maps.validation_reports")
+REPORT_SINK_DIR = os.environ.get('REPORT_SINK_DIR', '/tmp/tagging-reports')
+REPORT_SINK_BATCH_SIZE = int(os.environ.get('REPORT_SINK_BATCH_SIZE', 500))
+REPORT_SINK_FLUSH_INTERVAL = float(os.environ.get('REPORT_SINK_FLUSH_INTERVAL', 5.0))
+REPORT_SINK_MAX_QUEUE = int(os.environ.get('REPORT_SINK_MAX_QUEUE', 10000))
+report_sink = create_report_sink(REPORT_SINK, bq_client=get_bq_client, table=REPORT_SINK_TABLE,
+                                 directory=REPORT_SINK_DIR, batch_size=REPORT_SINK_BATCH_SIZE,
+                                 flush_interval=REPORT_SINK_FLUSH_INTERVAL, max_queue=REPORT_SINK_MAX_QUEUE)
+
+# Métricas por layer (/metrics) e bloco `timings` no relatório
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+REPORT_TIMINGS = os.environ.get('REPORT_TIMINGS', 'false').lower() == 'true'
+metrics = Metrics(enabled=METRICS_ENABLED)
+startup_profile.mark("init")
+
+
+@metrics.collector
+def _cache_metrics():
+    index = rule_index.stats()
+    snapshots = snapshot_store.stats()
+    taxonomy = taxonomy_engine.cache_info()
+    samples = [
+        ("cache_hits", "counter", "Consultas atendidas por cache.", [
+            ({"cache": "rule_index"}, index["hits"]),
+            ({"cache": "snapshot"}, snapshot_store.hits),
+            ({"cache": "negative"}, negative_cache.hits),
+            ({"cache": "validators"}, validator_cache.hits),
+            ({"cache": "taxonomy_events"}, taxonomy["events"]["hits"]),
+            ({"cache": "taxonomy_params"}, taxonomy["params"]["hits"]),
+        ]),
+        ("cache_misses", "counter", "Consultas que não estavam em cache.", [
+            ({"cache": "rule_index"}, index["misses"]),
+            ({"cache": "validators"}, validator_cache.misses),
+            ({"cache": "taxonomy_events"}, taxonomy["events"]["misses"]),
+            ({"cache": "taxonomy_params"}, taxonomy["params"]["misses"]),
+        ]),
+        ("schema_lookups_coalesced", "counter", "Buscas de regra que aguardaram uma leitura idêntica em andamento.", [
+            ({}, schema_flight.shared),
+        ]),
+        ("rule_index_documents", "gauge", "Documentos no índice de regras em memória.", [
+            ({}, index["documents"]),
+        ]),
+        ("snapshot_resident_bytes", "gauge", "Tamanho das versões de mapa mapeadas em memória.", [
+            ({}, snapshots["resident_bytes"]),
+        ]),
+        ("snapshot_evictions", "counter", "Versões de mapa fechadas por exceder SNAPSHOT_MEMORY_BUDGET_MB.", [
+            ({}, snapshots["evictions"]),
+        ]),
+        ("rule_index_resident_bytes", "gauge", "Tamanho (JSON) dos documentos no índice de regras em memória.", [
+            ({}, index["resident_bytes"]),
+        ]),
+        ("rule_index_evictions", "counter", "Versões de mapa removidas do índice por exceder RULE_INDEX_MEMORY_BUDGET_MB.", [
+            ({}, index["evictions"]),
+        ]),
+        ("validations_in_flight", "gauge", "Requisições de validação em andamento.", [
+            ({}, load_shedder.inflight),
+        ]),
+        ("requests_rejected", "counter", "Requisições de validação recusadas com 429.", [
+            ({}, load_shedder.rejected),
+        ]),
+        ("layer_latency_ewma_seconds", "gauge", "Latência recente (EWMA) da I/O monitorada pelo descarte de carga.", [
+            ({"layer": layer}, value) for layer, value in sorted(load_shedder.latency().items())
+        ]),
+    ]
+    if report_sink.enabled:
+        samples += [
+            ("reports_recorded", "counter", "Relatórios de validação gravados pelo sink.", [
+                ({"outcome": "written"}, report_sink.written),
+                ({"outcome": "dropped"}, report_sink.dropped),
+                ({"outcome": "failed"}, report_sink.failed),
+            ]),
+            ("report_sink_queue", "gauge", "Relatórios aguardando gravação.", [
+                ({}, report_sink.pending()),
+            ]),
+        ]
+    startup = startup_profile.report()
+    samples.append(("startup_phase_seconds", "gauge", "Tempo de cada fase da inicialização do worker.", [
+        ({"phase": phase}, ms / 1000) for phase, ms in startup["phases"].items()
+    ]))
+    if hasattr(dedup_store, '__len__'):
+        samples.append(("dedup_keys", "gauge", "Chaves ativas no store de deduplicação em memória.", [
+            ({}, len(dedup_store)),
+        ]))
+    return samples
 
 # --- FUNÇÕES AUXILIARES ---
-def fetch_map_from_bigquery(map_id=None, map_version=None):
+def fetch_map_from_bigquery(map_id=None, map_version=None, on_row=None):
     """
     Vai ao BigQuery, busca as regras e transforma em formato Hierárquico (JSON).
-    Se map_id for fornecido, filtra por ele (ex: versão do app ou plataforma).
+    Filtra por `map_id` (ex: versão do app ou plataforma) e por `map_version`;
+    sem `map_version`, usa a versão mais recente do mapa.
+
+    É um gerador de `(doc_id, doc_body)`: as linhas são lidas página a página
+    (BQ_PAGE_SIZE) e transformadas à medida que chegam, sem materializar o mapa.
+    `on_row` (opcional) é chamado a cada linha lida (progresso do job).
     """
 
     if not map_id:
         raise ValueError("map_id é obrigatório para carregar um mapa específico!")
 
-    map_version = f"map_id = '{map_version}'" if isinstance(map_version, int) else 'map_is IS NULL'
-
-    # Query SQL para pegar os dados planos
+    # Query SQL parametrizada para pegar os dados planos
     # Assumindo colunas: event_name, param_name, param_type, regex_pattern, is_required
     query = f"""
         SELECT *
         FROM `{BQ_TABLE}`
-        WHERE {map_id}'
-        AND map_version {map_version}
-        OR map_version = (SELECT MAX(map_version) FROM `{BQ_TABLE}` WHERE map_id = '{map_id}')
-        LIMIT 500
+        WHERE map_id = @map_id
+        AND map_version = COALESCE(
+            @map_version,
+            (SELECT MAX(map_version) FROM `{BQ_TABLE}` WHERE map_id = @map_id)
+        )
     """
+    from google.cloud import bigquery  # só o /loadmap usa; fora do cold start
 
-    query_job = bq_client.query(query)
-    rows = list(query_job.result())
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("map_id", "STRING", str(map_id)),
+        bigquery.ScalarQueryParameter("map_version", "INT64", int(map_version) if map_version is not None else None),
+    ])
+
+    query_job = get_bq_client().query(query, job_config=job_config)
+    rows = query_job.result(page_size=BQ_PAGE_SIZE)
 
     # Transformação: cada linha é 'wide' — tem colunas de metadados + colunas de parâmetros.
-    events_cache = {}
     # chaves que serão mantidas separadas no documento (não entram em `params`)
     meta_keys = {"map_id", "map_version", "event_name"}
-
-    def _slugify(*parts):
-        # cria uma chave legível a partir de partes, sanitizando caracteres
-        raw = "_".join([str(p) for p in parts if p is not None and p != ""])
-        slug = re.sub(r'[^A-Za-z0-9]+', '_', raw)
-        slug = re.sub(r'_+', '_', slug).strip('_')
-        return slug[:200]  # limite de comprimento
+    seen_ids = set()
 
     for row in rows:
+        if on_row:
+            on_row()
+
         # Converte Row para dict
         try:
             row_dict = dict(row)
@@ -104,273 +361,568 @@ def fetch_map_from_bigquery(map_id=None, map_version=None):
             # Fallback: se row não for mapeável diretamente, tente acessar atributos
             row_dict = {k: getattr(row, k, None) for k in dir(row) if not k.startswith("_")}
 
-        map_id = row_dict.get('map_id')
-        map_version = row_dict.get('map_version')
+        row_map_id = row_dict.get('map_id')
+        row_map_version = row_dict.get('map_version')
         evt = row_dict.get("event_name")
-        page_path = row_dict.get('page_path')
-        title = row_dict.get('title')
-        section = row_dict.get('section')
-        label = row_dict.get('label')
 
-        if not evt or not map_id or not map_version:
+        if not evt or not row_map_id or not row_map_version:
             logger.warning("Linha com metadados incompletos ignorada: %s", row_dict)
             continue
 
         # Remova apenas os metadados (map_id/map_version/event_name); mantenha page_path/title/section/label em params
         params = {k: v for k, v in row_dict.items() if k not in meta_keys and v is not None}
 
-        # Definir uma chave única composta (usa alguns campos também presentes em params)
-        if evt.lower() in ('page_view', 'pageview', 'page_view_event'):
-            unique_part = title or page_path or ''
-        else:
-            unique_part = (section or '') + '_' + (label or '')
+        # Chave única composta (mesma do validador, ver rule_keys.py)
+        doc_id = row_doc_id(row_dict)
 
-        doc_id = _slugify(map_id, map_version, evt, page_path or '', unique_part)
+        # Um documento só pode ser escrito uma vez por carga
+        if doc_id in seen_ids:
+            logger.warning("doc_id duplicado ignorado: %s", doc_id)
+            continue
+        seen_ids.add(doc_id)
 
         doc_body = {
             "metadata": {
-                "map_id": map_id,
-                "map_version": map_version
+                "map_id": row_map_id,
+                "map_version": row_map_version
             },
             "event_name": evt,
             "params": params
         }
 
-        events_cache[doc_id] = doc_body
-
-    return events_cache
+        yield doc_id, doc_body
 
-def update_firestore_cache(events_data, map_id=None, map_version=None):
+def update_firestore_cache(events_data, map_id=None, map_version=None, progress=None, on_phase=None,
+                           incremental=False):
     """
-    Grava os dados transformados no Firestore em lote (Batch).
+    Grava os dados transformados no Firestore em lote (BulkCommitter).
+    `events_data` é um iterável de `(doc_id, doc_body)` (ex: o gerador de
+    `fetch_map_from_bigquery`) ou um dicionário `{doc_id: doc_body}`.
     Se map_id e map_version forem fornecidos, remove os documentos antigos
-    que correspondem a essa versão antes de inserir os novos.
-    """
-    batch = db.batch()
-    count = 0
-
-    # Se map_id e map_version foram fornecidos, deleta os docs antigos dessa versão
-    if map_id and map_version:
-        query = db.collection(COLLECTION_NAME).where('metadata.map_id', '==', map_id).where('metadata.map_version', '==', map_version)
-        old_docs = list(query.stream())
-        for doc in old_docs:
-            batch.delete(doc.reference)
-            count += 1
-            if count >= 400:
-                batch.commit()
-                batch = db.batch()
-                count = 0
-    
-    # Insere os novos documentos
-    for event_name, rules in events_data.items():
-        doc_ref = db.collection(COLLECTION_NAME).document(event_name)
-        batch.set(doc_ref, rules)
-        count += 1
-        
-        # Firestore batch tem limite de 500 operações. Commit e reinicia se necessário.
-        if count >= 400: 
-            batch.commit()
-            batch = db.batch()
-            count = 0
-            
-    if count > 0:
-        batch.commit()
+    que correspondem a essa versão antes de inserir os novos e grava o
+    manifesto de hashes da versão.
+
+    Com `incremental=True`, compara o hash de cada documento com o manifesto
+    e grava apenas os novos/alterados, removendo os que saíram do mapa. Sem
+    manifesto para a versão, cai no modo completo.
+
+    `progress` (opcional) recebe as estatísticas a cada batch gravado e
+    `on_phase` (opcional) é chamado na troca de fase ('deleting'/'writing').
+    Retorna as estatísticas (`written`, `deleted`, `batches`, `retries`,
+    `errors`, `mode`, `added`, `changed`, `removed`, `unchanged`).
+    """
+    from firestore_writer import iter_documents
+
+    if isinstance(events_data, dict):
+        events_data = events_data.items()
+
+    db = get_db()
+    has_manifest = bool(map_id and map_version)
+    previous = load_manifest(db, map_id, map_version) if incremental and has_manifest else None
+    if incremental and previous is None:
+        logger.info("Sem manifesto para %s/%s; carga completa.", map_id, map_version)
+        incremental = False
+
+    counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    hashes = {}
+    collection = db.collection(COLLECTION_NAME)
+    with _bulk_committer(progress) as writer:
+        # Se map_id e map_version foram fornecidos, deleta os docs antigos dessa versão
+        if has_manifest and not incremental:
+            if on_phase:
+                on_phase('deleting')
+            # sem manifesto até o fim da carga: se ela falhar, a próxima também é completa
+            delete_manifest(db, map_id, map_version)
+            query = collection.where('metadata.map_id', '==', map_id).where('metadata.map_version', '==', map_version)
+            for doc in iter_documents(query.select(['__name__'])):
+                writer.delete(doc.reference)
+            # as exclusões terminam antes das escritas (mesmos doc_ids)
+            writer.drain()
+
+        # Insere os novos documentos (no modo incremental, só os novos/alterados)
+        if on_phase:
+            on_phase('writing')
+        for doc_id, rules in events_data:
+            # hashes da busca sem metadata (ver rule_index.doc_lookup_keys); entram
+            # no hash do conteúdo, então a próxima carga também regrava documentos antigos
+            rules = dict(rules, **{LOOKUP_KEYS_FIELD: doc_lookup_keys(rules)})
+            digest = content_hash(rules)
+            hashes[doc_id] = digest
+            if incremental:
+                old = previous.get(doc_id)
+                if old == digest:
+                    counts["unchanged"] += 1
+                    continue
+                counts["added" if old is None else "changed"] += 1
+            else:
+                counts["added"] += 1
+            writer.set(collection.document(doc_id), rules)
+
+        # Remove documentos que saíram do mapa
+        if incremental:
+            for doc_id in previous.keys() - hashes.keys():
+                writer.delete(collection.document(doc_id))
+                counts["removed"] += 1
+
+    if has_manifest:
+        save_manifest(db, map_id, map_version, hashes)
+        lookup_keys_versions.add(map_id, map_version)
+
+    stats = dict(writer.stats, mode="incremental" if incremental else "full", **counts)
+    return stats
+
+def _bulk_committer(progress=None):
+    from firestore_writer import BulkCommitter  # importa google.api_core; só para cargas/limpezas
+
+    return BulkCommitter(get_db(), batch_size=FIRESTORE_BATCH_SIZE, concurrency=FIRESTORE_WRITE_CONCURRENCY,
+                         max_retries=FIRESTORE_MAX_RETRIES, progress=progress)
+
+
+def _log_write_progress(stats):
+    if stats["batches"] % 25 == 0:
+        logger.info("Firestore: %s gravados, %s removidos (%s batches, %s retries)",
+                    stats["written"], stats["deleted"], stats["batches"], stats["retries"])
+
 # --- FUNÇÕES DE VALIDAÇÃO (LAYERS) ---
 
-def validate_deduplication(raw_payload, payload=None):
+def validate_deduplication(raw_payload, payload=None, client_id=None):
     """Layer 1: Verifica hash do payload para evitar duplicidade imediata.
 
-    Suporte por 'session' / 'client': o cache usa uma chave composta por
-    `client_id:event_hash` quando `client_id` for fornecido no `payload` ou no
+    Suporte por 'session' / 'client': o store usa uma chave composta por
+    `client_id:payload` quando `client_id` for fornecido no `payload` ou no
     header `X-CLIENT-ID`. Caso contrário usa uma chave global.
 
-    - `raw_payload`: string bruta do request (usada para o hash)
+    - `raw_payload`: corpo bruto do request, em bytes (usado para o hash; `str` também é aceito)
     - `payload`: dicionário JSON já parseado (opcional)
+    - `client_id`: header `X-CLIENT-ID` já extraído (fora do contexto do Flask)
     """
     if not raw_payload:
         return None
 
-    # calcula o hash do payload
-    event_hash = hashlib.md5(raw_payload.encode('utf-8')).hexdigest()
+    client_id = event_client_id(payload, client_id)
+
+    # o store reduz a chave a um digest de 16 bytes
+    if isinstance(raw_payload, str):
+        raw_payload = raw_payload.encode('utf-8')
+    key = f"{client_id or 'global'}:".encode('utf-8') + raw_payload
+
+    if dedup_store.seen(key):
+        return {
+            "status": "ERROR",
+            "layer": "Deduplication",
+            "message": "Evento duplicado detectado em curto intervalo."
+        }
 
-    # tenta extrair client_id do payload ou do header
-    client_id = None
-    if payload and isinstance(payload, dict):
-        client_id = payload.get('client_id')
-    if not client_id:
+    return None
+
+def event_client_id(payload, client_id=None):
+    """`client_id` do evento: do `payload`, do argumento ou do header `X-CLIENT-ID`."""
+    if payload and isinstance(payload, dict) and payload.get('client_id'):
+        return payload.get('client_id')
+    if not client_id and has_request_context():
         client_id = request.headers.get('X-CLIENT-ID')
+    return client_id
 
-    key = f"{client_id or 'global'}:{event_hash}"
+def validate_taxonomy(payload):
+    """Layer 2: Verifica padrões de nomenclatura (snake_case, prefixos, limites do GA4).
 
-    # Acesso ao cache protegido por lock (cachetools.TTLCache não é thread-safe)
-    with dedup_lock:
-        if key in dedup_cache:
-            return {
-                "status": "ERROR",
-                "layer": "Deduplication",
-                "message": "Evento duplicado detectado em curto intervalo."
-            }
-        dedup_cache[key] = True
+    Recebe o `payload` completo (contendo `event_name` e `params`). As regras
+    ficam em `taxonomy_engine` (ver `taxonomy.py`).
+    """
+    event_name = payload.get('event_name')
+    params = payload.get('params', {}) or {}
+    issues = taxonomy_engine.validate(event_name, params)
 
+    if issues:
+        return {"status": "ERROR", "layer": "Taxonomy", "issues": issues}
     return None
 
-def validate_taxonomy(payload):
-    """Layer 2: Verifica padrões de nomenclatura (snake_case, prefixos).
+def _schema_lookup_key(payload, client_id=None):
+    """Chave que identifica a busca de regra de um evento: `(tipo, chave, versões)`.
 
-    Recebe o `payload` completo (contendo `event_name` e `params`).
+    Com metadata a chave é o doc_id e a versão é a do próprio evento; sem
+    metadata são os filtros e as versões que o cliente enxerga (`map_registry`).
     """
     event_name = payload.get('event_name')
     params = payload.get('params', {}) or {}
-    issues = []
+    metadata = payload.get('metadata') or {}
+
+    # Se metadata contém map_id/map_version, compõe o doc_id igual ao loader
+    if metadata and metadata.get('map_id') and metadata.get('map_version'):
+        return ('doc_id', metadata_doc_id(event_name, metadata),
+                map_scope(metadata.get('map_id'), metadata.get('map_version')))
+
+    return ('query', lookup_tuple(event_name, params), map_registry.view(event_client_id(payload, client_id)))
 
-    if not event_name or not re.match(r'^[a-z0-9_]+$', event_name):
-        issues.append(f"Nome do evento '{event_name}' deve ser snake_case.")
 
-    for param in params.keys():
-        if param.startswith(('ga_', 'google_', 'firebase_')):
-            issues.append(f"Parâmetro '{param}' usa prefixo reservado proibido.")
-        if not re.match(r'^[a-z0-9_]+$', param):
-            issues.append(f"Parâmetro '{param}' deve ser snake_case.")
+_FIRESTORE_OFFLINE = {"status": "SKIPPED", "message": "🔴 Firestore indisponível (Erro de conexão)"}
+
+
+def _not_documented(kind, event_name):
+    context = "para este contexto" if kind == 'doc_id' else "no mapa de coleta"
+    return {
+        "status": "WARNING",
+        "layer": "Schema",
+        "message": f"⚠️ Evento '{event_name}' não documentado {context}."
+    }
+
+
+def _rule_from_memory(kind, key, scope, event_name, params):
+    """Busca a regra no índice em memória e no snapshot local (sem I/O de rede).
+
+    `scope` é a versão do evento (`doc_id`) ou as versões visíveis (`query`).
+    """
+    if kind == 'doc_id':
+        doc_dict = rule_index.get(key)
+        if doc_dict is None:
+            doc_dict = snapshot_store.get(key, *scope)
+        return doc_dict
 
+    doc_dict = rule_index.find(event_name, params, scope)
+    if doc_dict is None:
+        found = snapshot_store.find(event_name, params, scope)
+        if found is not None:
+            doc_dict = found[1]
+    return doc_dict
+
+
+def _rule_query(collection, event_name, params):
+    """Busca completa por event_name e filtros extra (params) — semelhante ao loader.
+
+    Usada com RULE_LOOKUP_KEYS=false e como fallback para documentos sem `lookup_keys`.
+    Aceita a coleção do cliente síncrono ou do `AsyncClient` (mesma API de query).
+    """
+    query = collection.where('event_name', '==', event_name)
+    # aplicar filtros em campos comuns armazenados dentro de 'params'
+    if params.get('page_path'):
+        query = query.where('params.page_path', '==', params.get('page_path'))
+    if params.get('title'):
+        query = query.where('params.title', '==', params.get('title'))
+    if params.get('section'):
+        query = query.where('params.section', '==', params.get('section'))
+    if params.get('label'):
+        query = query.where('params.label', '==', params.get('label'))
+    return query
+
+
+# Limites do Firestore: valores por `array_contains_any` e por `not-in`
+_LOOKUP_KEYS_PER_QUERY = 30
+_NOT_IN_MAX = 10
+
+
+def _rule_lookup_queries(collection, lookup, view):
+    """Busca sem metadata pelo campo `lookup_keys`: consultas pontuais (limit 1).
+
+    A primeira lista traz uma consulta por até 30 versões da visão do cliente
+    (menor doc_id); a segunda consulta, usada só se nenhuma delas achar, cobre
+    mapas ainda desconhecidos em memória: versão mais nova do primeiro mapa
+    (por map_id) fora da visão (índice composto em firestore.indexes.json).
+    Aceita a coleção do cliente síncrono ou do `AsyncClient`.
+    """
+    keys = [lookup_hash(lookup, scope) for scope in view]
+    scoped = [collection.where(LOOKUP_KEYS_FIELD, 'array_contains_any', keys[start:start + _LOOKUP_KEYS_PER_QUERY])
+              .order_by('__name__').limit(1)
+              for start in range(0, len(keys), _LOOKUP_KEYS_PER_QUERY)]
+    unknown = collection.where(LOOKUP_KEYS_FIELD, 'array_contains', lookup_hash(lookup))
+    map_ids = sorted({map_id for map_id, _ in view})
+    if 0 < len(map_ids) <= _NOT_IN_MAX:
+        unknown = unknown.where('metadata.map_id', 'not-in', map_ids)
+    unknown = (unknown.order_by('metadata.map_id').order_by('metadata.map_version', direction='DESCENDING')
+               .order_by('__name__').limit(1))
+    return scoped, unknown
+
+
+def _use_rule_query(view):
+    """Busca por `where` encadeados: sem `lookup_keys` ou como fallback de documentos antigos.
+
+    Em `auto`, o fallback só roda se alguma versão da `view` não foi gravada com
+    `lookup_keys` (ou a visão está vazia, com mapas ainda desconhecidos).
+    """
+    if not RULE_LOOKUP_KEYS or RULE_LOOKUP_LEGACY_FALLBACK == 'true':
+        return True
+    if RULE_LOOKUP_LEGACY_FALLBACK == 'false':
+        return False
+    return not lookup_keys_versions.covers(view)
+
+
+def _pick_lookup(found, unknown, view):
+    """Resultado das consultas de `_rule_lookup_queries`: `(doc_id, doc)` ou None."""
+    if found:
+        return min(found, key=lambda item: item[0])
+    # a versão mais nova só vale para mapas fora da visão (os demais já foram consultados)
+    if unknown is not None and doc_scope(unknown[1])[0] not in dict(view):
+        return unknown
+    return None
+
+
+def _lookup_rule(collection, lookup, view):
+    scoped, unknown = _rule_lookup_queries(collection, lookup, view)
+    found = [(doc.id, doc.to_dict()) for query in scoped for doc in query.stream()]
+    if found:
+        return _pick_lookup(found, None, view)
+    return _pick_lookup([], next(((doc.id, doc.to_dict()) for doc in unknown.stream()), None), view)
+
+
+def _resolve_rule(payload, lookup_key):
+    """Busca o documento de regra: índice em memória e, em caso de miss, Firestore.
+
+    Buscas idênticas simultâneas compartilham uma única leitura no Firestore
+    (`schema_flight`) e buscas sem regra ficam no cache negativo por
+    NEGATIVE_CACHE_TTL segundos.
+    Retorna `(doc_dict, None)` ou `(None, resultado)` quando não há regra.
+    """
+    event_name = payload.get('event_name')
+    params = payload.get('params', {}) or {}
+    kind, key, scope = lookup_key
+
+    # versão capturada antes do miss: se o índice for invalidado durante a
+    # leitura no Firestore, o documento não é reinserido
+    index_version = rule_index.version
+
+    doc_dict = _rule_from_memory(kind, key, scope, event_name, params)
+    if doc_dict is not None:
+        return doc_dict, None
+    if not get_db():
+        return None, dict(_FIRESTORE_OFFLINE)
+
+    flight_key = (index_version, lookup_key)
+    try:
+        hash(flight_key)
+    except TypeError:
+        flight_key = None
+
+    if flight_key is not None and negative_cache.get(flight_key):
+        return None, _not_documented(kind, event_name)
+    shed = _shed_schema_read()
+    if shed:
+        return None, shed
+    if flight_key is None:
+        # filtros não hasheáveis: leitura direta, sem coalescência
+        return _read_rule(kind, key, scope, event_name, params, index_version)
+    return schema_flight.do(
+        flight_key, lambda: _read_rule(kind, key, scope, event_name, params, index_version, flight_key))
+
+
+def _shed_schema_read():
+    """Resultado SKIPPED quando a carga atual não permite ler a regra no Firestore."""
+    reason = load_shedder.skip_reason("schema")
+    if reason:
+        return {"status": "SKIPPED", "layer": "Schema",
+                "message": f"Regra fora da memória; Firestore não consultado. {reason}"}
+    return None
+
+
+def _read_rule(kind, key, scope, event_name, params, index_version, negative_key=None):
+    """Lê a regra no Firestore; o resultado vai para o índice (ou para o cache negativo)."""
+    db = get_db()
+    with load_shedder.measure("schema"):
+        if kind == 'doc_id':
+            doc = db.collection(COLLECTION_NAME).document(key).get()
+            if not doc.exists:
+                doc_id = doc_dict = None
+            else:
+                doc_id, doc_dict = key, doc.to_dict()
+        else:
+            collection = db.collection(COLLECTION_NAME)
+            found = _lookup_rule(collection, key, scope) if RULE_LOOKUP_KEYS else None
+            if found is None and _use_rule_query(scope):
+                docs = [(doc.id, doc.to_dict()) for doc in _rule_query(collection, event_name, params).stream()]
+                # primeiro documento (por doc_id) da versão de mapa que vale para o cliente
+                found = map_registry.pick(docs, scope)
+            doc_id, doc_dict = found or (None, None)
+
+    if doc_dict is None:
+        if negative_key is not None:
+            negative_cache.put(negative_key, True)
+        return None, _not_documented(kind, event_name)
+
+    rule_index.put(doc_id, doc_dict, index_version)
+    return doc_dict, None
+
+
+def check_params(doc_dict, params):
+    """Valida os `params` recebidos com o validador compilado da regra (ver validators.py)."""
+    issues = validator_cache.get(doc_dict).validate(params)
     if issues:
-        return {"status": "ERROR", "layer": "Taxonomy", "issues": issues}
+        return {"status": "ERROR", "layer": "Schema", "issues": issues}
     return None
 
-def validate_schema(payload):
+
+def validate_schema(payload, lookups=None):
     """Layer 3: Valida contra regras do Firestore.
 
     Recebe o `payload` completo e usa `metadata` (se presente) para buscar o
     documento de forma precisa; caso contrário realiza uma busca baseada em
     `event_name` e possíveis campos presentes dentro de `params`.
-    """
-    if not db:
-        return {"status": "SKIPPED", "message": "🔴 Firestore indisponível (Erro de conexão)"}
 
+    As regras são lidas primeiro do índice em memória (`rule_index`) e do
+    snapshot local (`snapshot_store`); o Firestore só é consultado em caso de
+    miss e o resultado volta ao índice. Os `params` são conferidos pelo
+    validador compilado da regra (igualdade, tipo, regex e enum).
+    `lookups` (opcional) é um dicionário compartilhado entre eventos de um
+    mesmo lote para reaproveitar buscas idênticas.
+    """
     try:
-        event_name = payload.get('event_name')
         params = payload.get('params', {}) or {}
-        metadata = payload.get('metadata') or {}
-
-        doc_dict = None
-
-        # Se metadata contém map_id/map_version, compõe o doc_id igual ao loader
-        if metadata and metadata.get('map_id') and metadata.get('map_version'):
-            map_id = metadata.get('map_id')
-            map_version = metadata.get('map_version')
-            page_path = metadata.get('page_path')
-            title = metadata.get('title')
-            section = metadata.get('section')
-            label = metadata.get('label')
-            outbound = metadata.get('outbound')
-
-            def _slugify(*parts):
-                raw = "_".join([str(p) for p in parts if p is not None and p != ""])
-                slug = re.sub(r'[^A-Za-z0-9]+', '_', raw)
-                slug = re.sub(r'_+', '_', slug).strip('_')
-                return slug[:200]
-
-            if event_name and event_name.lower() in ('page_view', 'pageview', 'page_view_event'):
-                unique_part = title or page_path or ''
-            else:
-                unique_part = (section or '') + '_' + (label or '') + ('_' + (outbound or '') if outbound else '')
-
-            doc_id = _slugify(map_id, map_version, event_name, page_path or '', unique_part)
-            doc_ref = db.collection(COLLECTION_NAME).document(doc_id)
-            doc = doc_ref.get()
+        lookup_key = _schema_lookup_key(payload)
 
-            if doc.exists:
-                doc_dict = doc.to_dict()
-            else:
-                return {
-                    "status": "WARNING",
-                    "layer": "Schema",
-                    "message": f"⚠️ Evento '{event_name}' não documentado para este contexto."
-                }
-        else:
-            # Busca completa por event_name e filtros extra (params) — semelhante ao loader
-            query = db.collection(COLLECTION_NAME).where('event_name', '==', event_name)
-            # aplicar filtros em campos comuns armazenados dentro de 'params'
-            
-            
-            if params.get('page_path'):
-                query = query.where('params.page_path', '==', params.get('page_path'))
-            if params.get('title'):
-                query = query.where('params.title', '==', params.get('title'))
-            if params.get('section'):
-                query = query.where('params.section', '==', params.get('section'))
-            if params.get('label'):
-                query = query.where('params.label', '==', params.get('label'))
-
-            docs = list(query.stream())
-            if not docs:
-                return {
-                    "status": "WARNING",
-                    "layer": "Schema",
-                    "message": f"⚠️ Evento '{event_name}' não documentado no mapa de coleta."
-                }
-
-            # usa o primeiro documento que corresponde aos filtros
-            doc_dict = docs[0].to_dict()
-
-        expected_params = doc_dict.get('params', {})
-        issues = []
-
-        for key, value in expected_params.items():
-            if key not in params:
-                issues.append(f"Parâmetro esperado ausente: {key}")
-                continue
-
-            if params.get(key) != value:
-                issues.append(f"Valor de '{key}' inválido. Esperado: {value}, recebido: {params.get(key)}")
-
-        if issues:
-            return {"status": "ERROR", "layer": "Schema", "issues": issues}
-        return None
+        try:
+            resolved = lookups.get(lookup_key) if lookups is not None else None
+        except TypeError:
+            # filtros não hasheáveis: sem compartilhamento
+            lookups = None
+            resolved = None
+        if resolved is None:
+            resolved = _resolve_rule(payload, lookup_key)
+            # descarte por carga é momentâneo: não vale para o resto do lote
+            if lookups is not None and (resolved[0] is not None or resolved[1].get('status') != 'SKIPPED'):
+                lookups[lookup_key] = resolved
+
+        doc_dict, result = resolved
+        if doc_dict is None:
+            return result
+        return check_params(doc_dict, params)
 
     except Exception as e:
         logger.error(f"Erro ao ler Firestore: {e}")
         return {"status": "ERROR", "layer": "Schema", "message": str(e)}
 
+_GA4_SKIPPED = {"status": "SKIPPED", "layer": "Google Protocol", "message": "Sem credenciais GA4."}
+
+
 def validate_google_mp(payload):
     """Layer 4: Envia para Google Analytics Debug Protocol."""
     meas_id = payload.get('measurement_id')
     api_secret = payload.get('api_secret')
-    
+
     if not meas_id or not api_secret:
-        return {"status": "SKIPPED", "layer": "Google Protocol", "message": "Sem credenciais GA4."}
-
-    ga4_payload = {
-        "client_id": payload.get("client_id", "test_user"),
-        "timestamp_micros": payload.get("timestamp_micros"),
-        "events": [{
-            "name": payload.get("event_name"),
-            "params": payload.get("params", {})
-        }]
-    }
+        return dict(_GA4_SKIPPED)
+
+    with load_shedder.measure("google_mp"):
+        return ga4_client.validate_chunk([payload])[0]
+
+
+def validate_google_mp_batch(payloads, timings=None):
+    """Layer 4 em lote: agrupa eventos por credenciais em chamadas de até GA4_MP_MAX_EVENTS.
 
-    url = f"https://www.google-analytics.com/debug/mp/collect?measurement_id={meas_id}&api_secret={api_secret}"
-    
+    As chamadas são disparadas em paralelo no pool `ga4_executor`. Retorna um
+    objeto por evento com `.result()` (mesmo contrato de um Future).
+    `timings` (opcional) traz um dicionário por evento, que recebe a duração
+    da chamada em que o evento foi enviado.
+    """
+    slots = [_GA4Slot(None, None) for _ in payloads]
+    for positions, chunk in ga4_client.plan(payloads):
+        chunk_timings = [timings[pos] for pos in positions if timings[pos] is not None] if timings else None
+        future = ga4_executor.submit(_validate_ga4_chunk, chunk, chunk_timings)
+        for offset, pos in enumerate(positions):
+            slots[pos] = _GA4Slot(future, offset)
+    return slots
+
+
+def _validate_ga4_chunk(chunk, timings=None):
+    start = time.perf_counter()
+    results = ga4_client.validate_chunk(chunk)
+    elapsed = time.perf_counter() - start
+    metrics.observe("google_mp", elapsed)
+    load_shedder.observe("google_mp", elapsed)
+    for report_timings in timings or ():
+        report_timings["google_mp"] = round(elapsed * 1000, 3)
+    return results
+
+
+class _GA4Slot:
+    """Resultado de um evento dentro de uma chamada em lote ao GA4."""
+    __slots__ = ('future', 'offset')
+
+    def __init__(self, future, offset):
+        self.future = future
+        self.offset = offset
+
+    def result(self):
+        if self.future is None:
+            return dict(_GA4_SKIPPED)
+        return self.future.result()[self.offset]
+
+
+class _SkippedLayer:
+    """Layer 4 não executada (amostragem ou carga): `.result()` devolve o SKIPPED."""
+    __slots__ = ('skipped',)
+
+    def __init__(self, skipped):
+        self.skipped = skipped
+
+    def result(self):
+        return self.skipped
+
+
+def skipped_layers(raw_payload, payload, client_id=None):
+    """Resultados SKIPPED das Layers 3 e 4 que o evento não executa.
+
+    A amostragem (`sampler`) vale para as duas layers; o descarte por carga
+    (`load_shedder`) pula o GA4 aqui e restringe o Schema às regras em
+    memória em `_resolve_rule`.
+    """
+    client_id = event_client_id(payload, client_id)
+    event_name = payload.get('event_name')
+
+    skipped = {}
+    if sampler.enabled:
+        for layer, name in (("schema", "Schema"), ("google_mp", "Google Protocol")):
+            reason = sampler.skip_reason(layer, raw_payload, event_name, client_id)
+            if reason:
+                skipped[layer] = {"status": "SKIPPED", "layer": name, "message": reason}
+    if "google_mp" not in skipped and payload.get('measurement_id') and payload.get('api_secret'):
+        reason = load_shedder.skip_reason("google_mp")
+        if reason:
+            skipped["google_mp"] = {"status": "SKIPPED", "layer": "Google Protocol", "message": reason}
+    return skipped
+
+
+def submit_google_mp(payload, timings=None):
+    """Dispara a Layer 4 em background para rodar em paralelo com a Layer 3."""
+    if not payload.get('measurement_id') or not payload.get('api_secret'):
+        return _GA4Slot(None, None)
+    return ga4_executor.submit(timed_layer, "google_mp", validate_google_mp, payload, timings=timings)
+
+
+def timed_layer(layer, fn, *args, timings=None):
+    """Executa uma layer medindo a duração (métricas e bloco `timings` do relatório).
+
+    Sem métricas e sem `timings` é uma chamada direta.
+    """
+    if not metrics.enabled and timings is None:
+        return fn(*args)
+    start = time.perf_counter()
     try:
-        response = requests.post(url, json=ga4_payload, timeout=3)
-        # O endpoint de debug retorna 200 mesmo com erros de validação no corpo
-        if response.status_code == 200:
-            google_resp = response.json()
-            validation_messages = google_resp.get('validationMessages', [])
-            if validation_messages:
-                return {
-                    "status": "ERROR", 
-                    "layer": "Google Protocol", 
-                    "google_feedback": validation_messages
-                }
-        else:
-             return {"status": "ERROR", "layer": "Google Protocol", "message": f"⚠️ sHTTP {response.status_code}"}
-        
-    except Exception as e:
-        return {"status": "ERROR", "layer": "Google Protocol", "message": str(e)}
+        return fn(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(layer, elapsed)
+        if timings is not None:
+            timings[layer] = round(elapsed * 1000, 3)
+
+# --- ENDPOINTS ---
+
+_SHED_ENDPOINTS = frozenset(('validate', 'validate_batch'))
+
 
+@app.before_request
+def _admit_validation():
+    """Recusa validações com 429 quando já há SHED_MAX_INFLIGHT em andamento."""
+    if request.method != 'POST' or request.endpoint not in _SHED_ENDPOINTS:
+        return None
+    if not load_shedder.try_acquire():
+        return jsonify(OVERLOADED), 429, {"Retry-After": str(SHED_RETRY_AFTER)}
+    g.shed_slot = True
     return None
 
-# --- ENDPOINTS ---
+
+@app.teardown_request
+def _release_validation(exc):
+    # no /validate/batch roda ao fim do streaming (stream_with_context)
+    if g.pop('shed_slot', False):
+        load_shedder.release()
+
 
 @app.route('/', methods=['GET'])
 def health_check():
@@ -382,83 +934,235 @@ def health_check():
         "docs": "/apidocs"
     }), 200
 
+def run_map_load(job):
+    """Executa a carga de um mapa (BigQuery -> Firestore) atualizando o `job`."""
+    logger.info(f"Iniciando refresh do mapa. Map ID: {job.map_id}, versão: {job.map_version or 'mais recente'} (job {job.job_id})")
+
+    def _on_row():
+        job.rows_read += 1
+
+    def _on_progress(stats):
+        job.docs_written = stats["written"]
+        job.docs_deleted = stats["deleted"]
+        job.retries = stats["retries"]
+        _log_write_progress(stats)
+        load_jobs.save(job)
+
+    # 1. Busca e Transforma (gerador: as linhas vão direto para o Firestore)
+    load_jobs.set_phase(job, 'fetching')
+    events_data = fetch_map_from_bigquery(job.map_id, job.map_version, on_row=_on_row)
+    first = next(events_data, None)
+
+    if first is None:
+        job.status = 'EMPTY'
+        job.errors.append("Nenhum dado encontrado no BigQuery.")
+        return
+
+    # Extrai map_version do primeiro documento (todos têm a mesma versão após fetch)
+    job.map_version = first[1].get('metadata', {}).get('map_version')
+
+    # 2. Atualiza Cache (remove antigos do mesmo map_id/map_version e insere novos)
+    # e grava o snapshot local com os mesmos documentos
+    events_data = itertools.chain([first], events_data)
+    writer = snapshot_store.writer(job.map_id, job.map_version) if SNAPSHOT_DIR else None
+    try:
+        stats = update_firestore_cache(writer.tee(events_data) if writer else events_data,
+                                       map_id=job.map_id, map_version=job.map_version,
+                                       progress=_on_progress,
+                                       on_phase=lambda phase: load_jobs.set_phase(job, phase),
+                                       incremental=job.mode == 'incremental')
+    except Exception:
+        if writer:
+            writer.abort()
+        raise
+    job.docs_written = stats["written"]
+    job.docs_deleted = stats["deleted"]
+    job.retries = stats["retries"]
+    job.mode = stats["mode"]
+    job.changes = {key: stats[key] for key in ("added", "changed", "removed", "unchanged")}
+    unchanged = job.mode == 'incremental' and not (stats["added"] or stats["changed"] or stats["removed"])
+
+    # O snapshot leva o token da publicação desta carga (sem alterações, o token atual)
+    token = rule_index.token if unchanged else new_token()
+    if writer:
+        writer.commit(token)
+        snapshot_store.load()
+
+    if unchanged:
+        logger.info("Mapa %s/%s sem alterações; índice mantido.", job.map_id, job.map_version)
+        return
+
+    # 3. Invalida o índice em memória (e nos demais workers/instâncias via token;
+    # lá os snapshots anteriores deixam de valer) e re-aquece
+    load_jobs.set_phase(job, 'publishing')
+    db = get_db()
+    rule_index.publish(_rules_control_ref(db), token)
+    snapshot_store.sync(token)
+    if _rule_index_should_warm():
+        rule_index.warm_async(db, COLLECTION_NAME, _rules_control_ref(db))
+
+
+def _persist_job(status):
+    """Espelha o status do job no Firestore para o polling em outras instâncias."""
+    db = get_db()
+    if db:
+        db.collection(LOADMAP_JOBS_COLLECTION).document(status["job_id"]).set(status)
+
+
+load_jobs = JobRegistry(max_workers=LOADMAP_MAX_JOBS, persist=_persist_job)
+
+
+def _parse_map_version(value):
+    """`map_version` do corpo do /loadmap: inteiro ou ausente (None = mais recente).
+
+    Levanta ValueError para qualquer outro valor (ex.: "v2", "2.1", true), que o
+    job só descobriria ao montar a consulta do BigQuery.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise ValueError(value)
+
+
 @app.route('/loadmap', methods=['POST'])
 def refresh_rules():
     """
-    Cold Start: Carrega regras do BigQuery para o Firestore
+    Cold Start: Enfileira a carga de regras do BigQuery para o Firestore
     ---
     tags:
       - Carregar mapa
     parameters:
       - name: body
         in: body
-        required: false
+        required: true
         schema:
           type: object
           properties:
             map_id:
               type: string
-              description: "Versão específica do mapa a carregar (opcional)"
-              example: "v1.0"
+              description: "Mapa a carregar"
+              example: "00001"
+            map_version:
+              type: integer
+              description: "Versão específica do mapa (opcional, padrão: a mais recente)"
+              example: 3
+            mode:
+              type: string
+              enum: ["incremental", "full"]
+              description: "incremental: grava só documentos novos/alterados e remove os que saíram (padrão); full: apaga e regrava a versão"
+              example: "incremental"
           example:
-            map_id: "v1.0"
+            map_id: "00001"
     responses:
-      200:
-        description: Cache atualizado com sucesso
+      202:
+        description: Job de carga criado (ou já em andamento para o mesmo map_id, map_version e mode)
         schema:
           type: object
           properties:
             status:
               type: string
-              example: "SUCCESS"
-            message:
+              example: "ACCEPTED"
+            job_id:
               type: string
-              example: "Cache atualizado com 42 eventos."
-            mode:
+              example: "3f2c9a..."
+            status_url:
               type: string
-              example: "COLD_START_COMPLETE"
-      404:
-        description: Nenhum dado encontrado
+              example: "/loadmap/3f2c9a..."
+            deduplicated:
+              type: boolean
+              description: "true se a requisição foi anexada a um job já em andamento"
+      400:
+        description: map_id ausente, mode inválido ou map_version não inteiro
+      409:
+        description: "Carga do mesmo map_id em andamento com outro map_version/mode (`running` traz os parâmetros dela)"
       500:
         description: Erro na inicialização ou processamento
     """
-    if not bq_client:
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    map_id = payload.get('map_id')
+    mode = payload.get('mode') or LOADMAP_DEFAULT_MODE
+
+    if not map_id:
+        return jsonify({"status": "ERROR", "message": "map_id é obrigatório."}), 400
+    if mode not in ('incremental', 'full'):
+        return jsonify({"status": "ERROR", "message": "mode deve ser 'incremental' ou 'full'."}), 400
+    try:
+        map_version = _parse_map_version(payload.get('map_version'))  # Opcional: carregar versão específica
+    except ValueError:
+        return jsonify({"status": "ERROR", "message": "map_version deve ser um inteiro."}), 400
+
+    if not get_bq_client():
         return jsonify({"error": "Cliente BigQuery não inicializado"}), 500
-    
-    # return jsonify({"status": "MOCK_SUCCESS", "message": "Função de refresh pronta para implementação"}), 200
-        
+
     try:
-        payload = request.get_json() or {}
-        map_id = payload.get('map_id') # Opcional: carregar versão específica
-
-        logger.info(f"Iniciando refresh do mapa. Map ID: {map_id}")
-        
-        # 1. Busca e Transforma
-        events_data = fetch_map_from_bigquery(map_id)
-        
-        if not events_data:
-            return jsonify({"status": "EMPTY", "message": "Nenhum dado encontrado no BigQuery."}), 404
-
-        # Extrai map_version do primeiro documento (todos têm a mesma versão após fetch)
-        first_doc = next(iter(events_data.values()))
-        map_version = payload.get('map_id') or first_doc.get('metadata', {}).get('map_version')
-
-        # 2. Atualiza Cache (remove antigos do mesmo map_id/map_version e insere novos)
-        update_firestore_cache(events_data, map_id=map_id, map_version=map_version)
-        
+        job, created = load_jobs.submit(map_id, map_version, run_map_load, mode=mode)
+
+        if not created and not job.matches(map_version, mode):
+            # Outra versão/modo do mesmo mapa em andamento: não anexa (a versão pedida não seria carregada)
+            return jsonify({
+                "status": "CONFLICT",
+                "message": "Já existe uma carga em andamento para este map_id com outros parâmetros.",
+                "job_id": job.job_id,
+                "status_url": f"/loadmap/{job.job_id}",
+                "running": {"map_version": job.requested[0], "mode": job.requested[1]},
+            }), 409
+
         return jsonify({
-            "status": "SUCCESS", 
-            "message": f"Cache atualizado com {len(events_data)} eventos.",
-            "mode": "COLD_START_COMPLETE"
-        }), 200
+            "status": "ACCEPTED",
+            "job_id": job.job_id,
+            "status_url": f"/loadmap/{job.job_id}",
+            "deduplicated": not created
+        }), 202
 
     except Exception as e:
         logger.error(f"Erro no refresh: {e}")
         return jsonify({"status": "ERROR", "message": str(e)}), 500
 
+
+@app.route('/loadmap/<job_id>', methods=['GET'])
+def load_job_status(job_id):
+    """
+    Status de um job de carga de mapa
+    ---
+    tags:
+      - Carregar mapa
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: "Fase (queued, fetching, deleting, writing, publishing, done, failed), linhas lidas, documentos gravados, throughput e erros"
+      404:
+        description: Job não encontrado
+    """
+    job = load_jobs.get(job_id)
+    if job:
+        return jsonify(job.to_dict()), 200
+
+    # Job criado por outra instância/worker
+    db = get_db()
+    if db:
+        try:
+            doc = db.collection(LOADMAP_JOBS_COLLECTION).document(job_id).get()
+            if doc.exists:
+                return jsonify(doc.to_dict()), 200
+        except Exception as e:
+            logger.error(f"Erro ao ler status do job {job_id}: {e}")
+
+    return jsonify({"error": "Job não encontrado"}), 404
+
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache():
-    
+    db = get_db()
     if not db:
         return jsonify({"error": "Firestore indisponível"}), 500
 
@@ -476,18 +1180,18 @@ def clear_cache():
         if not payload or not payload.get('confirm'):
             return jsonify({"error": "Operation not confirmed. Send {\"confirm\": true}"}), 400
 
-        # Delete documents in batches without materializing the entire collection
-        deleted = 0
-        batch = db.batch()
-        for i, doc_ref in enumerate(db.collection(COLLECTION_NAME).list_documents(), start=1):
-            batch.delete(doc_ref)
-            deleted += 1
-            if deleted % 400 == 0:
-                batch.commit()
-                batch = db.batch()
+        # Delete documents in parallel batches without materializing the entire collection
+        with _bulk_committer(_log_write_progress) as writer:
+            for doc_ref in db.collection(COLLECTION_NAME).list_documents(page_size=1000):
+                writer.delete(doc_ref)
+        deleted = writer.stats["deleted"]
 
-        if deleted % 400 != 0:
-            batch.commit()
+        # Sem os documentos, os manifestos e snapshots não valem mais (a próxima carga é completa)
+        clear_manifests(db)
+        lookup_keys_versions.clear()
+        snapshot_store.clear()
+
+        snapshot_store.sync(rule_index.publish(_rules_control_ref(db)))
 
         return jsonify({"status": "SUCCESS", "deleted": deleted}), 200
 
@@ -496,6 +1200,40 @@ def clear_cache():
         return jsonify({"status": "ERROR", "message": str(e)}), 500
 
 
+@app.route('/rules/stats', methods=['GET'])
+def rule_index_stats():
+    """
+    Estatísticas do índice de regras em memória
+    ---
+    tags:
+      - Carregar mapa
+    responses:
+      200:
+        description: Versão, tamanho e contadores de hit/miss do índice, versões de mapa em snapshot (residentes ou não) e versões ativas/fixadas por cliente
+    """
+    return jsonify(dict(rule_index.stats(), snapshots=snapshot_store.stats(), maps=map_registry.stats())), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Métricas das Camadas (OpenMetrics)
+    ---
+    tags:
+      - Monitoramento
+    produces:
+      - application/openmetrics-text
+    responses:
+      200:
+        description: Duração por layer (histograma), resultados por layer e hits de cache
+      404:
+        description: Métricas desativadas (METRICS_ENABLED=false)
+    """
+    if not metrics.enabled:
+        return jsonify({"error": "Métricas desativadas"}), 404
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route('/validate', methods=['POST'])
 def validate():
     """
@@ -526,69 +1264,260 @@ def validate():
               example: 
                 content_type: "article"
                 item_id: "12345"
+      - name: timings
+        in: query
+        type: boolean
+        required: false
+        description: "Inclui no relatório a duração (ms) de cada layer"
     responses:
       200:
         description: Relatório de Validação
+      429:
+        description: "Servidor sobrecarregado (SHED_MAX_INFLIGHT); tente após `Retry-After` segundos"
     """
     try:
         if not request.is_json:
             return jsonify({"error": "JSON required"}), 400
 
-        raw_payload = request.data.decode('utf-8')
-        payload = request.get_json()
-        
-        event_name = payload.get('event_name')
-        params = payload.get('params', {})
-        
-        report = {
-            "event": event_name,
-            "valid": True,
-            "layers": {}
-        }
+        # um único parse: os mesmos bytes vão para o hash da deduplicação
+        raw_payload = request.get_data(cache=False)
+        payload = codec.loads(raw_payload)
 
-        # 1. Deduplicação
-        dedup_res = validate_deduplication(raw_payload)
-        if dedup_res:
-            report["valid"] = False
-            report["layers"]["deduplication"] = dedup_res
-            return jsonify(report), 200
+        report = build_report(raw_payload, payload, with_timings=_timings_requested())
+        report_sink.record(report, event_client_id(payload))
+        return json_response(report), 200
+
+    except Exception as e:
+        logger.error(f"Erro Fatal no validate_full: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno no servidor", "details": str(e)}), 500
 
-        report["layers"]["deduplication"] = {"status": "OK"}
 
-        # 2. Taxonomia
-        tax_res = validate_taxonomy(payload)
-        if tax_res:
-            report["valid"] = False
-            report["layers"]["taxonomy"] = tax_res
-        else:
-            report["layers"]["taxonomy"] = {"status": "OK"}
+def json_response(data):
+    """Resposta JSON serializada por `codec.dumps` (mesmas chaves e ordem do `jsonify`, em UTF-8)."""
+    return Response(codec.dumps(data) + b"\n", mimetype='application/json')
+
+
+def _timings_requested():
+    """Bloco `timings` no relatório: `REPORT_TIMINGS` ou `?timings=true` na requisição."""
+    return REPORT_TIMINGS or request.args.get('timings', '').lower() in ('1', 'true')
+
+
+def build_report(raw_payload, payload, lookups=None, with_timings=False):
+    """Executa as 4 camadas sobre um evento e monta o relatório de validação."""
+    report = dedup_report(raw_payload, payload, with_timings=with_timings)
+    if not report["valid"]:
+        return report
+    skipped = skipped_layers(raw_payload, payload)
+    if "google_mp" in skipped:
+        mp_future = _SkippedLayer(skipped["google_mp"])
+    else:
+        mp_future = submit_google_mp(payload, report.get("timings"))
+    return _finish_report(report, payload, lookups, mp_future, skipped)
+
+
+def dedup_report(raw_payload, payload, client_id=None, with_timings=False):
+    """Inicia o relatório com a Layer 1; eventos duplicados não seguem adiante."""
+    report = {
+        "event": payload.get('event_name'),
+        "valid": True,
+        "layers": {}
+    }
+    if with_timings:
+        report["timings"] = {}
 
-        # 3. Schema (Firestore)
-        schema_res = validate_schema(payload)
-        if schema_res and schema_res.get('status') == "ERROR":
+    # 1. Deduplicação
+    set_layer(report, "deduplication", timed_layer(
+        "deduplication", validate_deduplication, raw_payload, None, client_id, timings=report.get("timings")))
+    return report
+
+
+def _finish_report(report, payload, lookups, mp_future, skipped=None):
+    """Layers 2 a 4. A Layer 4 (`mp_future`) já está em andamento em paralelo.
+
+    `skipped` traz os resultados das layers puladas (ver `skipped_layers`).
+    """
+    timings = report.get("timings")
+
+    # 2. Taxonomia
+    set_layer(report, "taxonomy", timed_layer("taxonomy", validate_taxonomy, payload, timings=timings))
+
+    # 3. Schema (Firestore)
+    if skipped and "schema" in skipped:
+        set_layer(report, "schema", skipped["schema"])
+    else:
+        set_layer(report, "schema", timed_layer("schema", validate_schema, payload, lookups, timings=timings))
+
+    # 4. Google MP
+    set_layer(report, "google_mp", mp_future.result())
+
+    return report
+
+
+def set_layer(report, layer, result):
+    """Registra o resultado de uma layer; ERROR invalida o evento, WARNING/SKIPPED não."""
+    metrics.count(layer, result)
+    if result:
+        if result.get('status') == "ERROR":
             report["valid"] = False
-            report["layers"]["schema"] = schema_res
-        elif schema_res: # Warning or Skipped
-             report["layers"]["schema"] = schema_res
-        else:
-            report["layers"]["schema"] = {"status": "OK"}
-
-        # 4. Google MP
-        mp_res = validate_google_mp(payload)
-        if mp_res:
-            if mp_res['status'] == "ERROR":
-                report["valid"] = False
-            report["layers"]["google_mp"] = mp_res
-        else:
-            report["layers"]["google_mp"] = {"status": "OK"}
+        report["layers"][layer] = result
+    else:
+        report["layers"][layer] = {"status": "OK"}
 
-        return jsonify(report), 200
 
-    except Exception as e:
-        logger.error(f"Erro Fatal no validate_full: {e}", exc_info=True)
-        return jsonify({"error": "Erro interno no servidor", "details": str(e)}), 500
+def build_reports(items, lookups=None, with_timings=False):
+    """Valida uma janela do lote: `items` é uma lista de `(raw_payload, payload)`.
+
+    A deduplicação roda primeiro; os eventos restantes vão ao GA4 agrupados
+    (até GA4_MP_MAX_EVENTS por chamada) enquanto as Layers 2 e 3 executam.
+    Uma falha inesperada em um evento vira o relatório de erro só daquele evento.
+    """
+    reports = []
+    pending = []
+    for i, (raw_payload, payload) in enumerate(items):
+        try:
+            report = dedup_report(raw_payload, payload, with_timings=with_timings)
+            if report["valid"]:
+                pending.append((i, skipped_layers(raw_payload, payload)))
+        except Exception as e:
+            report = _failed_report(payload, e)
+        reports.append(report)
+    to_ga4 = [i for i, skipped in pending if "google_mp" not in skipped]
+    slots = dict(zip(to_ga4, validate_google_mp_batch(
+        [items[i][1] for i in to_ga4], [reports[i].get("timings") for i in to_ga4] if with_timings else None)))
+    for i, skipped in pending:
+        slot = slots[i] if i in slots else _SkippedLayer(skipped["google_mp"])
+        try:
+            _finish_report(reports[i], items[i][1], lookups, slot, skipped)
+        except Exception as e:
+            reports[i] = _failed_report(items[i][1], e)
+    return reports
+
+
+def _failed_report(payload, error):
+    """Relatório de um evento do lote cuja validação falhou (demais eventos seguem)."""
+    logger.error(f"Erro ao validar evento do lote: {error}", exc_info=True)
+    return {"event": payload.get('event_name'), "valid": False,
+            "error": "Erro interno no servidor", "details": str(error)}
+
+
+def _iter_batch_events(stream):
+    """Lê o corpo de `/validate/batch` como array JSON ou NDJSON.
+
+    O formato é detectado pelo primeiro caractere não-branco (`[` = array),
+    independente do Content-Type (`navigator.sendBeacon` envia `text/plain`).
+    NDJSON é lido linha a linha, sem materializar o corpo.
+    Gera `(raw_payload, payload, erro)` por evento.
+    """
+    head = stream.read(1)
+    while head and head.isspace():
+        head = stream.read(1)
+    if not head:
+        return
+
+    if head == b'[':
+        try:
+            items = codec.loads(head + stream.read())
+        except ValueError as e:
+            yield None, None, f"JSON inválido: {e}"
+            return
+        if not isinstance(items, list):
+            yield None, None, "Array JSON esperado."
+            return
+        for item in items:
+            yield codec.dumps(item, sort_keys=False), item, None
+        return
+
+    for line in itertools.chain([head + stream.readline()], stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line, codec.loads(line), None
+        except ValueError as e:
+            yield line, None, f"JSON inválido: {e}"
 
 
+@app.route('/validate/batch', methods=['POST'])
+def validate_batch():
+    """
+    Validação em Lote (Array JSON ou NDJSON)
+    ---
+    tags:
+      - Validação
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: "Array JSON de eventos ou um evento JSON por linha (NDJSON)"
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              event_name:
+                type: string
+                example: "select_content"
+              params:
+                type: object
+      - name: timings
+        in: query
+        type: boolean
+        required: false
+        description: "Inclui em cada relatório a duração (ms) de cada layer"
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: "Um relatório de validação por linha (NDJSON), na ordem de entrada, com o campo `index`"
+      429:
+        description: "Servidor sobrecarregado (SHED_MAX_INFLIGHT); tente após `Retry-After` segundos"
+    """
+    with_timings = _timings_requested()
+
+    def generate():
+        window = []
+
+        def flush():
+            # Processa a janela e emite os relatórios na ordem de entrada; as buscas
+            # de regra são compartilhadas só dentro da janela (memória constante)
+            valid = [(raw_payload, payload) for _, raw_payload, payload, _ in window if payload is not None]
+            try:
+                reports = iter(build_reports(valid, {}, with_timings))
+            except Exception as e:
+                logger.error(f"Erro ao validar janela do lote: {e}", exc_info=True)
+                reports = None
+            for index, _, payload, error in window:
+                if payload is None:
+                    report = {"valid": False, "error": error}
+                elif reports is None:
+                    report = {"event": payload.get('event_name'), "valid": False,
+                              "error": "Erro interno no servidor"}
+                else:
+                    report = next(reports)
+                report["index"] = index
+                # o sink serializa em outra thread: o relatório já vai completo
+                if payload is not None and "error" not in report:
+                    report_sink.record(report, event_client_id(payload))
+                yield codec.dumps(report) + b"\n"
+            window.clear()
+
+        for index, (raw_payload, payload, error) in enumerate(_iter_batch_events(request.stream)):
+            if error is None and not isinstance(payload, dict):
+                error = "Evento deve ser um objeto JSON."
+            window.append((index, raw_payload, payload if error is None else None, error))
+            if len(window) >= BATCH_WINDOW_SIZE:
+                yield from flush()
+        yield from flush()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+startup_profile.mark("routes")
+startup_profile.done()
+
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 8080))
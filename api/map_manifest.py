@@ -0,0 +1,166 @@
+"""
+Manifesto de hashes por versão de mapa (carga incremental do /loadmap)
+
+Cada documento gerado pelo loader recebe um hash de conteúdo. O manifesto de
+uma versão (`map_id`/`map_version`) guarda `{doc_id: hash}` e permite gravar
+apenas documentos novos/alterados e remover os que saíram do mapa.
+
+Como um documento do Firestore tem limite de 1 MiB, os hashes ficam em shards
+(`<manifesto>/shards/<n>`) de até SHARD_MAX_BYTES (tamanho estimado pelas
+regras do Firestore) e até SHARD_CAPACITY entradas cada.
+
+O documento raiz do manifesto marca `lookup_keys: true` quando os documentos
+da versão foram gravados com o campo `lookup_keys` (ver rule_index.py);
+`LookupKeysVersions` usa essa marca para limitar a busca legada por `params.*`
+às versões gravadas antes do campo.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from rule_index import map_scope
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_COLLECTION = 'analytics_event_rules_manifests'
+# Entradas por shard: cada chave do mapa gera entradas no índice automático
+# (limite de 40.000 por documento)
+SHARD_CAPACITY = 5000
+# Tamanho estimado por shard, com folga para o nome do documento e o limite de 1 MiB
+SHARD_MAX_BYTES = 900 * 1024
+# Campo "hashes" e demais custos fixos do documento
+_SHARD_OVERHEAD = len("hashes") + 1 + 32
+
+
+def content_hash(doc):
+    """Hash estável do conteúdo de um documento (independe da ordem das chaves)."""
+    raw = json.dumps(doc, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def manifest_id(map_id, map_version):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', f"{map_id}__{map_version}")
+
+
+def load_manifest(db, map_id, map_version):
+    """Retorna `{doc_id: hash}` da versão, ou None se não há manifesto."""
+    root = db.collection(MANIFEST_COLLECTION).document(manifest_id(map_id, map_version))
+    snap = root.get()
+    if not snap.exists:
+        return None
+
+    hashes = {}
+    for shard in root.collection('shards').stream():
+        hashes.update((shard.to_dict() or {}).get('hashes') or {})
+    return hashes
+
+
+def _entry_size(doc_id, digest):
+    """Bytes de uma entrada do mapa no Firestore: nome do campo e string, cada um + 1."""
+    return len(str(doc_id).encode('utf-8')) + 1 + len(str(digest).encode('utf-8')) + 1
+
+
+def split_shards(hashes):
+    """Divide `{doc_id: hash}` em shards dentro de SHARD_MAX_BYTES e SHARD_CAPACITY."""
+    shard, size = {}, _SHARD_OVERHEAD
+    for doc_id, digest in hashes.items():
+        entry = _entry_size(doc_id, digest)
+        if shard and (size + entry > SHARD_MAX_BYTES or len(shard) >= SHARD_CAPACITY):
+            yield shard
+            shard, size = {}, _SHARD_OVERHEAD
+        shard[doc_id] = digest
+        size += entry
+    if shard or not hashes:
+        yield shard
+
+
+def save_manifest(db, map_id, map_version, hashes):
+    """Grava o manifesto completo, removendo shards que sobraram de uma carga maior."""
+    root = db.collection(MANIFEST_COLLECTION).document(manifest_id(map_id, map_version))
+
+    shard_refs = root.collection('shards')
+    shards = 0
+    for shard in split_shards(hashes):
+        shard_refs.document(str(shards)).set({"hashes": shard})
+        shards += 1
+    for ref in shard_refs.list_documents():
+        if not ref.id.isdigit() or int(ref.id) >= shards:
+            ref.delete()
+
+    root.set({
+        "map_id": map_id,
+        "map_version": map_version,
+        "documents": len(hashes),
+        "shards": shards,
+        "lookup_keys": True,
+        "updated_at": time.time(),
+    })
+
+
+def _delete_manifest(root):
+    for ref in root.collection('shards').list_documents():
+        ref.delete()
+    root.delete()
+
+
+def delete_manifest(db, map_id, map_version):
+    """Remove o manifesto de uma versão (antes de uma carga completa, que pode falhar no meio)."""
+    _delete_manifest(db.collection(MANIFEST_COLLECTION).document(manifest_id(map_id, map_version)))
+
+
+def clear_manifests(db):
+    """Remove todos os manifestos (usado quando a coleção de regras é limpa)."""
+    removed = 0
+    for root in db.collection(MANIFEST_COLLECTION).list_documents():
+        _delete_manifest(root)
+        removed += 1
+    return removed
+
+
+class LookupKeysVersions:
+    """Versões de mapa `(map_id, map_version)` cujos documentos têm `lookup_keys`.
+
+    Recarregado a cada nova publicação de regras (`reload`); enquanto não
+    carregado, nenhuma versão é considerada coberta.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+
+    def reload(self, db):
+        versions = None
+        try:
+            versions = set()
+            for snap in db.collection(MANIFEST_COLLECTION).stream():
+                data = snap.to_dict() or {}
+                if data.get('lookup_keys'):
+                    versions.add(map_scope(data.get('map_id'), data.get('map_version')))
+        except Exception as e:
+            logger.error(f"Erro ao ler manifestos (lookup_keys): {e}")
+            versions = None
+        with self._lock:
+            self._versions = versions
+        return versions
+
+    def add(self, map_id, map_version):
+        """Marca uma versão recém-gravada por esta instância."""
+        with self._lock:
+            if self._versions is not None:
+                self._versions.add(map_scope(map_id, map_version))
+
+    def clear(self):
+        with self._lock:
+            self._versions = set()
+
+    def covers(self, view):
+        """True se todas as versões da `view` (não vazia) foram gravadas com `lookup_keys`."""
+        versions = self._versions
+        return bool(view) and versions is not None and all(scope in versions for scope in view)
+
+    def __len__(self):
+        versions = self._versions
+        return len(versions) if versions is not None else 0
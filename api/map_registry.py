@@ -0,0 +1,98 @@
+"""
+Versão ativa de cada mapa, por cliente (Layer 3)
+
+A coleção de regras guarda documentos de todos os `map_id`/`map_version`
+misturados. Eventos com `metadata` apontam a versão exata; para os demais, a
+busca precisa saber qual versão de cada mapa vale para quem enviou o evento.
+
+`MapRegistry` resolve essa "visão": a versão mais nova de cada mapa conhecida
+em memória (ponteiros dos snapshots e documentos do índice) ou, para clientes
+fixados pelo header `X-CLIENT-ID`, a versão definida em MAP_PINS_FILE:
+
+    {"cliente-legado": {"site": 3}, "app-beta": {"app": "7"}}
+
+A visão é uma tupla ordenada de `(map_id, map_version)`, hasheável, e entra
+na chave das buscas (cache do lote, coalescência e cache negativo).
+"""
+import json
+import logging
+import os
+
+from rule_index import doc_scope, map_scope, version_key
+
+logger = logging.getLogger(__name__)
+
+
+def load_pins(path=None):
+    """Versões fixadas por cliente (`MAP_PINS_FILE`): `{client_id: {map_id: map_version}}`."""
+    path = path or os.environ.get('MAP_PINS_FILE')
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        pins = json.load(f)
+    logger.info("Versões de mapa fixadas para %s cliente(s) (%s)", len(pins), path)
+    return pins
+
+
+class MapRegistry:
+    def __init__(self, rule_index, snapshot_store, pins=None):
+        self.rule_index = rule_index
+        self.snapshot_store = snapshot_store
+        self.pins = {str(client): dict(map_scope(m, v) for m, v in maps.items())
+                     for client, maps in (pins or {}).items()}
+        self._latest = (None, {})
+        self._views = {}
+
+    def _generation(self):
+        return (self.rule_index.generation, self.snapshot_store.generation)
+
+    def latest(self):
+        """`{map_id: versão mais nova}` entre snapshots e índice (recalculado só quando mudam)."""
+        generation = self._generation()
+        cached_generation, latest = self._latest
+        if cached_generation != generation:
+            latest = self.rule_index.latest()
+            for map_id, map_version in self.snapshot_store.latest().items():
+                if map_id not in latest or version_key(map_version) > version_key(latest[map_id]):
+                    latest[map_id] = map_version
+            self._latest = (generation, latest)
+        return latest
+
+    def view(self, client_id=None):
+        """Versões que o cliente enxerga: a fixada para ele ou a mais nova de cada mapa."""
+        client = str(client_id) if client_id is not None and str(client_id) in self.pins else None
+        generation = self._generation()
+        cached = self._views.get(client)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        versions = dict(self.latest())
+        versions.update(self.pins.get(client) or {})
+        view = tuple(sorted(versions.items()))
+        self._views[client] = (generation, view)
+        return view
+
+    def pick(self, docs, view):
+        """Escolhe, entre `(doc_id, doc)` vindos do Firestore, o da versão que vale na `view`.
+
+        Mapas ainda desconhecidos em memória valem pela versão mais nova entre
+        os resultados. Entre os candidatos vale o menor `doc_id`.
+        """
+        versions = dict(view)
+        newest = {}
+        for _, doc in docs:
+            map_id, map_version = doc_scope(doc)
+            if map_id not in versions and (map_id not in newest or
+                                           version_key(map_version) > version_key(newest[map_id])):
+                newest[map_id] = map_version
+        best = None
+        for doc_id, doc in docs:
+            map_id, map_version = doc_scope(doc)
+            if versions.get(map_id, newest.get(map_id)) == map_version and (best is None or doc_id < best[0]):
+                best = (doc_id, doc)
+        return best
+
+    def stats(self):
+        return {
+            "latest": self.latest(),
+            "pinned_clients": {client: maps for client, maps in sorted(self.pins.items())},
+        }
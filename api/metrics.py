@@ -0,0 +1,115 @@
+"""
+Métricas das camadas de validação (OpenMetrics)
+
+`Metrics` acumula, por layer, um histograma de duração e contadores de
+resultado (ok, error, warning, skipped). Contadores já mantidos por outros
+componentes (hits do índice de regras, snapshots, LRU da taxonomia) são lidos
+apenas no scrape, via `collector`, sem custo no caminho de validação.
+
+Com `enabled=False` as chamadas viram no-op (uma checagem de atributo).
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Limites (s) dos buckets: de ~0,1 ms (cache em memória) a segundos (GA4/Firestore)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PREFIX = "tagging"
+
+
+def outcome(result):
+    """Classifica o retorno de uma layer (None = OK)."""
+    if not result:
+        return "ok"
+    return str(result.get('status') or 'ok').lower()
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)  # último = +Inf
+        self.sum = 0.0
+
+
+class Metrics:
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._results = {}
+        self._collectors = []
+
+    # --- Caminho de validação ---
+
+    def observe(self, layer, seconds):
+        if not self.enabled:
+            return
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._durations.get(layer)
+            if hist is None:
+                hist = self._durations[layer] = _Histogram(self.buckets)
+            hist.counts[slot] += 1
+            hist.sum += seconds
+
+    def count(self, layer, result):
+        if not self.enabled:
+            return
+        key = (layer, outcome(result))
+        with self._lock:
+            self._results[key] = self._results.get(key, 0) + 1
+
+    # --- Scrape ---
+
+    def collector(self, fn):
+        """Registra `fn() -> [(nome, tipo, ajuda, [(labels, valor), ...]), ...]`."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        """Exposição no formato OpenMetrics (texto)."""
+        with self._lock:
+            durations = {layer: (list(h.counts), h.sum) for layer, h in self._durations.items()}
+            results = dict(self._results)
+
+        lines = [
+            f"# TYPE {PREFIX}_layer_duration_seconds histogram",
+            f"# HELP {PREFIX}_layer_duration_seconds Duração de cada layer de validação.",
+        ]
+        for layer, (counts, total) in sorted(durations.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float('inf') else repr(float(bound))
+                lines.append(f'{PREFIX}_layer_duration_seconds_bucket{{layer="{layer}",le="{le}"}} {cumulative}')
+            lines.append(f'{PREFIX}_layer_duration_seconds_count{{layer="{layer}"}} {cumulative}')
+            lines.append(f'{PREFIX}_layer_duration_seconds_sum{{layer="{layer}"}} {total!r}')
+
+        lines += [
+            f"# TYPE {PREFIX}_layer_results counter",
+            f"# HELP {PREFIX}_layer_results Resultados por layer (ok, error, warning, skipped).",
+        ]
+        for (layer, result), n in sorted(results.items()):
+            lines.append(f'{PREFIX}_layer_results_total{{layer="{layer}",outcome="{result}"}} {n}')
+
+        for fn in self._collectors:
+            for name, kind, help_text, samples in fn():
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+                suffix = "_total" if kind == "counter" else ""
+                for labels, value in samples:
+                    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                    label_text = f"{{{label_text}}}" if label_text else ""
+                    lines.append(f"{PREFIX}_{name}{suffix}{label_text} {value}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
@@ -0,0 +1,368 @@
+"""
+Validação offline de arquivos NDJSON (um evento por linha, como o corpo do /validate)
+
+Reaproveita as layers de `main.py` contra os snapshots locais de regras
+(SNAPSHOT_DIR), sem rede: clientes do GCP desativados e GA4 desligado por
+padrão. O arquivo é lido por mmap e dividido em faixas alinhadas em quebras
+de linha; cada faixa é validada por um processo do pool e os resumos parciais
+são somados no final.
+
+    python api/offline_validator.py captura.ndjson --snapshot-dir /tmp/tagging-snapshots \\
+        --out resumo.json
+
+    # eventos embrulhados (ex.: {"ts": ..., "body": {...}}) e 8 processos
+    python api/offline_validator.py captura.ndjson --field body --workers 8
+
+- Schema: a regra vem do snapshot (e do índice em memória); evento sem regra
+  é "não documentado", sem consulta ao Firestore.
+- Deduplicação (`--dedup`): marca linhas idênticas (mesmo `client_id` e
+  payload) dentro de cada processo; não há janela de tempo real offline.
+- GA4 (`--ga4`): chama o endpoint de debug do Measurement Protocol (rede).
+
+O resumo traz totais, status por layer, eventos com mais erros, parâmetros
+citados nos problemas e as mensagens mais frequentes por layer/evento, com os
+offsets (bytes) das primeiras linhas de cada uma.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+LAYERS = ('deduplication', 'taxonomy', 'schema', 'google_mp')
+# Offsets de exemplo guardados por mensagem
+EXAMPLES = 3
+
+# Nome do parâmetro nas mensagens das layers (validators.py e taxonomy.py)
+_PARAM_PATTERN = re.compile(r"Parâmetro esperado ausente: (\S+)|(?:Parâmetro|Valor de|Tipo de) '([^']+)'")
+
+# Estado de cada processo do pool (preenchido por `_init_worker`)
+_worker = {}
+
+
+# --- FAIXAS DO ARQUIVO ---
+
+def split_ranges(path, chunk_size):
+    """Faixas `(início, fim)` de ~`chunk_size` bytes, terminando em quebra de linha."""
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    ranges = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_lines(mm, start, end):
+    """`(offset, linha)` das linhas não vazias de `mm[start:end]`."""
+    pos = start
+    while pos < end:
+        newline = mm.find(b"\n", pos, end)
+        if newline == -1:
+            newline = end
+        line = mm[pos:newline].strip()
+        if line:
+            yield pos, line
+        pos = newline + 1
+
+
+# --- PROCESSOS DO POOL ---
+
+def _init_worker(options):
+    """Configura o ambiente e importa `main` uma vez por processo."""
+    logging.basicConfig(level=logging.INFO if options['verbose'] else logging.WARNING)
+    os.environ.update({
+        'GCP_CLIENTS_ENABLED': 'false',
+        'RULE_INDEX_WARM': 'false',
+        'SNAPSHOT_DIR': options['snapshot_dir'],
+        'SNAPSHOT_POLL_INTERVAL': '0',
+        'SNAPSHOT_MEMORY_BUDGET_MB': str(options['memory_budget_mb']),
+        'METRICS_ENABLED': 'false',
+        'REPORT_SINK': '',
+        'DEDUP_BACKEND': 'memory',
+        # sem janela de tempo offline: vale a execução inteira
+        'DEDUP_TTL': str(365 * 24 * 3600),
+    })
+    for name in ('SAMPLING_RULES_FILE', 'SHED_MAX_INFLIGHT', 'SHED_DEGRADE_INFLIGHT',
+                 'SHED_SCHEMA_LATENCY_MS', 'SHED_GA4_LATENCY_MS'):
+        os.environ.pop(name, None)
+
+    import main
+    _worker.update(options, main=main, files={})
+
+
+def _mapped(path):
+    files = _worker['files']
+    if path not in files:
+        f = open(path, 'rb')
+        files[path] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return files[path][1]
+
+
+def _schema(main, payload, lookups):
+    """Layer 3 só com as regras em memória: sem regra = não documentado."""
+    params = payload.get('params', {}) or {}
+    kind, key, scope = lookup_key = main._schema_lookup_key(payload)
+    try:
+        doc_dict = lookups[lookup_key]
+    except KeyError:
+        doc_dict = lookups[lookup_key] = main._rule_from_memory(kind, key, scope, payload.get('event_name'), params)
+    except TypeError:
+        # filtros não hasheáveis: sem compartilhamento
+        doc_dict = main._rule_from_memory(kind, key, scope, payload.get('event_name'), params)
+    if doc_dict is None:
+        return main._not_documented(kind, payload.get('event_name'))
+    return main.check_params(doc_dict, params)
+
+
+def validate_event(raw_payload, payload, lookups):
+    """Relatório de um evento com as layers habilitadas (mesmo formato do /validate)."""
+    main = _worker['main']
+    report = {"event": payload.get('event_name'), "valid": True, "layers": {}}
+    if _worker['dedup']:
+        main.set_layer(report, "deduplication", main.validate_deduplication(raw_payload, payload))
+        if not report["valid"]:
+            return report
+    main.set_layer(report, "taxonomy", main.validate_taxonomy(payload))
+    try:
+        main.set_layer(report, "schema", _schema(main, payload, lookups))
+    except Exception as e:
+        main.set_layer(report, "schema", {"status": "ERROR", "layer": "Schema", "message": str(e)})
+    if _worker['ga4']:
+        main.set_layer(report, "google_mp", main.validate_google_mp(payload))
+    return report
+
+
+def _extract(payload, field):
+    """Evento dentro da linha (`--field`, caminho com pontos); texto é parseado como JSON."""
+    for part in field.split('.'):
+        if not isinstance(payload, dict):
+            return None
+        payload = payload.get(part)
+    if isinstance(payload, (str, bytes)):
+        payload = codec.loads(payload)
+    return payload
+
+
+def validate_range(path, start, end):
+    """Valida uma faixa do arquivo e devolve o resumo parcial."""
+    mm = _mapped(path)
+    summary = Summary()
+    lookups = {}
+    for offset, line in iter_lines(mm, start, end):
+        try:
+            payload = codec.loads(line)
+            raw_payload = line
+            if _worker['field']:
+                payload = _extract(payload, _worker['field'])
+                raw_payload = codec.dumps(payload, sort_keys=False)
+            if not isinstance(payload, dict):
+                raise ValueError("Evento deve ser um objeto JSON.")
+        except ValueError:
+            summary.parse_error(offset)
+            continue
+        summary.add(validate_event(raw_payload, payload, lookups), offset)
+    summary.bytes = end - start
+    return summary.to_dict()
+
+
+# --- RESUMO ---
+
+class Summary:
+    """Contadores de um conjunto de eventos; resumos parciais são somados com `merge`."""
+
+    def __init__(self):
+        self.events = 0
+        self.invalid = 0
+        self.bytes = 0
+        self.parse_errors = {"count": 0, "examples": []}
+        self.layers = {}     # layer -> status -> n
+        self.by_event = {}   # evento -> {"total", "invalid", "errors": {layer: n}}
+        self.params = {}     # parâmetro -> {"count", "layers": {layer: n}, "events": {evento: n}}
+        self.issues = {}     # (layer, evento, mensagem) -> {"count", "examples"}
+
+    def parse_error(self, offset):
+        self.parse_errors["count"] += 1
+        if len(self.parse_errors["examples"]) < EXAMPLES:
+            self.parse_errors["examples"].append(offset)
+
+    def add(self, report, offset):
+        event = report.get("event") or ""
+        self.events += 1
+        stats = self.by_event.setdefault(event, {"total": 0, "invalid": 0, "errors": {}})
+        stats["total"] += 1
+        if not report["valid"]:
+            self.invalid += 1
+            stats["invalid"] += 1
+
+        for layer, result in report["layers"].items():
+            status = result.get("status", "OK")
+            counts = self.layers.setdefault(layer, {})
+            counts[status] = counts.get(status, 0) + 1
+            if status == "OK":
+                continue
+            if status == "ERROR":
+                stats["errors"][layer] = stats["errors"].get(layer, 0) + 1
+            messages = result.get("issues") or [result.get("message") or status]
+            for message in messages:
+                self._issue(layer, event, str(message), offset)
+
+    def _issue(self, layer, event, message, offset):
+        entry = self.issues.setdefault((layer, event, message), {"count": 0, "examples": []})
+        entry["count"] += 1
+        if len(entry["examples"]) < EXAMPLES:
+            entry["examples"].append(offset)
+
+        match = _PARAM_PATTERN.search(message)
+        if match and not message.startswith("Nome do evento"):
+            param = self.params.setdefault(match.group(1) or match.group(2),
+                                           {"count": 0, "layers": {}, "events": {}})
+            param["count"] += 1
+            param["layers"][layer] = param["layers"].get(layer, 0) + 1
+            param["events"][event] = param["events"].get(event, 0) + 1
+
+    def to_dict(self):
+        return {
+            "events": self.events, "invalid": self.invalid, "bytes": self.bytes,
+            "parse_errors": self.parse_errors, "layers": self.layers, "by_event": self.by_event,
+            "params": self.params, "issues": [[*key, value] for key, value in self.issues.items()],
+        }
+
+    def merge(self, part):
+        self.events += part["events"]
+        self.invalid += part["invalid"]
+        self.bytes += part["bytes"]
+        self.parse_errors["count"] += part["parse_errors"]["count"]
+        self.parse_errors["examples"] = sorted(self.parse_errors["examples"] +
+                                               part["parse_errors"]["examples"])[:EXAMPLES]
+        for layer, counts in part["layers"].items():
+            _add_counts(self.layers.setdefault(layer, {}), counts)
+        for event, stats in part["by_event"].items():
+            mine = self.by_event.setdefault(event, {"total": 0, "invalid": 0, "errors": {}})
+            mine["total"] += stats["total"]
+            mine["invalid"] += stats["invalid"]
+            _add_counts(mine["errors"], stats["errors"])
+        for name, stats in part["params"].items():
+            mine = self.params.setdefault(name, {"count": 0, "layers": {}, "events": {}})
+            mine["count"] += stats["count"]
+            _add_counts(mine["layers"], stats["layers"])
+            _add_counts(mine["events"], stats["events"])
+        for layer, event, message, stats in part["issues"]:
+            mine = self.issues.setdefault((layer, event, message), {"count": 0, "examples": []})
+            mine["count"] += stats["count"]
+            mine["examples"] = sorted(mine["examples"] + stats["examples"])[:EXAMPLES]
+
+    def report(self, top):
+        """Resumo final, ordenado pelos maiores contadores (`top` itens por lista)."""
+        events = sorted(self.by_event.items(), key=lambda item: (-item[1]["invalid"], -item[1]["total"], item[0]))
+        params = sorted(self.params.items(), key=lambda item: (-item[1]["count"], item[0]))
+        issues = sorted(self.issues.items(), key=lambda item: (-item[1]["count"], item[0]))
+        return {
+            "totals": {"events": self.events, "valid": self.events - self.invalid, "invalid": self.invalid,
+                       "parse_errors": self.parse_errors["count"], "bytes": self.bytes},
+            "layers": {layer: self.layers[layer] for layer in LAYERS if layer in self.layers},
+            "events": [dict(stats, event_name=name) for name, stats in events[:top]],
+            "params": [{"param": name, "count": stats["count"], "layers": stats["layers"],
+                        "events": dict(sorted(stats["events"].items(), key=lambda item: -item[1])[:top])}
+                       for name, stats in params[:top]],
+            "issues": [{"layer": layer, "event_name": event, "message": message, **stats}
+                       for (layer, event, message), stats in issues[:top]],
+            "parse_errors": self.parse_errors,
+        }
+
+
+def _add_counts(target, counts):
+    for key, value in counts.items():
+        target[key] = target.get(key, 0) + value
+
+
+# --- CLI ---
+
+def run(args):
+    if not os.path.isdir(args.snapshot_dir):
+        logger.warning("Diretório de snapshots inexistente: %s (todos os eventos ficarão sem regra)",
+                       args.snapshot_dir)
+    options = {
+        'snapshot_dir': args.snapshot_dir,
+        'memory_budget_mb': args.memory_budget_mb,
+        'dedup': args.dedup,
+        'ga4': args.ga4,
+        'field': args.field,
+        'verbose': args.verbose,
+    }
+    ranges = split_ranges(args.path, max(1, int(args.chunk_mb * 1024 * 1024)))
+    workers = max(1, min(args.workers or os.cpu_count() or 1, len(ranges) or 1))
+    logger.info("%s: %s faixa(s) em %s processo(s)", args.path, len(ranges), workers)
+
+    summary = Summary()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+        futures = [pool.submit(validate_range, args.path, begin, end) for begin, end in ranges]
+        for done, future in enumerate(futures, 1):
+            summary.merge(future.result())
+            if args.verbose:
+                logger.info("Faixa %s/%s (%s eventos até agora)", done, len(futures), summary.events)
+    elapsed = time.perf_counter() - start
+
+    result = summary.report(args.top)
+    result["totals"].update(seconds=round(elapsed, 3),
+                            events_per_second=round(summary.events / elapsed, 1) if elapsed else None)
+    result["meta"] = {
+        "path": os.path.abspath(args.path),
+        "snapshot_dir": os.path.abspath(args.snapshot_dir),
+        "layers": [layer for layer, enabled in (("deduplication", args.dedup), ("taxonomy", True),
+                                                ("schema", True), ("google_mp", args.ga4)) if enabled],
+        "field": args.field,
+        "workers": workers,
+        "ranges": len(ranges),
+    }
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        totals = result["totals"]
+        print(f"{totals['events']} eventos ({totals['invalid']} inválidos, {totals['parse_errors']} linhas "
+              f"com JSON inválido) em {totals['seconds']} s; resumo em {args.out}")
+    else:
+        print(text)
+    return 1 if args.fail_on_invalid and (summary.invalid or summary.parse_errors["count"]) else 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="Arquivo NDJSON (um evento por linha)")
+    parser.add_argument('--snapshot-dir', default=os.environ.get('SNAPSHOT_DIR', '/tmp/tagging-snapshots'),
+                        help="Diretório dos snapshots de regras (padrão: SNAPSHOT_DIR)")
+    parser.add_argument('--memory-budget-mb', type=float, default=0,
+                        help="Limite de versões de mapa abertas por processo (0 = sem limite)")
+    parser.add_argument('--field', help="Caminho do evento em cada linha (ex.: body ou request.payload)")
+    parser.add_argument('--workers', type=int, default=0, help="Processos (padrão: CPUs da máquina)")
+    parser.add_argument('--chunk-mb', type=float, default=64.0, help="Tamanho de cada faixa do arquivo")
+    parser.add_argument('--dedup', action='store_true', help="Marca linhas duplicadas (Layer 1)")
+    parser.add_argument('--ga4', action='store_true', help="Valida no GA4 (Layer 4; usa a rede)")
+    parser.add_argument('--top', type=int, default=50, help="Itens por lista no resumo")
+    parser.add_argument('--out', help="Grava o resumo em JSON (padrão: stdout)")
+    parser.add_argument('--fail-on-invalid', action='store_true',
+                        help="Sai com código 1 se houver eventos inválidos ou linhas com JSON inválido")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,180 @@
+"""
+Gravação dos relatórios de validação em lote (fora do caminho da requisição)
+
+`ReportSink.record()` só coloca o relatório em uma fila limitada; uma thread
+em background converte os relatórios em linhas e grava em lote quando chega
+a `batch_size` relatórios ou a cada `flush_interval` segundos. Com a fila
+cheia (destino lento ou fora do ar) o relatório é descartado e contado em
+`dropped`: a validação nunca espera pela gravação.
+
+Destinos:
+
+- `BigQueryWriter`: streaming insert (`insert_rows_json`) na tabela
+  REPORT_SINK_TABLE (esquema em `BIGQUERY_SCHEMA`).
+- `NDJSONWriter`: um arquivo por dia em um diretório local, para testes
+  offline ou coleta por outro agente.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LAYERS = ('deduplication', 'taxonomy', 'schema', 'google_mp')
+
+# Esquema da tabela do BigQuery (`bq mk --table <tabela> <campos>`)
+BIGQUERY_SCHEMA = [
+    ("recorded_at", "TIMESTAMP"),
+    ("event_name", "STRING"),
+    ("client_id", "STRING"),
+    ("valid", "BOOLEAN"),
+    ("deduplication", "STRING"),
+    ("taxonomy", "STRING"),
+    ("schema", "STRING"),
+    ("google_mp", "STRING"),
+    ("report", "JSON"),
+]
+
+
+def report_row(report, client_id=None, recorded_at=None):
+    """Linha gravada para um relatório: status por layer e o relatório completo."""
+    layers = report.get('layers') or {}
+    row = {
+        "recorded_at": (recorded_at or datetime.now(timezone.utc)).isoformat(),
+        "event_name": report.get('event'),
+        "client_id": client_id,
+        "valid": bool(report.get('valid')),
+        "report": json.dumps(report, ensure_ascii=False, default=str),
+    }
+    for layer in LAYERS:
+        result = layers.get(layer)
+        row[layer] = result.get('status') if result else None
+    return row
+
+
+class BigQueryWriter:
+    """`client` pode ser o cliente ou uma função que o retorna (criado no primeiro lote)."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+
+    def write(self, rows):
+        client = self.client() if callable(self.client) else self.client
+        if client is None:
+            raise RuntimeError("Cliente BigQuery não inicializado")
+        errors = client.insert_rows_json(self.table, rows)
+        if errors:
+            raise RuntimeError(f"{len(errors)} linha(s) recusada(s) pelo BigQuery: {errors[:3]}")
+
+
+class NDJSONWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, rows):
+        path = os.path.join(self.directory, f"reports-{datetime.now(timezone.utc):%Y%m%d}.ndjson")
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+
+
+class ReportSink:
+    """Fila limitada + thread de gravação. Sem `writer`, `record()` é no-op."""
+
+    def __init__(self, writer=None, batch_size=500, flush_interval=5.0, max_queue=10000):
+        self.writer = writer
+        self.enabled = writer is not None
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name="report-sink", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def record(self, report, client_id=None):
+        if not self.enabled:
+            return
+        try:
+            # a serialização fica para a thread de gravação
+            self._queue.put_nowait((report, client_id, datetime.now(timezone.utc)))
+        except queue.Full:
+            self.dropped += 1
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush(self._collect())
+
+    def _collect(self):
+        """Aguarda até `batch_size` relatórios ou até `flush_interval` desde o primeiro."""
+        try:
+            items = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _flush(self, items):
+        if not items:
+            return
+        try:
+            rows = [report_row(*item) for item in items]
+            self.writer.write(rows)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(items)
+            logger.error(f"Erro ao gravar {len(items)} relatórios de validação: {e}")
+
+    def close(self, timeout=10.0):
+        """Para a thread e grava o que restou na fila (chamado no encerramento do worker)."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(items), self.batch_size):
+            self._flush(items[start:start + self.batch_size])
+
+
+def create_sink(backend, bq_client=None, table=None, directory=None, **options):
+    """`ReportSink` do destino configurado (REPORT_SINK); vazio/desconhecido = desativado."""
+    if backend == 'bigquery':
+        if bq_client is None:
+            logger.error("REPORT_SINK=bigquery sem cliente BigQuery; relatórios não serão gravados.")
+            return ReportSink(None)
+        logger.info("Relatórios de validação gravados no BigQuery (%s)", table)
+        return ReportSink(BigQueryWriter(bq_client, table), **options)
+    if backend == 'ndjson':
+        logger.info("Relatórios de validação gravados em %s", directory)
+        return ReportSink(NDJSONWriter(directory), **options)
+    if backend:
+        logger.warning("REPORT_SINK desconhecido: %s (use bigquery ou ndjson)", backend)
+    return ReportSink(None)
@@ -0,0 +1,376 @@
+"""
+Índice de regras em memória (Layer 3)
+
+Mantém uma cópia local e versionada dos documentos de `analytics_event_rules`,
+indexada pelo mesmo `doc_id` gerado pelo loader e por uma chave secundária
+(event_name, page_path, title, section, label). O Firestore continua sendo a
+fonte da verdade e só é consultado em caso de miss.
+
+A chave secundária é separada por versão de mapa (`map_scope`): a busca sem
+metadata recebe as versões que o cliente enxerga (ver map_registry.py) e não
+mistura documentos de versões diferentes.
+
+No Firestore a mesma chave é gravada em cada documento como hash, no campo
+`lookup_keys` (`doc_lookup_keys`): com e sem a versão do mapa, uma entrada por
+combinação de campos presentes/curinga. O fallback vira uma consulta
+`array_contains` pontual (`lookup_hash`) em vez de `where` encadeados.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Campos de `params` usados na busca sem metadata (mesma ordem dos `where`)
+LOOKUP_FIELDS = ('page_path', 'title', 'section', 'label')
+
+# Curinga: campo ausente na consulta (o `where` correspondente não é aplicado)
+_ANY = object()
+
+# Campo dos documentos no Firestore com os hashes das chaves secundárias
+LOOKUP_KEYS_FIELD = 'lookup_keys'
+
+
+def new_token():
+    """Token de uma publicação de regras (documento de controle e snapshots)."""
+    return uuid.uuid4().hex
+
+
+def version_key(version):
+    """Ordena versões de mapa: numéricas pelo valor, as demais como texto."""
+    try:
+        return (0, int(version))
+    except (TypeError, ValueError):
+        return (1, str(version))
+
+
+def map_scope(map_id, map_version):
+    """Identifica uma versão de mapa: `(map_id, map_version)` como texto."""
+    return ('' if map_id is None else str(map_id), '' if map_version is None else str(map_version))
+
+
+def doc_scope(doc):
+    """Versão de mapa de um documento de regra (`metadata` gravado pelo loader)."""
+    metadata = doc.get('metadata') or {}
+    return map_scope(metadata.get('map_id'), metadata.get('map_version'))
+
+
+def lookup_tuple(event_name, params):
+    """Chave secundária de uma consulta. Campos vazios viram curinga."""
+    return (event_name,) + tuple(params.get(f) or _ANY for f in LOOKUP_FIELDS)
+
+
+def _doc_lookup_tuples(doc):
+    """Todas as chaves secundárias que um documento satisfaz.
+
+    Gera uma chave por combinação de campos presentes/curinga (2^4), o que
+    transforma a busca parcial em um único acesso ao dicionário.
+    """
+    params = doc.get('params') or {}
+    values = [params.get(f) for f in LOOKUP_FIELDS]
+    evt = doc.get('event_name')
+    for mask in range(1 << len(LOOKUP_FIELDS)):
+        yield (evt,) + tuple(v if mask & (1 << i) else _ANY for i, v in enumerate(values))
+
+
+def lookup_hash(lookup, scope=None):
+    """Hash (texto) de uma chave secundária; com `scope`, restrito àquela versão de mapa."""
+    parts = [list(scope) if scope is not None else None, [None if v is _ANY else v for v in lookup]]
+    raw = json.dumps(parts, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def doc_lookup_keys(doc):
+    """Valor do campo `lookup_keys` de um documento: hashes de cada chave que ele
+    satisfaz, com e sem a versão do mapa (consultas usam só valores não vazios)."""
+    scope = doc_scope(doc)
+    keys = []
+    for lookup in _doc_lookup_tuples(doc):
+        if all(v is _ANY or v for v in lookup[1:]):
+            keys += [lookup_hash(lookup, scope), lookup_hash(lookup)]
+    return keys
+
+
+class RuleIndex:
+    """Cache local de regras com invalidação por versão.
+
+    - `version` é incrementada a cada `invalidate()`; escritas iniciadas antes
+      da invalidação (warm ou fallback) são descartadas.
+    - `token` identifica o conteúdo publicado no Firestore; o poller compara
+      com o documento de controle para invalidar outros workers/instâncias.
+    - `budget` limita os bytes dos documentos (JSON, a mesma medida dos
+      snapshots; 0 = sem limite). Acima dele, versões de mapa que não são a
+      mais nova do seu mapa saem do índice, da usada há mais tempo para a
+      mais recente, e voltam pelo fallback do Firestore se forem consultadas.
+    """
+
+    def __init__(self, budget=0):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._by_lookup = {}
+        # versão mais nova presente de cada mapa; `generation` muda junto
+        self._latest = {}
+        self.budget = budget
+        # {scope: {doc_id: bytes}}, total em bytes e último uso de cada versão
+        self._scopes = {}
+        self._bytes = 0
+        self._used = {}
+        self.evictions = 0
+        self.generation = 0
+        self.version = 0
+        self.token = None
+        self.warm = False
+        self.hits = 0
+        self.misses = 0
+
+    # --- Leitura ---
+
+    def get(self, doc_id):
+        """Busca por `doc_id` (caminho com metadata)."""
+        doc = self._docs.get(doc_id)
+        self._count(doc is not None)
+        if doc is not None and self.budget:
+            self._used[doc_scope(doc)] = time.monotonic()
+        return doc
+
+    def find(self, event_name, params, scopes):
+        """Busca por (event_name, page_path, title, section, label) nas versões `scopes`.
+
+        Entre mapas diferentes vale o menor `doc_id` (mesma ordem do Firestore).
+        """
+        doc_id = found_scope = None
+        try:
+            key = lookup_tuple(event_name, params)
+            for scope in scopes:
+                found = self._by_lookup.get((scope, key))
+                if found is not None and (doc_id is None or found < doc_id):
+                    doc_id, found_scope = found, scope
+        except TypeError:
+            # valores não hasheáveis (listas/dicts) nunca estão no índice
+            doc_id = None
+        doc = self._docs.get(doc_id) if doc_id else None
+        self._count(doc is not None)
+        if doc is not None and self.budget:
+            self._used[found_scope] = time.monotonic()
+        return doc
+
+    def _count(self, hit):
+        # contadores aproximados, sem lock no caminho quente (só alimentam stats/métricas)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    # --- Escrita ---
+
+    def put(self, doc_id, doc, version):
+        """Insere um documento se `version` ainda for a versão corrente."""
+        with self._lock:
+            if version != self.version:
+                return False
+            self._insert(doc_id, doc)
+            return True
+
+    def _insert(self, doc_id, doc):
+        # os hashes só servem à consulta no Firestore
+        doc.pop(LOOKUP_KEYS_FIELD, None)
+        previous = self._docs.get(doc_id)
+        if previous is not None:
+            sizes = self._scopes.get(doc_scope(previous), {})
+            self._bytes -= sizes.pop(doc_id, 0)
+        self._docs[doc_id] = doc
+        scope = doc_scope(doc)
+        if previous is not None:
+            self._unindex(doc_id, previous, scope, doc)
+        map_id, map_version = scope
+        latest = self._latest.get(map_id)
+        if latest is None or version_key(map_version) > version_key(latest):
+            self._latest[map_id] = map_version
+            self.generation += 1
+        try:
+            for key in _doc_lookup_tuples(doc):
+                # Firestore devolve em ordem de doc_id; mantém o menor para o mesmo resultado
+                key = (scope, key)
+                current = self._by_lookup.get(key)
+                if current is None or doc_id < current:
+                    self._by_lookup[key] = doc_id
+        except TypeError:
+            logger.warning("Documento %s com campos de busca não hasheáveis; indexado só por doc_id.", doc_id)
+        if self.budget:
+            size = len(json.dumps(doc, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8'))
+            self._scopes.setdefault(scope, {})[doc_id] = size
+            self._bytes += size
+            self._used.setdefault(scope, time.monotonic())
+            if self._bytes > self.budget:
+                self._evict()
+
+    def _unindex(self, doc_id, previous, scope, doc):
+        """Remove as chaves secundárias da versão anterior de `doc_id` que o novo `doc` não satisfaz.
+
+        Onde `doc_id` era o menor, outro documento da mesma versão de mapa que
+        satisfaça a chave assume a entrada.
+        """
+        previous_scope = doc_scope(previous)
+        try:
+            stale = {key for key in _doc_lookup_tuples(previous)
+                     if self._by_lookup.get((previous_scope, key)) == doc_id}
+            if previous_scope == scope:
+                stale.difference_update(_doc_lookup_tuples(doc))
+        except TypeError:
+            return
+        if not stale:
+            return
+        for key in stale:
+            del self._by_lookup[(previous_scope, key)]
+        for other_id, other in self._docs.items():
+            if other_id == doc_id or doc_scope(other) != previous_scope:
+                continue
+            try:
+                for key in stale.intersection(_doc_lookup_tuples(other)):
+                    current = self._by_lookup.get((previous_scope, key))
+                    if current is None or other_id < current:
+                        self._by_lookup[(previous_scope, key)] = other_id
+            except TypeError:
+                continue
+
+    def _evict(self):
+        """Remove versões frias (nunca a mais nova de cada mapa) até caber no orçamento."""
+        cold = [scope for scope in self._scopes if self._latest.get(scope[0]) != scope[1]]
+        for scope in sorted(cold, key=lambda s: self._used.get(s, 0)):
+            if self._bytes <= self.budget:
+                break
+            sizes = self._scopes.pop(scope)
+            self._used.pop(scope, None)
+            for doc_id in sizes:
+                doc = self._docs.pop(doc_id, None)
+                if doc is None:
+                    continue
+                try:
+                    for key in _doc_lookup_tuples(doc):
+                        self._by_lookup.pop((scope, key), None)
+                except TypeError:
+                    pass
+            self._bytes -= sum(sizes.values())
+            self.evictions += 1
+            logger.info("Versão %s/%s removida do índice de regras (orçamento de %s bytes).", *scope, self.budget)
+
+    def invalidate(self, token=None):
+        """Descarta todo o conteúdo e avança a versão."""
+        with self._lock:
+            self.version += 1
+            self.token = token
+            self.warm = False
+            self._docs = {}
+            self._by_lookup = {}
+            self._latest = {}
+            self._scopes = {}
+            self._bytes = 0
+            self._used = {}
+            self.generation += 1
+            return self.version
+
+    def latest(self):
+        """`{map_id: versão mais nova}` entre os documentos do índice."""
+        with self._lock:
+            return dict(self._latest)
+
+    # --- Warm-up / sincronização ---
+
+    def warm_from(self, db, collection_name, page_size=1000):
+        """Carrega todos os documentos da coleção para a versão corrente.
+
+        A coleção é lida em páginas de `page_size` (cursor por `__name__`), sem
+        um stream único durante todo o warm-up.
+        """
+        from firestore_writer import iter_documents  # importa google.api_core; só no warm-up
+
+        version = self.version
+        start = time.monotonic()
+        count = 0
+        for snap in iter_documents(db.collection(collection_name), page_size=page_size):
+            with self._lock:
+                if version != self.version:
+                    logger.info("Warm-up do índice interrompido (versão %s obsoleta).", version)
+                    return
+                self._insert(snap.id, snap.to_dict())
+            count += 1
+        with self._lock:
+            if version == self.version:
+                self.warm = True
+        logger.info("Índice de regras aquecido: %s documentos em %.2fs.", count, time.monotonic() - start)
+
+    def refresh(self, db, collection_name, control_ref=None, force=False, warm=True, on_token=None):
+        """Re-aquece o índice se o token publicado mudou (ou se `force`).
+
+        `on_token(token)` (opcional) é chamado antes de invalidar (ex.: snapshots
+        gravados com outro token deixam de valer). `warm` pode ser uma função,
+        avaliada depois de `on_token`; falso apenas invalida (as regras vêm de
+        outra fonte, ex.: snapshot).
+        """
+        token = None
+        if control_ref is not None:
+            snap = control_ref.get()
+            token = (snap.to_dict() or {}).get('token') if snap.exists else None
+        if not force and token == self.token:
+            return
+        if token != self.token:
+            logger.info("Versão de regras publicada: %s; recarregando índice.", token)
+        if on_token:
+            on_token(token)
+        self.invalidate(token)
+        if warm() if callable(warm) else warm:
+            self.warm_from(db, collection_name)
+
+    def warm_async(self, db, collection_name, control_ref=None, warm=True, on_token=None):
+        def _run():
+            try:
+                self.refresh(db, collection_name, control_ref, force=True, warm=warm, on_token=on_token)
+            except Exception as e:
+                logger.error(f"Erro no warm-up do índice de regras: {e}")
+
+        threading.Thread(target=_run, name="rule-index-warm", daemon=True).start()
+
+    def publish(self, control_ref, token=None):
+        """Invalida localmente e grava um novo token (ou `token`) para os demais workers."""
+        token = token or new_token()
+        control_ref.set({"token": token, "updated_at": time.time()})
+        self.invalidate(token)
+        return token
+
+    def start_poller(self, db, collection_name, control_ref, interval, should_warm=None, on_token=None):
+        """Verifica o token publicado a cada `interval` segundos.
+
+        `should_warm` (opcional) decide a cada troca se o índice é re-aquecido;
+        `on_token` é repassado a `refresh`.
+        """
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh(db, collection_name, control_ref, warm=should_warm or True, on_token=on_token)
+                except Exception as e:
+                    logger.error(f"Erro ao verificar versão do índice de regras: {e}")
+
+        if interval > 0:
+            threading.Thread(target=_run, name="rule-index-poller", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "version": self.version,
+                "token": self.token,
+                "warm": self.warm,
+                "documents": len(self._docs),
+                "maps": dict(self._latest),
+                "versions": len(self._scopes),
+                "budget_bytes": self.budget,
+                "resident_bytes": self._bytes,
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
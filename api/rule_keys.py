@@ -0,0 +1,134 @@
+"""
+Chave (`doc_id`) das regras de evento
+
+Única implementação usada pelo loader (`fetch_map_from_bigquery`) e pelo
+validador (`validate_schema` com `metadata`), para que os dois lados gerem
+sempre o mesmo id:
+
+    <map_id>_<map_version>_<event_name>_<page_path>_<parte única>
+
+A parte única é `title` (ou `page_path`) para page_view e
+`section_label[_outbound]` para os demais eventos. O slug troca qualquer
+caractere fora de [A-Za-z0-9] por `_` com uma tabela de `str.translate`,
+colapsa `_` repetidos e limita o tamanho; ids recentes ficam em um LRU.
+
+Para conferir o corpus golden (`rule_keys_golden.json`; também roda em
+tests/test_rule_keys.py):
+
+    python api/rule_keys.py
+"""
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+
+PAGE_VIEW_EVENTS = frozenset(('page_view', 'pageview', 'page_view_event'))
+MAX_LENGTH = 200
+CACHE_SIZE = 16384
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rule_keys_golden.json')
+
+
+class _SlugTable(dict):
+    """Tabela de `str.translate`: ASCII alfanumérico fica, o resto vira `_`."""
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = char if char.isascii() and char.isalnum() else '_'
+        self[codepoint] = value
+        return value
+
+
+_TABLE = _SlugTable()
+
+
+def slugify(*parts):
+    """Junta as partes não vazias com `_` e sanitiza (ex.: `/a b` -> `a_b`)."""
+    raw = "_".join([str(p) for p in parts if p is not None and p != ""])
+    # split/join colapsa `_` repetidos e remove os das pontas
+    return "_".join(filter(None, raw.translate(_TABLE).split('_')))[:MAX_LENGTH]
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+# typed: 3/3.0 e True/1 são iguais como chave, mas geram slugs diferentes
+@lru_cache(maxsize=CACHE_SIZE, typed=True)
+def _doc_id(map_id, map_version, event_name, page_path, title, section, label, outbound):
+    if event_name and event_name.lower() in PAGE_VIEW_EVENTS:
+        unique_part = title or page_path or ''
+    else:
+        unique_part = (section or '') + '_' + (label or '') + ('_' + str(_text(outbound)) if outbound else '')
+    return slugify(map_id, map_version, event_name, page_path or '', unique_part)
+
+
+def doc_id(map_id, map_version, event_name, page_path=None, title=None, section=None, label=None,
+           outbound=None):
+    try:
+        return _doc_id(map_id, map_version, event_name, page_path, title, section, label, outbound)
+    except TypeError:
+        # valores não hasheáveis (listas/dicts) não passam pelo LRU
+        return _doc_id.__wrapped__(map_id, map_version, event_name, page_path, title, section, label, outbound)
+
+
+def row_doc_id(row):
+    """`doc_id` de uma linha do mapa no BigQuery (loader)."""
+    return doc_id(row.get('map_id'), row.get('map_version'), row.get('event_name'),
+                  row.get('page_path'), row.get('title'), row.get('section'), row.get('label'),
+                  row.get('outbound'))
+
+
+def metadata_doc_id(event_name, metadata):
+    """`doc_id` de um evento recebido com `metadata` (validador)."""
+    return doc_id(metadata.get('map_id'), metadata.get('map_version'), event_name,
+                  metadata.get('page_path'), metadata.get('title'), metadata.get('section'),
+                  metadata.get('label'), metadata.get('outbound'))
+
+
+def cache_info():
+    return _doc_id.cache_info()._asdict()
+
+
+# --- Corpus golden ---
+
+def _reference_slugify(*parts):
+    # implementação original (duas passadas de regex), usada só na conferência
+    raw = "_".join([str(p) for p in parts if p is not None and p != ""])
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', raw)
+    slug = re.sub(r'_+', '_', slug).strip('_')
+    return slug[:MAX_LENGTH]
+
+
+def check_golden(path=GOLDEN_FILE):
+    """Confere loader, validador e slug de referência contra o corpus. Retorna as falhas."""
+    with open(path, encoding='utf-8') as f:
+        cases = json.load(f)
+
+    failures = []
+    for case in cases:
+        row = case['row']
+        metadata = {k: v for k, v in row.items() if k != 'event_name'}
+        got = {
+            "loader": row_doc_id(row),
+            "validator": metadata_doc_id(row.get('event_name'), metadata),
+        }
+        for side, value in got.items():
+            if value != case['doc_id']:
+                failures.append(f"{case['name']}: {side} gerou {value!r}, esperado {case['doc_id']!r}")
+
+        parts = [row.get('map_id'), row.get('map_version'), row.get('event_name'), row.get('page_path')]
+        if slugify(*parts) != _reference_slugify(*parts):
+            failures.append(f"{case['name']}: slug diverge da implementação com regex")
+    return failures
+
+
+if __name__ == "__main__":
+    problems = check_golden()
+    for problem in problems:
+        print(problem)
+    print("OK" if not problems else f"{len(problems)} divergência(s)")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,178 @@
+"""
+Amostragem e descarte adaptativo de carga (Layers 3 e 4)
+
+As layers caras (Schema com leitura no Firestore e Google MP) não precisam
+rodar para todo evento em produção. Dois mecanismos reduzem esse custo e
+marcam a layer como `SKIPPED` com o motivo no relatório:
+
+- `Sampler`: taxas fixas por layer, com sobrescrita por `event_name` e por
+  `client_id` (`SAMPLING_RULES_FILE`). A decisão é determinística pelo hash
+  do payload bruto, e a mesma amostra vale para as duas layers: um evento
+  amostrado a 10% no Schema também está na amostra de 20% do GA4.
+- `LoadShedder`: acompanha as validações em andamento e a latência (EWMA)
+  do Firestore e do GA4. Acima dos limites, o GA4 é pulado e o Schema fica
+  restrito às regras em memória (índice/snapshot); acima do limite de
+  requisições em andamento a API responde 429 com `Retry-After` antes que o
+  pool de workers sature.
+
+Limites em 0 desativam o respectivo mecanismo.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SAMPLED_LAYERS = ('schema', 'google_mp')
+
+
+def load_sampling_rules(path=None):
+    """Taxas de amostragem do arquivo JSON (`SAMPLING_RULES_FILE`), se houver.
+
+    Formato (taxas entre 0 e 1; layers omitidas ficam em 1):
+
+        {"google_mp": {"default": 0.1, "events": {"purchase": 1}, "clients": {"app-x": 0.01}},
+         "schema": {"default": 0.5}}
+    """
+    path = path or os.environ.get('SAMPLING_RULES_FILE')
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    logger.info("Regras de amostragem carregadas de %s", path)
+    return rules
+
+
+def _rate(value):
+    return min(max(float(value), 0.0), 1.0)
+
+
+class _LayerRates:
+    __slots__ = ('default', 'events', 'clients')
+
+    def __init__(self, rules):
+        self.default = _rate(rules.get('default', 1.0))
+        self.events = {k: _rate(v) for k, v in (rules.get('events') or {}).items()}
+        self.clients = {k: _rate(v) for k, v in (rules.get('clients') or {}).items()}
+
+    def rate(self, event_name, client_id):
+        # a menor taxa entre as sobrescritas que casam; sem sobrescrita, a padrão
+        matched = [rates[key] for rates, key in ((self.events, event_name), (self.clients, client_id))
+                   if key is not None and key in rates]
+        return min(matched) if matched else self.default
+
+
+class Sampler:
+    def __init__(self, rules):
+        self._layers = {layer: _LayerRates(rules[layer]) for layer in SAMPLED_LAYERS if rules.get(layer)}
+        self.enabled = bool(self._layers)
+
+    def rate(self, layer, event_name=None, client_id=None):
+        rates = self._layers.get(layer)
+        return rates.rate(event_name, client_id) if rates else 1.0
+
+    def skip_reason(self, layer, raw_payload, event_name=None, client_id=None):
+        """Motivo para pular a `layer` neste evento, ou None se ele está na amostra."""
+        rate = self.rate(layer, event_name, client_id)
+        if rate >= 1.0:
+            return None
+        if rate > 0.0 and _sample_point(raw_payload) < rate:
+            return None
+        return f"Fora da amostragem (taxa {rate:g})."
+
+
+def _sample_point(raw_payload):
+    """Posição do evento em [0, 1): mesmo payload, mesma decisão."""
+    data = raw_payload.encode('utf-8') if isinstance(raw_payload, str) else (raw_payload or b'')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little') / 2 ** 64
+
+
+class LoadShedder:
+    """Contagem de validações em andamento e latência recente por layer.
+
+    - `max_inflight`: requisições de validação simultâneas antes do 429.
+    - `degrade_inflight`: a partir daqui o GA4 é pulado e o Schema só usa regras em memória.
+    - `latency_ms`: `{layer: limite}` sobre a EWMA da latência de I/O da layer.
+    - `probe_interval`: com a layer degradada por latência, uma chamada a cada
+      intervalo (s) ainda passa, para que a EWMA volte a cair quando o
+      serviço se recuperar.
+    """
+
+    def __init__(self, max_inflight=0, degrade_inflight=0, latency_ms=None, alpha=0.2, retry_after=1,
+                 probe_interval=1.0):
+        self.max_inflight = max_inflight
+        self.degrade_inflight = degrade_inflight
+        self.latency_ms = {layer: ms for layer, ms in (latency_ms or {}).items() if ms > 0}
+        self.alpha = alpha
+        self.retry_after = retry_after
+        self.probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.rejected = 0
+        self._ewma = {}
+        self._next_probe = {}
+
+    # --- Admissão (429) ---
+
+    def try_acquire(self):
+        """Registra uma requisição em andamento; False quando deve ser recusada com 429."""
+        with self._lock:
+            if self.max_inflight and self.inflight >= self.max_inflight:
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+    # --- Degradação das layers ---
+
+    def skip_reason(self, layer):
+        """Motivo para pular a I/O da `layer` agora, ou None."""
+        inflight = self.inflight
+        if self.degrade_inflight and inflight > self.degrade_inflight:
+            return f"Carga alta ({inflight} validações em andamento)."
+
+        limit = self.latency_ms.get(layer)
+        if limit is None:
+            return None
+        ewma = self._ewma.get(layer, 0.0) * 1000
+        if ewma <= limit:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_probe.get(layer, 0.0):
+                self._next_probe[layer] = now + self.probe_interval
+                return None
+        return f"Latência alta ({ewma:.0f} ms, limite {limit:g} ms)."
+
+    def observe(self, layer, seconds):
+        if layer not in self.latency_ms:
+            return
+        with self._lock:
+            previous = self._ewma.get(layer)
+            self._ewma[layer] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    @contextmanager
+    def measure(self, layer):
+        """Mede a I/O de uma layer (também em código `async`, em volta do `await`)."""
+        if layer not in self.latency_ms:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(layer, time.perf_counter() - start)
+
+    def latency(self):
+        """EWMA (s) por layer monitorada."""
+        with self._lock:
+            return dict(self._ewma)
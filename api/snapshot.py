@@ -0,0 +1,579 @@
+"""
+Snapshots compactos de regras por versão de mapa
+
+Cada `/loadmap` grava, além do Firestore, um arquivo `<map_id>__<map_version>.<id>.snap`
+em SNAPSHOT_DIR. Os workers mapeiam o arquivo em memória (mmap) ao iniciar e
+leem as regras direto das páginas do arquivo: os workers de uma mesma máquina
+compartilham o page cache em vez de cada um manter uma cópia do mapa.
+
+Formato (little-endian):
+    b'TGSNAP01'
+    registros JSON {"doc_id": ..., "doc": ...} (na ordem de chegada)
+    tabela primária:   hash64(doc_id) ordenado | offset u64 | tamanho u32
+    tabela secundária: hash64(chave de busca) ordenado | offset u64 | tamanho u32
+    cabeçalho JSON (map_id, map_version, contagens, offsets das tabelas)
+    rodapé: offset u64 do cabeçalho | tamanho u32 | 4 bytes | b'TGSNAP01'
+
+O ponteiro `<map_id>.current` indica o arquivo ativo de cada mapa e é trocado
+atomicamente (`os.replace`) quando uma versão igual ou mais nova é publicada.
+Versões anteriores continuam no diretório (até `keep_versions` por mapa) e são
+abertas sob demanda, por exemplo para clientes fixados em uma versão.
+
+O diretório é local à instância; com um espelho (`snapshot_mirror`), os
+snapshots publicados são enviados a um bucket e baixados pelas demais
+instâncias (`pull`). Cada snapshot leva no cabeçalho o token de regras
+publicado no Firestore junto com a carga (ver RuleIndex.publish); quando outra
+instância publica um novo token (outro /loadmap ou /clear-cache), os snapshots
+gravados com o token anterior deixam de ser usados (`sync`).
+"""
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from functools import lru_cache, partial
+
+from rule_index import LOOKUP_FIELDS, map_scope, version_key
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TGSNAP01'
+# Registros decodificados mantidos por snapshot (regras quentes não são relidas do mmap)
+RECORD_CACHE_SIZE = 4096
+_FOOTER = struct.Struct('<QI4x8s')
+# Token publicado ainda não consultado: todos os snapshots valem
+_UNSYNCED = object()
+
+
+def _h64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _lookup_key(event_name, values):
+    """Chave de busca secundária; `None` representa curinga (campo ausente)."""
+    return json.dumps([event_name, *values], ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _safe_name(value):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', str(value))
+
+
+def pointer_name(map_id):
+    """Nome do ponteiro `<map_id>.current` do mapa."""
+    return f"{_safe_name(map_id)}.current"
+
+
+def snapshot_prefix(map_id):
+    """Prefixo dos arquivos de snapshot do mapa (`<map_id>__`)."""
+    return f"{_safe_name(map_id)}__"
+
+
+def _pad8(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+class SnapshotWriter:
+    """Grava um snapshot em streaming; a troca do arquivo ativo só ocorre em `commit()`."""
+
+    def __init__(self, directory, map_id, map_version, keep_versions=5, mirror=None):
+        self.directory = directory
+        self.map_id = map_id
+        self.map_version = map_version
+        self.keep_versions = max(1, keep_versions)
+        self.mirror = mirror
+        os.makedirs(directory, exist_ok=True)
+        # nome único por carga: recarregar a mesma versão também troca o ponteiro
+        self.filename = f"{snapshot_prefix(map_id)}{_safe_name(map_version)}.{uuid.uuid4().hex[:8]}.snap"
+        self._tmp_path = os.path.join(directory, f".{self.filename}.{uuid.uuid4().hex}.tmp")
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+        self._doc_ids = []
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        # (hash64 da chave de busca, posição de chegada do documento)
+        self._lookup_hashes = array('Q')
+        self._lookup_docs = array('I')
+
+    def add(self, doc_id, doc):
+        record = json.dumps({"doc_id": doc_id, "doc": doc}, ensure_ascii=False,
+                            separators=(',', ':'), default=str).encode('utf-8')
+        position = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._offsets.append(self._file.tell())
+        self._lengths.append(len(record))
+        self._file.write(record)
+
+        params = doc.get('params') or {}
+        values = [params.get(f) for f in LOOKUP_FIELDS]
+        present = [i for i, v in enumerate(values) if v]
+        # uma chave por combinação de campos presentes/curinga
+        for mask in range(1 << len(present)):
+            key_values = [None] * len(values)
+            for bit, i in enumerate(present):
+                if mask & (1 << bit):
+                    key_values[i] = values[i]
+            self._lookup_hashes.append(_h64(_lookup_key(doc.get('event_name'), key_values)))
+            self._lookup_docs.append(position)
+
+    def tee(self, events):
+        """Repassa `(doc_id, doc)` adiante gravando cada item no snapshot."""
+        for doc_id, doc in events:
+            self.add(doc_id, doc)
+            yield doc_id, doc
+
+    def _write_table(self, entries):
+        """Grava (hash, offset, tamanho) ordenados por hash; retorna os offsets das colunas."""
+        hashes, offsets, lengths = array('Q'), array('Q'), array('I')
+        for h, position in entries:
+            hashes.append(h)
+            offsets.append(self._offsets[position])
+            lengths.append(self._lengths[position])
+        _pad8(self._file)
+        columns = {"hash": self._file.tell()}
+        hashes.tofile(self._file)
+        columns["offset"] = self._file.tell()
+        offsets.tofile(self._file)
+        columns["length"] = self._file.tell()
+        lengths.tofile(self._file)
+        return columns, len(hashes)
+
+    def commit(self, token=None):
+        """Finaliza o arquivo e o publica como ativo se a versão for igual ou mais nova.
+
+        `token` é o token de regras publicado com esta carga (gravado no cabeçalho).
+        Com espelho, o arquivo também é enviado ao bucket; uma falha no envio só é
+        registrada (o snapshot local continua valendo).
+        """
+        primary = sorted((_h64(doc_id), i) for i, doc_id in enumerate(self._doc_ids))
+        primary_columns, count = self._write_table(primary)
+
+        # Para chaves parciais, vale o menor doc_id (mesma ordem do Firestore)
+        rank = sorted(range(len(self._doc_ids)), key=self._doc_ids.__getitem__)
+        rank_of = array('I', [0]) * len(rank)
+        for r, position in enumerate(rank):
+            rank_of[position] = r
+        ordered = sorted((h << 32) | rank_of[p] for h, p in zip(self._lookup_hashes, self._lookup_docs))
+        secondary = []
+        last = None
+        for value in ordered:
+            h = value >> 32
+            if h != last:
+                secondary.append((h, rank[value & 0xFFFFFFFF]))
+                last = h
+        secondary_columns, secondary_count = self._write_table(secondary)
+
+        header = json.dumps({
+            "map_id": self.map_id,
+            "map_version": self.map_version,
+            "count": count,
+            "secondary_count": secondary_count,
+            "primary": primary_columns,
+            "secondary": secondary_columns,
+            "token": token,
+            "created_at": time.time(),
+        }, default=str).encode('utf-8')
+        header_offset = self._file.tell()
+        self._file.write(header)
+        self._file.write(_FOOTER.pack(header_offset, len(header), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        final_path = os.path.join(self.directory, self.filename)
+        os.replace(self._tmp_path, final_path)
+        previous = publish_snapshot(self.directory, self.map_id, self.map_version, self.filename)
+        logger.info("Snapshot %s gravado: %s documentos.", self.filename, count)
+
+        prune_snapshots(self.directory, self.map_id, self.keep_versions, keep=(self.filename, previous))
+        if self.mirror is not None:
+            try:
+                self.mirror.push(self.directory, self.map_id, self.map_version, self.filename,
+                                 keep_versions=self.keep_versions)
+            except Exception as e:
+                logger.error(f"Erro ao enviar snapshot {self.filename} para o espelho: {e}")
+        return final_path
+
+    def abort(self):
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def _pointer_path(directory, map_id):
+    return os.path.join(directory, pointer_name(map_id))
+
+
+def _read_pointer(directory, map_id):
+    pointer = _pointer_path(directory, map_id)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def publish_snapshot(directory, map_id, map_version, filename):
+    """Aponta `<map_id>.current` para `filename`, exceto se já há uma versão mais nova ativa.
+
+    Retorna o arquivo que estava ativo antes (ou None).
+    """
+    current = _read_pointer(directory, map_id)
+    if current and version_key(current.get('map_version')) > version_key(map_version):
+        logger.info("Snapshot %s não publicado: versão ativa %s é mais nova.", filename, current.get('map_version'))
+        return current.get('file')
+    pointer = _pointer_path(directory, map_id)
+    tmp = f"{pointer}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"map_id": map_id, "map_version": map_version, "file": filename}, f, default=str)
+    os.replace(tmp, pointer)
+    return current.get('file') if current else None
+
+
+def prune_snapshots(directory, map_id, keep_versions, keep=()):
+    """Mantém o arquivo mais novo de cada uma das `keep_versions` versões mais
+    recentes do mapa, além do ativo e de `keep` (ex.: o anterior, para workers
+    que ainda não trocaram)."""
+    active = _read_pointer(directory, map_id) or {}
+    keep = {*keep, active.get('file')}
+    prefix = snapshot_prefix(map_id)
+    newest = {}
+    for name in os.listdir(directory):
+        if not (name.startswith(prefix) and name.endswith('.snap')):
+            continue
+        try:
+            header = read_header(os.path.join(directory, name))
+        except Exception:
+            continue
+        if str(header.get('map_id')) != str(map_id):
+            continue
+        version = str(header.get('map_version'))
+        if version not in newest or header.get('created_at', 0) > newest[version][0]:
+            newest[version] = (header.get('created_at', 0), name)
+    recent = sorted(newest, key=version_key, reverse=True)[:max(1, keep_versions)]
+    keep.update(newest[version][1] for version in recent)
+
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.snap') and name not in keep:
+            os.remove(os.path.join(directory, name))
+
+
+def read_header(path):
+    """Cabeçalho de um snapshot, lido sem mapear o arquivo."""
+    with open(path, 'rb') as f:
+        f.seek(-_FOOTER.size, os.SEEK_END)
+        header_offset, header_len, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Arquivo de snapshot inválido: {path}")
+        f.seek(header_offset)
+        return json.loads(f.read(header_len))
+
+
+def _decode_record(mm, offset, length):
+    return json.loads(mm[offset:offset + length])
+
+
+class Snapshot:
+    """Leitura de um arquivo de snapshot via mmap.
+
+    As tabelas de hash são lidas direto das páginas mapeadas; cada registro
+    encontrado é copiado do mmap e decodificado (`json.loads`), com os mais
+    usados em um LRU por snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_offset, header_len, magic = _FOOTER.unpack_from(self._mm, len(self._mm) - _FOOTER.size)
+        if magic != MAGIC or self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Arquivo de snapshot inválido: {path}")
+        self.header = json.loads(self._mm[header_offset:header_offset + header_len])
+        self.map_id = self.header['map_id']
+        self.map_version = self.header['map_version']
+        self.size = len(self._mm)
+        # o cache referencia só o mmap (não o Snapshot), então o arquivo é liberado com o objeto
+        self._decode = lru_cache(maxsize=RECORD_CACHE_SIZE)(partial(_decode_record, self._mm))
+        view = memoryview(self._mm)
+        self._primary = self._columns(view, self.header['primary'], self.header['count'])
+        self._secondary = self._columns(view, self.header['secondary'], self.header['secondary_count'])
+
+    @staticmethod
+    def _columns(view, columns, count):
+        return (
+            view[columns['hash']:columns['hash'] + 8 * count].cast('Q'),
+            view[columns['offset']:columns['offset'] + 8 * count].cast('Q'),
+            view[columns['length']:columns['length'] + 4 * count].cast('I'),
+        )
+
+    def _records(self, table, h):
+        hashes, offsets, lengths = table
+        i = bisect.bisect_left(hashes, h)
+        while i < len(hashes) and hashes[i] == h:
+            yield self._decode(offsets[i], lengths[i])
+            i += 1
+
+    def get(self, doc_id):
+        # os registros são compartilhados entre chamadas: não devem ser alterados
+        for record in self._records(self._primary, _h64(doc_id)):
+            if record['doc_id'] == doc_id:
+                return record['doc']
+        return None
+
+    def find(self, event_name, params):
+        """Retorna `(doc_id, doc)` para a busca sem metadata, ou None."""
+        values = [params.get(f) or None for f in LOOKUP_FIELDS]
+        try:
+            h = _h64(_lookup_key(event_name, values))
+        except (TypeError, ValueError):
+            return None
+        for record in self._records(self._secondary, h):
+            doc = record['doc']
+            doc_params = doc.get('params') or {}
+            # confere a chave (colisões de hash são descartadas)
+            if doc.get('event_name') == event_name and all(
+                    v is None or doc_params.get(f) == v for f, v in zip(LOOKUP_FIELDS, values)):
+                return record['doc_id'], doc
+        return None
+
+    def __len__(self):
+        return self.header['count']
+
+
+class SnapshotStore:
+    """Registro das versões de mapa disponíveis em snapshots.
+
+    Cada `(map_id, map_version)` corresponde ao arquivo mais novo daquela
+    versão. As versões são abertas sob demanda e ficam residentes em um LRU
+    limitado por `budget` bytes (tamanho dos arquivos mapeados; 0 = sem
+    limite): versões frias são fechadas e reabertas quando voltam a ser
+    usadas. A versão ativa de cada mapa é a do ponteiro `<map_id>.current`,
+    aberta já no `load()`.
+
+    Depois do primeiro `sync(token)`, só valem os snapshots gravados com o
+    token publicado; antes disso (ou sem Firestore), todos os do diretório.
+
+    Com `mirror` (ver snapshot_mirror), `sync` e o poller baixam antes as
+    versões ativas publicadas por outras instâncias.
+    """
+
+    def __init__(self, directory, budget=0, keep_versions=5, mirror=None):
+        self.directory = directory
+        self.budget = budget
+        self.keep_versions = keep_versions
+        self.mirror = mirror
+        self._catalog = {}
+        self._latest = {}
+        self._headers = {}
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self.token = _UNSYNCED
+        # muda a cada `load()` que altera as versões mais novas
+        self.generation = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @property
+    def loaded(self):
+        return bool(self._catalog)
+
+    def load(self):
+        """Relê o diretório: versões disponíveis e ponteiros `*.current` (troca atômica)."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        names = os.listdir(self.directory)
+        with self._lock:
+            cached, token = dict(self._headers), self.token
+        headers, valid = {}, set()
+        catalog, created = {}, {}
+        for name in names:
+            if not name.endswith('.snap'):
+                continue
+            try:
+                header = cached.get(name) or read_header(os.path.join(self.directory, name))
+            except Exception as e:
+                logger.error(f"Erro ao abrir snapshot {name}: {e}")
+                continue
+            headers[name] = header
+            if token is not _UNSYNCED and header.get('token') != token:
+                # gravado antes da última publicação de regras: pode estar desatualizado
+                continue
+            valid.add(name)
+            scope = map_scope(header['map_id'], header['map_version'])
+            if scope not in catalog or header.get('created_at', 0) > created[scope]:
+                catalog[scope] = os.path.join(self.directory, name)
+                created[scope] = header.get('created_at', 0)
+
+        latest = {}
+        for name in names:
+            if not name.endswith('.current'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    pointer = json.load(f)
+                map_id, map_version = map_scope(pointer['map_id'], pointer['map_version'])
+                path = os.path.join(self.directory, pointer['file'])
+                if pointer['file'] in valid and os.path.exists(path):
+                    # o ponteiro define o arquivo da versão ativa
+                    catalog[(map_id, map_version)] = path
+                    latest[map_id] = map_version
+            except Exception as e:
+                logger.error(f"Erro ao ler ponteiro de snapshot {name}: {e}")
+
+        with self._lock:
+            if self.token != token:
+                # `sync` concorrente: a releitura dele prevalece
+                return
+            self._headers = headers
+            # snapshots trocados ou removidos são liberados quando não houver mais leitores
+            self._resident = OrderedDict((scope, snapshot) for scope, snapshot in self._resident.items()
+                                         if catalog.get(scope) == snapshot.path)
+            if latest != self._latest:
+                self.generation += 1
+            self._catalog, self._latest = catalog, latest
+
+        for map_id, map_version in latest.items():
+            snapshot = self.open(map_id, map_version)
+            if snapshot is not None:
+                logger.info("Snapshot ativo para %s: %s (%s documentos)", map_id,
+                            os.path.basename(snapshot.path), len(snapshot))
+
+    def open(self, map_id, map_version):
+        """Snapshot residente da versão (abre e aplica o orçamento se preciso), ou None."""
+        scope = map_scope(map_id, map_version)
+        with self._lock:
+            snapshot = self._resident.get(scope)
+            if snapshot is not None:
+                self._resident.move_to_end(scope)
+                return snapshot
+            path = self._catalog.get(scope)
+        if path is None:
+            return None
+
+        try:
+            snapshot = Snapshot(path)
+        except Exception as e:
+            logger.error(f"Erro ao abrir snapshot {path}: {e}")
+            return None
+        with self._lock:
+            current = self._resident.get(scope)
+            if current is not None:
+                return current
+            if self._catalog.get(scope) == path:
+                self._resident[scope] = snapshot
+                self._evict(scope)
+        return snapshot
+
+    def _evict(self, keep):
+        if not self.budget:
+            return
+        total = sum(s.size for s in self._resident.values())
+        for scope in list(self._resident):
+            if total <= self.budget:
+                break
+            if scope == keep:
+                continue
+            total -= self._resident.pop(scope).size
+            self.evictions += 1
+            logger.info("Snapshot %s/%s removido da memória (orçamento de %s bytes).", *scope, self.budget)
+
+    def pull(self):
+        """Baixa do espelho as versões ativas (se configurado) e relê o diretório."""
+        if self.mirror is not None and self.directory:
+            try:
+                self.mirror.pull(self.directory, self.keep_versions)
+            except Exception as e:
+                logger.error(f"Erro ao baixar snapshots de {self.mirror.uri}: {e}")
+        self.load()
+
+    def sync(self, token):
+        """Passa a aceitar só os snapshots gravados com o token publicado `token`."""
+        with self._lock:
+            if self.token is not _UNSYNCED and self.token == token:
+                return
+            self.token = token
+        logger.info("Token de regras %s: relendo snapshots.", token)
+        self.pull()
+
+    def start_poller(self, interval):
+        def _run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.pull()
+                except Exception as e:
+                    logger.error(f"Erro ao reler snapshots: {e}")
+
+        if interval > 0:
+            threading.Thread(target=_run, name="snapshot-poller", daemon=True).start()
+
+    def latest(self):
+        """`{map_id: versão ativa}` segundo os ponteiros."""
+        return dict(self._latest)
+
+    def get(self, doc_id, map_id, map_version):
+        snapshot = self.open(map_id, map_version)
+        doc = snapshot.get(doc_id) if snapshot is not None else None
+        if doc is not None:
+            self.hits += 1
+        return doc
+
+    def find(self, event_name, params, scopes):
+        """Busca sem metadata nas versões `scopes`; entre mapas vale o menor `doc_id`."""
+        best = None
+        for map_id, map_version in scopes:
+            snapshot = self.open(map_id, map_version)
+            found = snapshot.find(event_name, params) if snapshot is not None else None
+            if found and (best is None or found[0] < best[0]):
+                best = found
+        if best:
+            self.hits += 1
+        return best
+
+    def writer(self, map_id, map_version):
+        return SnapshotWriter(self.directory, map_id, map_version, keep_versions=self.keep_versions,
+                              mirror=self.mirror)
+
+    def clear(self):
+        """Remove snapshots e ponteiros, também do espelho (usado por /clear-cache)."""
+        if self.mirror is not None:
+            try:
+                self.mirror.clear()
+            except Exception as e:
+                logger.error(f"Erro ao limpar snapshots de {self.mirror.uri}: {e}")
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(('.snap', '.current')):
+                os.remove(os.path.join(self.directory, name))
+        self.load()
+
+    def stats(self):
+        with self._lock:
+            catalog = list(self._catalog)
+            resident = {scope: len(s) for scope, s in self._resident.items()}
+            latest = dict(self._latest)
+            resident_bytes = sum(s.size for s in self._resident.values())
+        maps = {}
+        for map_id, map_version in sorted(catalog, key=lambda scope: (scope[0], version_key(scope[1]))):
+            info = maps.setdefault(map_id, {"map_version": latest.get(map_id), "versions": {}})
+            info["versions"][map_version] = {"resident": (map_id, map_version) in resident,
+                                             "documents": resident.get((map_id, map_version))}
+        return {
+            "directory": self.directory,
+            "mirror": self.mirror.uri if self.mirror is not None else None,
+            "token": None if self.token is _UNSYNCED else self.token,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "budget_bytes": self.budget,
+            "resident_bytes": resident_bytes,
+            "maps": maps,
+        }
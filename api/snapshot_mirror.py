@@ -0,0 +1,159 @@
+"""
+Espelho dos snapshots de regras em um bucket do Cloud Storage
+
+SNAPSHOT_DIR é local à instância (no Cloud Run, /tmp fica em memória e some
+com a instância). Com SNAPSHOT_BUCKET, o /loadmap envia o snapshot gravado e o
+ponteiro `<map_id>.current` para `gs://<bucket>/<prefixo>`, e cada instância
+baixa as versões ativas (`pull`): na primeira leitura do token de regras, a
+cada novo token publicado e no poller de snapshots.
+
+Só os arquivos apontados pelos ponteiros são baixados, para que o /tmp de cada
+instância guarde apenas as versões ativas. No bucket ficam as mesmas versões
+que no diretório local (`keep_versions` por mapa). A troca do ponteiro local
+continua sendo feita com `os.replace` no disco da instância, nunca no bucket.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+
+from google.api_core import exceptions as gexc
+
+from rule_index import version_key
+from snapshot import pointer_name, prune_snapshots, publish_snapshot, read_header, snapshot_prefix
+
+logger = logging.getLogger(__name__)
+
+# Tentativas de trocar o ponteiro no bucket quando outra instância o altera ao mesmo tempo
+_POINTER_RETRIES = 3
+
+
+class GCSSnapshotMirror:
+    """`client` pode ser o cliente do Storage ou uma função que o retorna."""
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket_name = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self._lock = threading.Lock()
+        # geração de cada ponteiro já aplicado (evita baixar de novo a cada poll)
+        self._pointers = {}
+
+    @property
+    def uri(self):
+        return f"gs://{self.bucket_name}/{self.prefix}"
+
+    def _bucket(self):
+        client = self.client() if callable(self.client) else self.client
+        if client is None:
+            raise RuntimeError("Cliente do Cloud Storage não inicializado")
+        return client.bucket(self.bucket_name)
+
+    # --- Envio (instância que executou o /loadmap) ---
+
+    def push(self, directory, map_id, map_version, filename, keep_versions=5):
+        """Envia o snapshot e aponta o ponteiro do bucket para ele (se a versão for igual ou mais nova)."""
+        bucket = self._bucket()
+        header = read_header(os.path.join(directory, filename))
+        blob = bucket.blob(self.prefix + filename)
+        blob.metadata = {"map_id": str(map_id), "map_version": str(map_version),
+                         "created_at": str(header.get('created_at', 0))}
+        blob.upload_from_filename(os.path.join(directory, filename), content_type='application/octet-stream')
+
+        pointer = json.dumps({"map_id": map_id, "map_version": map_version, "file": filename}, default=str)
+        remote_pointer = self.prefix + pointer_name(map_id)
+        for attempt in range(_POINTER_RETRIES):
+            current = bucket.get_blob(remote_pointer)
+            if current is not None:
+                active = json.loads(current.download_as_bytes())
+                if version_key(active.get('map_version')) > version_key(map_version):
+                    logger.info("Ponteiro de %s no bucket mantido: versão %s é mais nova.",
+                                map_id, active.get('map_version'))
+                    break
+            try:
+                # a troca só vale se ninguém alterou o ponteiro desde a leitura
+                bucket.blob(remote_pointer).upload_from_string(
+                    pointer, content_type='application/json',
+                    if_generation_match=current.generation if current is not None else 0)
+                break
+            except gexc.PreconditionFailed:
+                if attempt == _POINTER_RETRIES - 1:
+                    raise
+        self._prune(bucket, map_id, keep_versions)
+        logger.info("Snapshot %s enviado para %s", filename, self.uri)
+
+    def _prune(self, bucket, map_id, keep_versions):
+        """Mesmo critério do diretório local: o mais novo de cada uma das versões recentes, além do ativo."""
+        pointer = bucket.get_blob(self.prefix + pointer_name(map_id))
+        keep = {json.loads(pointer.download_as_bytes()).get('file')} if pointer is not None else set()
+        newest, blobs = {}, {}
+        for blob in bucket.list_blobs(prefix=self.prefix + snapshot_prefix(map_id)):
+            name = blob.name[len(self.prefix):]
+            meta = blob.metadata or {}
+            if '/' in name or not name.endswith('.snap') or meta.get('map_id') != str(map_id):
+                continue
+            blobs[name] = blob
+            version, created = meta.get('map_version'), float(meta.get('created_at') or 0)
+            if version not in newest or created > newest[version][0]:
+                newest[version] = (created, name)
+        recent = sorted(newest, key=version_key, reverse=True)[:max(1, keep_versions)]
+        keep.update(newest[version][1] for version in recent)
+        for name, blob in blobs.items():
+            if name not in keep:
+                try:
+                    blob.delete()
+                except gexc.NotFound:
+                    pass
+
+    # --- Download (demais instâncias) ---
+
+    def pull(self, directory, keep_versions=5):
+        """Baixa os snapshots ativos do bucket para `directory`; retorna quantos arquivos baixou."""
+        with self._lock:
+            bucket = self._bucket()
+            os.makedirs(directory, exist_ok=True)
+            downloaded = 0
+            for blob in bucket.list_blobs(prefix=self.prefix):
+                name = blob.name[len(self.prefix):]
+                if '/' in name or not name.endswith('.current') or self._pointers.get(name) == blob.generation:
+                    continue
+                try:
+                    pointer = json.loads(blob.download_as_bytes())
+                    filename = pointer['file']
+                    path = os.path.join(directory, filename)
+                    if not os.path.exists(path):
+                        self._download(bucket, filename, directory)
+                        downloaded += 1
+                except gexc.NotFound:
+                    # ponteiro trocado no meio do download: fica para o próximo pull
+                    continue
+                previous = publish_snapshot(directory, pointer['map_id'], pointer['map_version'], filename)
+                prune_snapshots(directory, pointer['map_id'], keep_versions, keep=(filename, previous))
+                self._pointers[name] = blob.generation
+            if downloaded:
+                logger.info("%s snapshot(s) baixado(s) de %s", downloaded, self.uri)
+            return downloaded
+
+    def _download(self, bucket, filename, directory):
+        tmp = os.path.join(directory, f".{filename}.{uuid.uuid4().hex}.tmp")
+        try:
+            bucket.blob(self.prefix + filename).download_to_filename(tmp)
+            read_header(tmp)  # descarta downloads truncados antes de publicar
+            os.replace(tmp, os.path.join(directory, filename))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self):
+        """Remove snapshots e ponteiros do bucket (usado por /clear-cache)."""
+        with self._lock:
+            bucket = self._bucket()
+            removed = 0
+            for blob in bucket.list_blobs(prefix=self.prefix):
+                name = blob.name[len(self.prefix):]
+                if '/' not in name and name.endswith(('.snap', '.current')):
+                    blob.delete()
+                    removed += 1
+            self._pointers.clear()
+            return removed
@@ -0,0 +1,156 @@
+"""
+Inicialização do worker: clientes sob demanda e perfil de tempo
+
+Em um cold start do Cloud Run, tudo que `main.py` faz na importação atrasa a
+primeira resposta. Por isso:
+
+- `LazyClient` cria os clientes GCP (e importa as bibliotecas) só no primeiro
+  uso, com lock para que threads concorrentes criem um único cliente.
+- `LazySwagger` monta o flasgger só no primeiro acesso a /apidocs.
+- `StartupProfile` mede as fases da inicialização (imports, snapshots,
+  clientes...) e registra um resumo no log; as fases sob demanda entram no
+  perfil quando acontecem. O perfil é exposto em /metrics.
+
+Este módulo deve ser o primeiro importado por `main.py`: o relógio começa aqui.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._mark = self.started
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.ready = None
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        """Registra como `name` o tempo desde a marca anterior (ex.: imports do módulo)."""
+        now = time.perf_counter()
+        self.record(name, now - self._mark)
+        self._mark = now
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            self._mark = time.perf_counter()
+
+    def done(self):
+        """Fim da importação: o worker pode atender requisições."""
+        self.ready = time.perf_counter() - self.started
+        report = self.report()
+        phases = ", ".join(f"{name} {ms:.0f} ms" for name, ms in report["phases"].items())
+        logger.info("Worker pronto em %.0f ms (%s)", report["ready_ms"], phases)
+
+    def report(self):
+        with self._lock:
+            phases = dict(self.phases)
+        return {
+            "ready_ms": round(self.ready * 1000, 1) if self.ready is not None else None,
+            "phases": {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        }
+
+
+startup_profile = StartupProfile()
+
+
+class LazyClient:
+    """Cliente criado no primeiro `get()` (None se a criação falhar ou se `enabled=False`).
+
+    Após uma falha, novas tentativas só acontecem depois de `retry_after`
+    segundos, para que requisições não paguem o custo a cada chamada.
+    """
+
+    def __init__(self, name, factory, retry_after=60.0, profile=startup_profile, enabled=True):
+        self.name = name
+        self.factory = factory
+        self.enabled = enabled
+        self.retry_after = retry_after
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._client = None
+        self._failed_at = None
+
+    def get(self):
+        client = self._client
+        if client is not None or not self.enabled:
+            return client
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_after:
+                return None
+            start = time.perf_counter()
+            try:
+                self._client = self.factory()
+                self._failed_at = None
+                logger.info("Cliente %s inicializado em %.0f ms.", self.name, (time.perf_counter() - start) * 1000)
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                logger.error(f"Erro ao inicializar cliente {self.name} (Verifique key.json): {e}")
+            if self.profile is not None:
+                self.profile.record(f"{self.name.lower()}_client", time.perf_counter() - start)
+            return self._client
+
+    @property
+    def initialized(self):
+        return self._client is not None
+
+
+class LazySwagger:
+    """Middleware WSGI que monta a documentação (flasgger) no primeiro acesso.
+
+    A documentação é servida por um app Flask separado, com as mesmas rotas
+    (e docstrings) do app principal; as demais requisições não passam pelo
+    flasgger.
+    """
+
+    PREFIXES = ('/apidocs', '/apispec', '/flasgger_static')
+
+    def __init__(self, app, profile=startup_profile):
+        self.app = app
+        self.profile = profile
+        self.wsgi_app = app.wsgi_app
+        self._docs = None
+        self._lock = threading.Lock()
+        app.wsgi_app = self
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(self.PREFIXES):
+            return self.docs_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def docs_app(self):
+        if self._docs is None:
+            with self._lock:
+                if self._docs is None:
+                    with self.profile.phase("swagger"):
+                        self._docs = self._build()
+        return self._docs
+
+    def _build(self):
+        from flask import Flask
+        from flasgger import Swagger
+
+        docs = Flask(self.app.import_name)
+        docs.config['SWAGGER'] = self.app.config.get('SWAGGER', {})
+        for rule in self.app.url_map.iter_rules():
+            if rule.endpoint == 'static':
+                continue
+            docs.add_url_rule(rule.rule, rule.endpoint, self.app.view_functions[rule.endpoint],
+                              methods=rule.methods)
+        Swagger(docs)
+        return docs
@@ -0,0 +1,110 @@
+"""
+Motor de taxonomia (Layer 2)
+
+As regras de nomenclatura vêm de `config.TAXONOMY_RULES` (ou de um JSON em
+`TAXONOMY_RULES_FILE`) e são compiladas uma única vez em um matcher combinado.
+Nomes válidos passam por um único `fullmatch`; o diagnóstico detalhado só é
+montado para nomes inválidos. Os resultados por nome ficam em um LRU, então um
+vocabulário pequeno de eventos/parâmetros custa praticamente um acesso a dict.
+"""
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+
+from config import TAXONOMY_RULES
+
+logger = logging.getLogger(__name__)
+
+
+def load_rules(path=None):
+    """Regras padrão de `config` sobrescritas pelo arquivo JSON (se houver)."""
+    rules = dict(TAXONOMY_RULES)
+    path = path or os.environ.get('TAXONOMY_RULES_FILE')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            rules.update(json.load(f))
+        logger.info("Regras de taxonomia carregadas de %s", path)
+    return rules
+
+
+class TaxonomyEngine:
+    """Valida `event_name` e `params` conforme as regras compiladas."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.reserved_prefixes = tuple(rules.get('reserved_prefixes') or ())
+        self.event_name_max_length = rules.get('event_name_max_length')
+        self.param_name_max_length = rules.get('param_name_max_length')
+        self.max_params = rules.get('max_params')
+        self.value_max_length = rules.get('param_value_max_length')
+        self.value_max_length_overrides = rules.get('param_value_max_length_overrides') or {}
+
+        self._name_re = re.compile(rules['name_pattern'])
+        self._event_ok = self._combine(rules['name_pattern'], self.event_name_max_length, ())
+        self._param_ok = self._combine(rules['name_pattern'], self.param_name_max_length, self.reserved_prefixes)
+
+        cache_size = rules.get('cache_size', 8192)
+        self._event_issues = lru_cache(maxsize=cache_size)(self._diagnose_event)
+        self._param_issues = lru_cache(maxsize=cache_size)(self._diagnose_param)
+
+    @staticmethod
+    def _combine(pattern, max_length, reserved_prefixes):
+        """Um único regex para o caminho feliz: padrão + tamanho + prefixos proibidos."""
+        parts = []
+        if reserved_prefixes:
+            parts.append('(?!(?:%s))' % '|'.join(re.escape(p) for p in reserved_prefixes))
+        if max_length:
+            parts.append(r'(?=.{1,%d}\Z)' % max_length)
+        parts.append('(?:%s)' % pattern)
+        return re.compile(''.join(parts), re.DOTALL)
+
+    def _diagnose_event(self, event_name):
+        if self._event_ok.fullmatch(event_name):
+            return ()
+        issues = []
+        if not self._name_re.fullmatch(event_name):
+            issues.append(f"Nome do evento '{event_name}' deve ser snake_case.")
+        if self.event_name_max_length and len(event_name) > self.event_name_max_length:
+            issues.append(f"Nome do evento '{event_name}' excede {self.event_name_max_length} caracteres.")
+        return tuple(issues)
+
+    def _diagnose_param(self, param):
+        if self._param_ok.fullmatch(param):
+            return ()
+        issues = []
+        if param.startswith(self.reserved_prefixes):
+            issues.append(f"Parâmetro '{param}' usa prefixo reservado proibido.")
+        if not self._name_re.fullmatch(param):
+            issues.append(f"Parâmetro '{param}' deve ser snake_case.")
+        if self.param_name_max_length and len(param) > self.param_name_max_length:
+            issues.append(f"Parâmetro '{param}' excede {self.param_name_max_length} caracteres.")
+        return tuple(issues)
+
+    def validate(self, event_name, params):
+        """Retorna a lista de problemas encontrados (vazia se o evento é válido)."""
+        issues = []
+
+        if not event_name or not isinstance(event_name, str):
+            issues.append(f"Nome do evento '{event_name}' deve ser snake_case.")
+        else:
+            issues.extend(self._event_issues(event_name))
+
+        if self.max_params and len(params) > self.max_params:
+            issues.append(f"Evento com {len(params)} parâmetros excede o limite de {self.max_params}.")
+
+        for param, value in params.items():
+            issues.extend(self._param_issues(param))
+            if self.value_max_length and isinstance(value, str):
+                limit = self.value_max_length_overrides.get(param, self.value_max_length)
+                if len(value) > limit:
+                    issues.append(f"Valor de '{param}' excede {limit} caracteres.")
+
+        return issues
+
+    def cache_info(self):
+        return {
+            "events": self._event_issues.cache_info()._asdict(),
+            "params": self._param_issues.cache_info()._asdict(),
+        }
@@ -0,0 +1,176 @@
+"""
+Validadores de parâmetros compilados a partir das regras (Layer 3)
+
+Cada documento de regra é compilado uma vez em um `RuleValidator`: uma
+verificação por parâmetro (presença, igualdade, tipo, regex, enum), na ordem
+das colunas do mapa. A validação de um evento só executa as verificações já
+compiladas, com as mesmas mensagens e na mesma ordem da comparação original.
+
+O mapa é largo (uma coluna por parâmetro). Além do valor literal (igualdade
+exata, como antes), colunas com sufixo descrevem regras do parâmetro base:
+
+    item_id__type      string | number | integer | boolean | array | object
+    item_id__regex     expressão regular (casamento completo)
+    item_id__enum      valores permitidos (lista ou texto separado por vírgula)
+    item_id__required  false torna o parâmetro opcional (padrão: obrigatório)
+
+Parâmetros que só têm regras por sufixo não são comparados por igualdade.
+Colunas estreitas como `param_type`/`regex_pattern`/`is_required` não são
+lidas como regras: sem sufixo, viram parâmetros comparados por igualdade.
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RULE_SUFFIXES = ('type', 'regex', 'enum', 'required')
+
+_TYPES = {
+    'string': lambda v: isinstance(v, str),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'array': lambda v: isinstance(v, list),
+    'object': lambda v: isinstance(v, dict),
+}
+_TYPE_ALIASES = {'str': 'string', 'float': 'number', 'int': 'integer', 'int64': 'integer',
+                 'float64': 'number', 'numeric': 'number', 'bool': 'boolean', 'list': 'array', 'dict': 'object'}
+
+_MISSING = object()
+
+
+def _is_false(value):
+    return value is False or str(value).strip().lower() in ('false', '0', 'no', 'n', '')
+
+
+class ParamCheck:
+    """Verificações compiladas de um parâmetro."""
+    __slots__ = ('name', 'required', 'expected', 'type_name', 'type_check', 'pattern', 'enum', 'enum_text')
+
+    def __init__(self, name):
+        self.name = name
+        self.required = True
+        self.expected = _MISSING
+        self.type_name = None
+        self.type_check = None
+        self.pattern = None
+        self.enum = None
+        self.enum_text = None
+
+    def check(self, value):
+        """Retorna a mensagem do primeiro problema encontrado, ou None."""
+        if self.expected is not _MISSING and value != self.expected:
+            return f"Valor de '{self.name}' inválido. Esperado: {self.expected}, recebido: {value}"
+        if self.type_check is not None and not self.type_check(value):
+            return f"Tipo de '{self.name}' inválido. Esperado: {self.type_name}, recebido: {type(value).__name__}"
+        if self.pattern is not None and not self.pattern.fullmatch(value if isinstance(value, str) else str(value)):
+            return f"Valor de '{self.name}' não corresponde ao padrão {self.pattern.pattern}"
+        if self.enum is not None and not self._in_enum(value):
+            return f"Valor de '{self.name}' fora dos valores permitidos: {sorted(self.enum_text)}"
+        return None
+
+    def _in_enum(self, value):
+        try:
+            if value in self.enum:
+                return True
+        except TypeError:
+            pass
+        return str(value) in self.enum_text
+
+
+class RuleValidator:
+    """Regra compilada de um documento."""
+    __slots__ = ('checks',)
+
+    def __init__(self, checks):
+        self.checks = tuple(checks)
+
+    def validate(self, params):
+        """Lista de problemas dos `params` recebidos (vazia se válido), na ordem das regras."""
+        issues = []
+        for check in self.checks:
+            value = params.get(check.name, _MISSING)
+            if value is _MISSING:
+                if check.required:
+                    issues.append(f"Parâmetro esperado ausente: {check.name}")
+                continue
+            issue = check.check(value)
+            if issue:
+                issues.append(issue)
+        return issues
+
+
+def compile_rule(doc):
+    """Compila `doc['params']` em um `RuleValidator`."""
+    checks = OrderedDict()
+
+    def _check(name):
+        check = checks.get(name)
+        if check is None:
+            check = checks[name] = ParamCheck(name)
+        return check
+
+    for key, value in (doc.get('params') or {}).items():
+        base, sep, suffix = key.rpartition('__')
+        if not sep or suffix not in RULE_SUFFIXES or not base:
+            _check(key).expected = value
+            continue
+
+        check = _check(base)
+        if suffix == 'required':
+            check.required = not _is_false(value)
+        elif suffix == 'type':
+            type_name = _TYPE_ALIASES.get(str(value).strip().lower(), str(value).strip().lower())
+            if type_name in _TYPES:
+                check.type_name, check.type_check = type_name, _TYPES[type_name]
+            else:
+                logger.warning("Tipo desconhecido '%s' para o parâmetro '%s'; regra ignorada.", value, base)
+        elif suffix == 'regex':
+            try:
+                check.pattern = re.compile(str(value))
+            except re.error as e:
+                logger.warning("Regex inválida para o parâmetro '%s' (%s); regra ignorada.", base, e)
+        elif suffix == 'enum':
+            values = value if isinstance(value, (list, tuple)) else [v.strip() for v in str(value).split(',')]
+            check.enum = frozenset(v for v in values if isinstance(v, (str, int, float, bool)))
+            check.enum_text = frozenset(str(v) for v in values)
+
+    return RuleValidator(checks.values())
+
+
+class ValidatorCache:
+    """Validadores compilados por documento (LRU limitado).
+
+    A chave é a identidade do documento: os documentos do índice de regras e
+    os registros dos snapshots são objetos estáveis, então cada regra é
+    compilada uma vez; um documento relido do Firestore é um objeto novo e é
+    recompilado.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc):
+        key = id(doc)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is doc:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        validator = compile_rule(doc)
+        with self._lock:
+            # guarda o documento junto: mantém o id() válido enquanto estiver no cache
+            self._entries[key] = (doc, validator)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return validator
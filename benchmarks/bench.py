@@ -0,0 +1,417 @@
+"""
+Benchmark das camadas de validação.
+
+Reexecuta um corpus NDJSON (um evento por linha) contra a API e mede
+requisições/s, latências p50/p95/p99 (total e por layer) e alocações:
+
+    # layers isoladas (sem stack HTTP), com stub do GA4
+    python benchmarks/bench.py run --mode layers --ga4-stub --out base.json
+
+    # app Flask em processo (test client), contra o emulador do Firestore
+    python benchmarks/bench.py run --mode inprocess --firestore-emulator localhost:8681
+
+    # servidor em execução (gunicorn/uvicorn), apenas latência total
+    python benchmarks/bench.py run --mode http --url http://localhost:8080 -c 32
+
+    # compara duas execuções; sai com código 1 se houver regressão
+    python benchmarks/bench.py compare base.json novo.json --threshold 0.10
+
+Por padrão cada requisição recebe um `client_id` distinto, para que a Layer 1
+não marque as repetições do corpus como duplicadas (`--no-vary` desativa).
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(HERE), 'api')
+DEFAULT_CORPUS = os.path.join(HERE, 'corpus', 'events.ndjson')
+
+# Funções de main.py medidas por layer
+LAYERS = {
+    'deduplication': 'validate_deduplication',
+    'taxonomy': 'validate_taxonomy',
+    'schema': 'validate_schema',
+    'google_mp': 'validate_google_mp',
+}
+
+
+# --- CORPUS ---
+
+def load_corpus(path):
+    events = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    if not events:
+        raise SystemExit(f"Corpus vazio: {path}")
+    return events
+
+
+def iter_payloads(events, total, vary=True):
+    """Gera `(raw_payload, payload)` percorrendo o corpus em ciclo."""
+    for seq, event in zip(range(total), itertools.cycle(events)):
+        if vary:
+            event = dict(event, client_id=f"bench-{seq}")
+        yield json.dumps(event, ensure_ascii=False), event
+
+
+# --- MEDIÇÃO ---
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    # nearest-rank
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def summarize(samples):
+    """Resumo de uma lista de durações (s) em milissegundos."""
+    ordered = sorted(samples)
+    ms = lambda v: round(v * 1000, 4) if v is not None else None
+    return {
+        "count": len(ordered),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+    }
+
+
+class LayerTimer:
+    """Substitui as funções de layer em `main` por versões cronometradas."""
+
+    def __init__(self, main):
+        self.main = main
+        self.samples = defaultdict(list)
+        self.peaks = defaultdict(list)
+        self.trace_allocations = False
+        self._originals = {}
+
+    def install(self):
+        for layer, attr in LAYERS.items():
+            original = getattr(self.main, attr)
+            self._originals[attr] = original
+            setattr(self.main, attr, self._wrap(layer, original))
+
+    def uninstall(self):
+        for attr, original in self._originals.items():
+            setattr(self.main, attr, original)
+
+    def _wrap(self, layer, fn):
+        samples = self.samples[layer]
+        peaks = self.peaks[layer]
+
+        def timed(*args, **kwargs):
+            if self.trace_allocations:
+                # passe de alocações é sequencial: o pico é só desta chamada
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return timed
+
+
+# --- ALVOS ---
+
+def _layers_target(main):
+    def call(raw_payload, payload):
+        main.validate_deduplication(raw_payload, payload)
+        main.validate_taxonomy(payload)
+        main.validate_schema(payload)
+        main.validate_google_mp(payload)
+        return 200
+    return call
+
+
+def _inprocess_target(main):
+    local = threading.local()
+
+    def call(raw_payload, payload):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = main.app.test_client()
+        response = client.post('/validate', data=raw_payload, content_type='application/json')
+        return response.status_code
+    return call
+
+
+def _http_target(url, timeout):
+    import requests
+
+    local = threading.local()
+    endpoint = url.rstrip('/') + '/validate'
+
+    def call(raw_payload, payload):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        response = session.post(endpoint, data=raw_payload.encode('utf-8'),
+                                headers={'Content-Type': 'application/json'}, timeout=timeout)
+        return response.status_code
+    return call
+
+
+def replay(call, payloads, concurrency):
+    """Executa `call` para cada payload; retorna (latências, erros, duração)."""
+    latencies = []
+    errors = []
+
+    def one(item):
+        start = time.perf_counter()
+        try:
+            status = call(*item)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(f"HTTP {status}")
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for item in payloads:
+            one(item)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # consome os resultados para propagar exceções inesperadas
+            for _ in pool.map(one, payloads):
+                pass
+    return latencies, errors, time.perf_counter() - started
+
+
+def measure_allocations(call, timer, payloads):
+    """Passe sequencial com tracemalloc: pico por layer e memória retida por requisição."""
+    tracemalloc.start(10)
+    timer.trace_allocations = True
+    try:
+        baseline = tracemalloc.take_snapshot()
+        start_current = tracemalloc.get_traced_memory()[0]
+        count = 0
+        for item in payloads:
+            call(*item)
+            count += 1
+        retained = tracemalloc.get_traced_memory()[0] - start_current
+        top = tracemalloc.take_snapshot().compare_to(baseline, 'lineno')[:5]
+    finally:
+        timer.trace_allocations = False
+        tracemalloc.stop()
+
+    layers = {}
+    for layer, peaks in timer.peaks.items():
+        if peaks:
+            ordered = sorted(peaks)
+            layers[layer] = {
+                "count": len(ordered),
+                "peak_mean_bytes": round(sum(ordered) / len(ordered)),
+                "peak_p95_bytes": percentile(ordered, 95),
+                "peak_max_bytes": ordered[-1],
+            }
+    return {
+        "requests": count,
+        "retained_bytes_per_request": round(retained / count) if count else None,
+        "layers": layers,
+        "top_sites": [{"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                      for stat in top],
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    events = load_corpus(args.corpus)
+    stub = None
+
+    if args.mode in ('layers', 'inprocess'):
+        if args.ga4_stub:
+            from ga4_stub import serve
+            stub = serve(0, args.ga4_latency_ms)
+            threading.Thread(target=stub.serve_forever, daemon=True).start()
+            os.environ['GA4_MP_BASE_URL'] = f"http://127.0.0.1:{stub.server_address[1]}"
+        if args.firestore_emulator:
+            os.environ['FIRESTORE_EMULATOR_HOST'] = args.firestore_emulator
+        os.environ.setdefault('RULE_INDEX_WARM', 'false')
+        sys.path.insert(0, API_DIR)
+        import main
+
+        timer = LayerTimer(main)
+        timer.install()
+        call = _layers_target(main) if args.mode == 'layers' else _inprocess_target(main)
+    else:
+        if not args.url:
+            raise SystemExit("--url é obrigatório no modo http")
+        timer = None
+        call = _http_target(args.url, args.timeout)
+
+    try:
+        # aquecimento (índice, conexões, caches) fora da medição
+        replay(call, iter_payloads(events, args.warmup, args.vary), args.concurrency)
+        if timer:
+            for samples in timer.samples.values():
+                samples.clear()
+
+        # offset no client_id para não colidir com o aquecimento
+        payloads = itertools.islice(iter_payloads(events, args.warmup + args.requests, args.vary), args.warmup, None)
+        latencies, errors, elapsed = replay(call, payloads, args.concurrency)
+
+        result = {
+            "meta": {
+                "mode": args.mode,
+                "corpus": os.path.relpath(args.corpus),
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "ga4_stub": bool(stub),
+                "firestore_emulator": args.firestore_emulator,
+                "git_revision": _git_revision(),
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+            },
+            "total": dict(summarize(latencies), errors=len(errors),
+                          rps=round(len(latencies) / elapsed, 1) if elapsed else None),
+            "layers": {layer: summarize(samples) for layer, samples in timer.samples.items() if samples} if timer else {},
+        }
+        if errors:
+            result["total"]["error_samples"] = sorted(set(errors))[:5]
+
+        if timer and args.allocations:
+            offset = args.warmup + args.requests
+            payloads = itertools.islice(iter_payloads(events, offset + args.allocations, args.vary), offset, None)
+            result["allocations"] = measure_allocations(call, timer, payloads)
+    finally:
+        if timer:
+            timer.uninstall()
+        if stub:
+            stub.shutdown()
+
+    print_result(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResultado gravado em {args.out}")
+    return 0
+
+
+def print_result(result):
+    meta, total = result["meta"], result["total"]
+    print(f"modo={meta['mode']} requisições={total['count']} concorrência={meta['concurrency']} "
+          f"erros={total['errors']} req/s={total['rps']}")
+    rows = [("total", total)] + sorted(result["layers"].items())
+    print(f"{'':<15}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in rows:
+        print(f"{name:<15}{stats['p50_ms']!s:>10}{stats['p95_ms']!s:>10}{stats['p99_ms']!s:>10}{stats['max_ms']!s:>10}")
+
+    allocations = result.get("allocations")
+    if allocations:
+        print(f"\nalocações: {allocations['retained_bytes_per_request']} bytes retidos/requisição")
+        for name, stats in sorted(allocations["layers"].items()):
+            print(f"  {name:<13} pico médio {stats['peak_mean_bytes']} bytes (p95 {stats['peak_p95_bytes']})")
+
+
+# --- COMPARAÇÃO ---
+
+def _metrics(result):
+    """Métricas comparáveis: `(nome, valor, maior_é_melhor)`."""
+    total = result["total"]
+    yield "total.rps", total.get("rps"), True
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        yield f"total.{key}", total.get(key), False
+    for layer, stats in result.get("layers", {}).items():
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            yield f"{layer}.{key}", stats.get(key), False
+    for layer, stats in result.get("allocations", {}).get("layers", {}).items():
+        yield f"{layer}.peak_mean_bytes", stats.get("peak_mean_bytes"), False
+
+
+def compare(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    base_metrics = {name: value for name, value, _ in _metrics(base)}
+    regressions = []
+    print(f"{'métrica':<28}{'base':>12}{'novo':>12}{'variação':>10}")
+    for name, value, higher_is_better in _metrics(new):
+        old = base_metrics.get(name)
+        if old is None or value is None:
+            continue
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        # diferenças absolutas muito pequenas são ruído de medição
+        noise = name.endswith('_ms') and abs(value - old) < args.min_delta_ms
+        flag = ""
+        if worse > args.threshold and not noise:
+            regressions.append(name)
+            flag = "  REGRESSÃO"
+        print(f"{name:<28}{old!s:>12}{value!s:>12}{change * 100:>9.1f}%{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regressão(ões) acima de {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nSem regressões acima de {args.threshold:.0%}.")
+    return 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help="Executa o benchmark")
+    p_run.add_argument('--mode', choices=('layers', 'inprocess', 'http'), default='inprocess')
+    p_run.add_argument('--corpus', default=DEFAULT_CORPUS, help="Arquivo NDJSON com os eventos")
+    p_run.add_argument('-n', '--requests', type=int, default=2000)
+    p_run.add_argument('-c', '--concurrency', type=int, default=1)
+    p_run.add_argument('--warmup', type=int, default=100)
+    p_run.add_argument('--no-vary', dest='vary', action='store_false',
+                       help="Não varia o client_id (repetições caem na deduplicação)")
+    p_run.add_argument('--allocations', type=int, default=200,
+                       help="Requisições do passe de alocações com tracemalloc (0 desativa)")
+    p_run.add_argument('--ga4-stub', action='store_true', help="Sobe o stub do GA4 em processo")
+    p_run.add_argument('--ga4-latency-ms', type=float, default=20.0)
+    p_run.add_argument('--firestore-emulator', help="host:porta do emulador do Firestore")
+    p_run.add_argument('--url', help="URL base do servidor (modo http)")
+    p_run.add_argument('--timeout', type=float, default=30.0)
+    p_run.add_argument('--out', help="Grava o resultado em JSON")
+    p_run.set_defaults(func=run)
+
+    p_cmp = sub.add_parser('compare', help="Compara duas execuções")
+    p_cmp.add_argument('base')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=0.10, help="Piora relativa tolerada (0.10 = 10%%)")
+    p_cmp.add_argument('--min-delta-ms', type=float, default=0.05,
+                       help="Ignora variações de latência menores que este valor absoluto")
+    p_cmp.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,200 @@
+"""
+Benchmark do codec JSON/hash do `/validate` (api/codec.py).
+
+Compara, por requisição e em CPU (`time.process_time`), o caminho anterior
+com o atual sobre os eventos do corpus:
+
+- parse:      `request.data.decode()` + `request.get_json()`  vs  `codec.loads(bytes)`
+- dedup:      MD5 hexdigest do corpo decodificado, chave       vs  bytes brutos em `ShardedDedupStore`
+              f-string e `TTLCache` com lock (Layer 1 original)     (`codec.digest`)
+- serialize:  `jsonify` (provider JSON do Flask)              vs  `codec.dumps` em uma `Response`
+
+Os stores da deduplicação são recriados a cada rodada (TTL e tamanho
+padrão), então toda requisição mede a inserção de uma chave nova.
+
+    python benchmarks/bench_codec.py --rounds 20 --out codec.json
+
+O JSON gravado segue o formato do `bench.py` (`total` e `layers` do caminho
+atual, em ms por requisição), para uso com `bench.py compare`. Sem `orjson`
+e `xxhash` instalados, o caminho atual usa os fallbacks da stdlib.
+"""
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import threading
+import time
+
+from bench import API_DIR, DEFAULT_CORPUS, _git_revision, load_corpus, summarize
+
+sys.path.insert(0, API_DIR)
+import codec  # noqa: E402
+from cachetools import TTLCache  # noqa: E402
+from dedup import ShardedDedupStore  # noqa: E402
+from flask import Flask, Response  # noqa: E402
+
+STEPS = ('parse', 'dedup', 'serialize')
+
+# padrões da Layer 1: DEDUP_TTL e DEDUP_MAXSIZE (antes) / DEDUP_SHARDS (depois)
+DEDUP_TTL = 2.0
+DEDUP_MAXSIZE = 1000
+DEDUP_SHARDS = 64
+
+_dedup = {}
+
+
+def reset_dedup():
+    _dedup['cache'] = TTLCache(maxsize=DEDUP_MAXSIZE, ttl=DEDUP_TTL)
+    _dedup['lock'] = threading.Lock()
+    _dedup['store'] = ShardedDedupStore(DEDUP_TTL, shards=DEDUP_SHARDS)
+
+
+def sample_report(event, index):
+    """Relatório no formato do `/validate`, com problemas em parte das layers."""
+    params = event.get('params') or {}
+    layers = {
+        "deduplication": {"status": "OK"},
+        "taxonomy": {"status": "OK"},
+        "schema": {"status": "OK"},
+        "google_mp": {"status": "OK", "layer": "Google Protocol", "message": "Aceito pelo GA4."},
+    }
+    if index % 3 == 0:
+        layers["schema"] = {"status": "ERROR", "layer": "Schema",
+                            "issues": [f"Parâmetro esperado ausente: {name}_id" for name in params]}
+    if index % 5 == 0:
+        layers["taxonomy"] = {"status": "WARNING", "layer": "Taxonomy",
+                              "issues": [f"Parâmetro '{name}' fora do padrão snake_case" for name in params]}
+    return {"event": event.get('event_name'), "valid": index % 3 != 0, "layers": layers,
+            "timings": {layer: 0.1 * (i + 1) for i, layer in enumerate(layers)}}
+
+
+# --- caminho anterior ---
+
+def parse_before(body):
+    body.decode('utf-8')
+    return json.loads(body)
+
+
+def dedup_before(body, client_id):
+    raw_payload = body.decode('utf-8')
+    event_hash = hashlib.md5(raw_payload.encode('utf-8')).hexdigest()
+    key = f"{client_id or 'global'}:{event_hash}"
+    with _dedup['lock']:
+        if key in _dedup['cache']:
+            return True
+        _dedup['cache'][key] = True
+    return False
+
+
+def serialize_before(app, report):
+    return app.json.response(report).get_data()
+
+
+# --- caminho atual ---
+
+def parse_after(body):
+    return codec.loads(body)
+
+
+def dedup_after(body, client_id):
+    return _dedup['store'].seen(f"{client_id or 'global'}:".encode('utf-8') + body)
+
+
+def serialize_after(app, report):
+    return Response(codec.dumps(report) + b"\n", mimetype='application/json').get_data()
+
+
+def measure(func, items, rounds):
+    """CPU média por item (s) em cada rodada."""
+    samples = []
+    for _ in range(rounds):
+        reset_dedup()
+        start = time.process_time()
+        for item in items:
+            func(*item)
+        samples.append((time.process_time() - start) / len(items))
+    return samples
+
+
+def run(args):
+    events = load_corpus(args.corpus)
+    # cópias com client_id distinto, como no bench.py
+    events = [dict(events[i % len(events)], client_id=f"codec-{i}") for i in range(args.events)]
+    bodies = [json.dumps(event).encode('utf-8') for event in events]
+    reports = [sample_report(event, i) for i, event in enumerate(events)]
+
+    app = Flask(__name__)
+    paths = {
+        "before": {"parse": parse_before, "dedup": dedup_before, "serialize": serialize_before},
+        "after": {"parse": parse_after, "dedup": dedup_after, "serialize": serialize_after},
+    }
+    inputs = {
+        "parse": [(body,) for body in bodies],
+        "dedup": [(body, event["client_id"]) for body, event in zip(bodies, events)],
+        "serialize": [(app, report) for report in reports],
+    }
+
+    results = {}
+    with app.app_context():
+        for path, funcs in paths.items():
+            # aquecimento fora da medição
+            for step in STEPS:
+                measure(funcs[step], inputs[step][:100], 1)
+            results[path] = {step: measure(funcs[step], inputs[step], args.rounds) for step in STEPS}
+
+    def per_request(path):
+        return [sum(values) for values in zip(*(results[path][step] for step in STEPS))]
+
+    result = {
+        "meta": {
+            "mode": "codec",
+            "events": args.events,
+            "rounds": args.rounds,
+            "json_backend": codec.JSON_BACKEND,
+            "digest_backend": codec.DIGEST_BACKEND,
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+        },
+        "total": summarize(per_request("after")),
+        "layers": {step: summarize(results["after"][step]) for step in STEPS},
+        "before": {
+            "total": summarize(per_request("before")),
+            "layers": {step: summarize(results["before"][step]) for step in STEPS},
+        },
+    }
+
+    print_result(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResultado gravado em {args.out}")
+    return 0
+
+
+def print_result(result):
+    meta = result["meta"]
+    print(f"eventos={meta['events']} rodadas={meta['rounds']} "
+          f"json={meta['json_backend']} digest={meta['digest_backend']}")
+    print(f"{'CPU/requisição (µs)':<22}{'antes':>10}{'depois':>10}{'economia':>10}")
+    rows = [(step, result["before"]["layers"][step], result["layers"][step]) for step in STEPS]
+    rows.append(("total", result["before"]["total"], result["total"]))
+    for name, before, after in rows:
+        old, new = before["p50_ms"] * 1000, after["p50_ms"] * 1000
+        saved = (old - new) / old if old else 0.0
+        print(f"{name:<22}{old:>10.2f}{new:>10.2f}{saved * 100:>9.1f}%")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Arquivo NDJSON com os eventos")
+    parser.add_argument('--events', type=int, default=5000, help="Eventos por rodada (o corpus é repetido)")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--out', help="Grava o resultado em JSON")
+    args = parser.parse_args(argv)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
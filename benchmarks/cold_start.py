@@ -0,0 +1,168 @@
+"""
+Benchmark de cold start.
+
+Sobe N processos novos e mede, em cada um, o tempo de `import main` (worker
+pronto) e da primeira validação (`POST /validate` pelo test client), além das
+fases do perfil de inicialização (`startup.py`):
+
+    python benchmarks/cold_start.py -n 10 --ga4-stub --out base.json
+
+    # maiores imports (self time) de uma execução com `python -X importtime`
+    python benchmarks/cold_start.py -n 5 --importtime 15
+
+O JSON gravado segue o formato do `bench.py` (`total` = import + primeira
+validação; `layers` = cada medida), então as execuções são comparadas com:
+
+    python benchmarks/bench.py compare base.json novo.json --threshold 0.10
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from bench import API_DIR, DEFAULT_CORPUS, _git_revision, load_corpus, summarize
+
+# Executado em cada processo filho (cwd = api/); imprime uma linha JSON
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+import main
+ready = time.perf_counter()
+client = main.app.test_client()
+response = client.post('/validate', data=sys.argv[1], content_type='application/json')
+done = time.perf_counter()
+print(json.dumps({
+    "import": ready - start,
+    "first_request": done - ready,
+    "status": response.status_code,
+    "phases": main.startup_profile.report()["phases"],
+}), flush=True)
+os._exit(0)
+"""
+
+
+def run_once(payload, env, importtime=False):
+    """Um cold start: `(medidas do filho, tempo total do processo, stderr)`."""
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD, payload]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=API_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise SystemExit(f"Processo filho falhou ({proc.returncode}):\n{proc.stderr[-2000:]}")
+    return json.loads(lines[-1]), elapsed, proc.stderr
+
+
+def top_imports(stderr, limit):
+    """Maiores tempos próprios (self, ms) na saída de `-X importtime`."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|', 2))
+        rows.append((int(self_us) / 1000, int(cumulative_us) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "self_ms": round(own, 1), "cumulative_ms": round(cumulative, 1)}
+            for own, cumulative, name in rows[:limit]]
+
+
+def run(args):
+    event = load_corpus(args.corpus)[0]
+    env = dict(os.environ)
+    env.setdefault('RULE_INDEX_WARM', 'false')
+    if args.firestore_emulator:
+        env['FIRESTORE_EMULATOR_HOST'] = args.firestore_emulator
+
+    stub = None
+    if args.ga4_stub:
+        from ga4_stub import serve
+        stub = serve(0, args.ga4_latency_ms)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        env['GA4_MP_BASE_URL'] = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    samples = {"import": [], "first_request": [], "process": []}
+    phases = {}
+    totals = []
+    statuses = set()
+    try:
+        for i in range(args.runs):
+            # client_id distinto: nenhum processo compartilha estado, mas o payload fica igual ao do bench
+            payload = json.dumps(dict(event, client_id=f"cold-{i}"))
+            child, elapsed, _ = run_once(payload, env)
+            samples["import"].append(child["import"])
+            samples["first_request"].append(child["first_request"])
+            samples["process"].append(elapsed)
+            totals.append(child["import"] + child["first_request"])
+            statuses.add(child["status"])
+            for phase, ms in child["phases"].items():
+                phases.setdefault(phase, []).append(ms / 1000)
+
+        imports = None
+        if args.importtime:
+            _, _, stderr = run_once(json.dumps(event), env, importtime=True)
+            imports = top_imports(stderr, args.importtime)
+    finally:
+        if stub:
+            stub.shutdown()
+
+    layers = {name: summarize(values) for name, values in samples.items()}
+    layers.update({f"phase:{phase}": summarize(values) for phase, values in phases.items()})
+    result = {
+        "meta": {
+            "mode": "cold_start",
+            "runs": args.runs,
+            "ga4_stub": bool(stub),
+            "firestore_emulator": args.firestore_emulator,
+            "statuses": sorted(statuses),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+        },
+        "total": summarize(totals),
+        "layers": layers,
+    }
+    if imports is not None:
+        result["imports"] = imports
+
+    print_result(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResultado gravado em {args.out}")
+    return 0
+
+
+def print_result(result):
+    meta = result["meta"]
+    print(f"cold starts={meta['runs']} status={meta['statuses']}")
+    rows = [("total", result["total"])] + list(result["layers"].items())
+    print(f"{'':<24}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, stats in rows:
+        print(f"{name:<24}{stats['p50_ms']!s:>10}{stats['p95_ms']!s:>10}{stats['max_ms']!s:>10}")
+
+    if result.get("imports"):
+        print(f"\n{'import':<48}{'self ms':>10}{'cumul. ms':>12}")
+        for row in result["imports"]:
+            print(f"{row['module']:<48}{row['self_ms']:>10}{row['cumulative_ms']:>12}")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=10, help="Processos (cold starts) medidos")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="NDJSON; o primeiro evento é a primeira validação")
+    parser.add_argument('--ga4-stub', action='store_true', help="Sobe o stub do GA4 em processo")
+    parser.add_argument('--ga4-latency-ms', type=float, default=20.0)
+    parser.add_argument('--firestore-emulator', help="host:porta do emulador do Firestore")
+    parser.add_argument('--importtime', type=int, default=0,
+                        help="Lista os N maiores imports de uma execução extra com -X importtime")
+    parser.add_argument('--out', help="Grava o resultado em JSON")
+    args = parser.parse_args(argv)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
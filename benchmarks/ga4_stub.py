@@ -0,0 +1,78 @@
+"""
+Stub local do endpoint de debug do GA4 Measurement Protocol.
+
+Responde `POST /debug/mp/collect` com o mesmo formato do Google, para testar a
+Layer 4 sem rede:
+
+    python benchmarks/ga4_stub.py --port 9099 --latency-ms 50
+    GA4_MP_BASE_URL=http://localhost:9099 gunicorn ... main:app
+
+Eventos cujo nome começa com `invalid_` recebem uma mensagem de validação como
+as do Google: `fieldPath` "events" e o índice do evento na `description`.
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como o endpoint real
+        # cabeçalhos e corpo saem em escritas separadas: sem TCP_NODELAY, Nagle +
+        # ACK atrasado somam ~40 ms a cada chamada na mesma conexão
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                body = {}
+
+            if latency:
+                time.sleep(latency)
+
+            messages = []
+            for index, event in enumerate(body.get('events') or []):
+                if str(event.get('name', '')).startswith('invalid_'):
+                    messages.append({
+                        "fieldPath": "events",
+                        "description": f"Event at index: [{index}] has invalid name [{event.get('name')}]. "
+                                       "Names must start with an alphabetic character.",
+                        "validationCode": "NAME_INVALID",
+                    })
+
+            data = json.dumps({"validationMessages": messages}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _StubServer(ThreadingHTTPServer):
+    # backlog alto: o modo ASGI abre centenas de conexões simultâneas
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def serve(port=9099, latency_ms=0.0):
+    server = _StubServer(('127.0.0.1', port), make_handler(latency_ms / 1000.0))
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9099)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latência simulada por chamada")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms)
+    print(f"GA4 stub em http://127.0.0.1:{args.port} (latência {args.latency_ms}ms)")
+    server.serve_forever()
@@ -9,6 +9,7 @@ REPOSITORY="tagging-api-repo"
 IMAGE_NAME="tagging-api"
 REGION="southamerica-east1"
 SERVICE_NAME="tagging-api"
+SNAPSHOT_BUCKET="${PROJECT_ID}-snapshots"  # snapshots de regras compartilhados entre instâncias
 TAG="${1:-latest}"  # Padrão: latest; ou passe um git commit hash
 
 echo "🚀 Iniciando deploy do tagging-api..."
@@ -42,7 +43,8 @@ gcloud run deploy ${SERVICE_NAME} \
     --memory 512Mi \
     --cpu 1 \
     --timeout 300 \
-    --set-env-vars GOOGLE_CLOUD_PROJECT=${PROJECT_ID},DEDUP_TTL=2.0,DEDUP_MAXSIZE=1000 \
+    --no-cpu-throttling \
+    --set-env-vars GOOGLE_CLOUD_PROJECT=${PROJECT_ID},DEDUP_TTL=2.0,SNAPSHOT_BUCKET=${SNAPSHOT_BUCKET} \
     --service-account developer@${PROJECT_ID}.iam.gserviceaccount.com \
     --allow-unauthenticated
 
@@ -1,4 +1,129 @@
 const debugMode = false
+
+// Validação em lote: eventos acumulados e enviados a /validate/batch (NDJSON)
+const VALIDATION_ENDPOINT = 'https://tagging-api-azvnjols4q-rj.a.run.app/validate/batch'
+const VALIDATION_BATCH_SIZE = 25        // eventos por requisição
+const VALIDATION_FLUSH_INTERVAL = 5000  // ms até enviar um lote incompleto
+const VALIDATION_MAX_QUEUE = 500        // eventos em espera (os mais antigos são descartados)
+const VALIDATION_MAX_BACKOFF = 60000    // ms
+
+class ValidationTransport {
+    constructor(endpoint, { batchSize = VALIDATION_BATCH_SIZE, flushInterval = VALIDATION_FLUSH_INTERVAL, maxQueue = VALIDATION_MAX_QUEUE } = {}) {
+        this.endpoint = endpoint
+        this.batchSize = batchSize
+        this.flushInterval = flushInterval
+        this.maxQueue = maxQueue
+        this.queue = []
+        this.timer = null
+        this.timerDue = 0
+        this.sending = false
+        this.blockedUntil = 0
+        this.failures = 0
+
+        // aba oculta/fechando: envia o que resta via sendBeacon (sobrevive ao unload)
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') this.flushBeacon()
+        })
+        window.addEventListener('pagehide', () => this.flushBeacon())
+    }
+
+    enqueue(event) {
+        this.queue.push(event)
+        if (this.queue.length > this.maxQueue) this.queue.splice(0, this.queue.length - this.maxQueue)
+
+        if (this.queue.length >= this.batchSize) this.flush()
+        else this.schedule(this.flushInterval)
+    }
+
+    schedule(delay) {
+        // mantém o agendamento mais próximo
+        const due = Date.now() + Math.max(0, delay)
+        if (this.timer && this.timerDue <= due) return
+        clearTimeout(this.timer)
+        this.timerDue = due
+        this.timer = setTimeout(() => {
+            this.timer = null
+            this.flush()
+        }, Math.max(0, delay))
+    }
+
+    encode(events) {
+        return events.map(event => JSON.stringify(event)).join('\n') + '\n'
+    }
+
+    async flush() {
+        if (this.sending || !this.queue.length) return
+        // backpressure: o servidor pediu para esperar (429/503 + Retry-After)
+        const wait = this.blockedUntil - Date.now()
+        if (wait > 0) return this.schedule(wait)
+
+        const batch = this.queue.splice(0, this.batchSize)
+        this.sending = true
+        try {
+            // text/plain, como no sendBeacon: requisição simples, sem preflight de CORS por lote
+            // (a API detecta o NDJSON pelo conteúdo)
+            const response = await fetch(this.endpoint, {
+                method: 'POST',
+                headers: { 'Content-Type': 'text/plain' },
+                body: this.encode(batch),
+                keepalive: true
+            })
+            if (response.status === 429 || response.status === 503) {
+                this.backoff(batch, this.retryAfter(response))
+                return
+            }
+            this.failures = 0
+            if (debugMode) this.report(await response.text())
+        } catch (error) {
+            this.backoff(batch, null)
+        } finally {
+            this.sending = false
+        }
+
+        if (this.queue.length >= this.batchSize) this.flush()
+        else if (this.queue.length) this.schedule(this.flushInterval)
+    }
+
+    backoff(batch, retryAfter) {
+        this.failures += 1
+        const delay = retryAfter !== null ? retryAfter : Math.min(VALIDATION_MAX_BACKOFF, 1000 * 2 ** this.failures)
+        this.blockedUntil = Date.now() + delay
+        // devolve o lote ao início da fila, respeitando o limite
+        this.queue.unshift(...batch)
+        if (this.queue.length > this.maxQueue) this.queue.splice(0, this.queue.length - this.maxQueue)
+        this.schedule(delay)
+    }
+
+    retryAfter(response) {
+        const value = response.headers.get('Retry-After')
+        if (!value) return null
+        const seconds = Number(value)
+        if (!Number.isNaN(seconds)) return seconds * 1000
+        const date = Date.parse(value)
+        return Number.isNaN(date) ? null : Math.max(0, date - Date.now())
+    }
+
+    flushBeacon() {
+        if (!navigator.sendBeacon || Date.now() < this.blockedUntil) return
+        while (this.queue.length) {
+            const batch = this.queue.slice(0, this.batchSize)
+            // text/plain não exige preflight de CORS; a API detecta o NDJSON pelo conteúdo
+            const sent = navigator.sendBeacon(this.endpoint, new Blob([this.encode(batch)], { type: 'text/plain' }))
+            if (!sent) break
+            this.queue.splice(0, batch.length)
+        }
+    }
+
+    report(text) {
+        text.split('\n').filter(Boolean).forEach(line => {
+            const report = JSON.parse(line)
+            if (!report.valid) console.warn('Evento inválido:', report)
+        })
+    }
+}
+
+const validationTransport = new ValidationTransport(VALIDATION_ENDPOINT)
+
 class Event {
     constructor(event_name, event_params = {}) {
         if (!window.gtag || window.dataLayer == undefined) {
@@ -13,13 +138,7 @@ class Event {
     }
 
     validate(event_name, event_params) {
-        fetch('https://tagging-api-azvnjols4q-rj.a.run.app/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ event_name, event_params })
-        }  ).then(response => response.json())
+        validationTransport.enqueue({ event_name, params: event_params })
     }
 }
 
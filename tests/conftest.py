@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Os módulos da API são importados como no container (diretório api/ no path)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+# `main` é configurado na importação: sem GCP, pollers, sink nem snapshots do host
+os.environ.update({
+    'GCP_CLIENTS_ENABLED': 'false',
+    'SNAPSHOT_DIR': tempfile.mkdtemp(prefix='tagging-tests-'),
+    'SNAPSHOT_POLL_INTERVAL': '0',
+    'RULE_INDEX_POLL_INTERVAL': '0',
+    'REPORT_SINK': '',
+    'DEDUP_BACKEND': 'memory',
+})
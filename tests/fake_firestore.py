@@ -0,0 +1,157 @@
+"""
+Firestore em memória para os testes
+
+Cobre só o que a API usa: documentos e subcoleções, `batch()`, `where`
+(==, in, not-in, array_contains, array_contains_any), `order_by`, `limit`,
+`start_after`, `select`, `stream`/`get` e `list_documents`. `reads` conta as
+consultas e leituras de documento.
+"""
+import copy
+
+
+def _field(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    def get(self):
+        self.db.reads += 1
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        current = self.db.docs.get(self.path) if merge else None
+        self.db.docs[self.path] = dict(current or {}, **copy.deepcopy(data))
+
+    def delete(self):
+        self.db.docs.pop(self.path, None)
+
+    def collection(self, name):
+        return FakeCollection(self.db, self.path + (name,))
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit=None, after=None):
+        self.db = db
+        self.path = path
+        self.filters = filters
+        self.orders = orders
+        self._limit = limit
+        self.after = after
+
+    def _copy(self, **changes):
+        state = dict(filters=self.filters, orders=self.orders, limit=self._limit, after=self.after)
+        state.update(changes)
+        return FakeQuery(self.db, self.path, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self.filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self.orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot.id)
+
+    def select(self, fields):
+        return self
+
+    def _matches(self, data):
+        for field, op, value in self.filters:
+            current = _field(data, field)
+            if op == '==' and current != value:
+                return False
+            if op == 'in' and current not in value:
+                return False
+            if op == 'not-in' and (current is None or current in value):
+                return False
+            if op == 'array_contains' and value not in (current or []):
+                return False
+            if op == 'array_contains_any' and not set(value) & set(current or []):
+                return False
+        return True
+
+    def stream(self):
+        self.db.reads += 1
+        depth = len(self.path) + 1
+        found = [(path[-1], data) for path, data in self.db.docs.items()
+                 if len(path) == depth and path[:-1] == self.path and self._matches(data)]
+        found.sort(key=lambda item: item[0])
+        for field, direction in reversed(self.orders):
+            if field != '__name__':
+                found.sort(key=lambda item: _field(item[1], field), reverse=direction == 'DESCENDING')
+        if self.after is not None:
+            found = [item for item in found if item[0] > self.after]
+        if self._limit is not None:
+            found = found[:self._limit]
+        return iter([FakeSnapshot(FakeDocument(self.db, self.path + (doc_id,)), data) for doc_id, data in found])
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path[-1]
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.path + (doc_id,))
+
+    def list_documents(self, page_size=None):
+        depth = len(self.path) + 1
+        ids = {path[depth - 1] for path in self.db.docs if len(path) >= depth and path[:depth - 1] == self.path}
+        return [self.document(doc_id) for doc_id in sorted(ids)]
+
+
+class FakeBatch:
+    def __init__(self):
+        self._ops = []
+
+    def set(self, ref, data):
+        self._ops.append((ref.set, data))
+
+    def delete(self, ref):
+        self._ops.append((ref.delete, None))
+
+    def commit(self):
+        for op, data in self._ops:
+            op(data) if data is not None else op()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def batch(self):
+        return FakeBatch()
+
+    def documents(self, collection):
+        """`{doc_id: data}` de uma coleção de primeiro nível."""
+        return {path[1]: data for path, data in self.docs.items() if len(path) == 2 and path[0] == collection}
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+ORIGIN = "https://loja.exemplo.com"
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def test_preflight_is_cached_by_the_browser(client):
+    response = client.options('/validate/batch', headers={
+        "Origin": ORIGIN,
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "Content-Type, X-CLIENT-ID",
+    })
+
+    assert response.headers["Access-Control-Max-Age"] == str(main.CORS_MAX_AGE)
+    assert "POST" in response.headers["Access-Control-Allow-Methods"]
+
+
+def test_text_plain_batch_is_read_as_ndjson(client):
+    # o tagging.js envia text/plain (requisição simples, sem preflight)
+    body = "\n".join(json.dumps({"event_name": f"cors_batch_{i}", "params": {}}) for i in range(2)) + "\n"
+    response = client.post('/validate/batch', data=body, headers={"Origin": ORIGIN, "Content-Type": "text/plain"})
+
+    assert response.status_code == 200
+    assert [json.loads(line)["index"] for line in response.get_data().splitlines()] == [0, 1]
+    assert response.headers["Access-Control-Allow-Origin"] in ("*", ORIGIN)
+    assert "Retry-After" in response.headers["Access-Control-Expose-Headers"]
+
+
+def test_retry_after_is_exposed_on_429(client, monkeypatch):
+    monkeypatch.setattr(main.load_shedder, 'try_acquire', lambda: False)
+
+    response = client.post('/validate/batch', data="{}\n", headers={"Origin": ORIGIN, "Content-Type": "text/plain"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(main.SHED_RETRY_AFTER)
+    assert "Retry-After" in response.headers["Access-Control-Expose-Headers"]
+
+
+def test_asgi_exposes_retry_after(monkeypatch):
+    import asgi
+
+    monkeypatch.setattr(main.load_shedder, 'try_acquire', lambda: False)
+
+    async def post():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post('/validate', json={"event_name": "x"}, headers={"Origin": ORIGIN})
+
+    response = asyncio.run(post())
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"] == ORIGIN
+    assert "Retry-After" in response.headers["access-control-expose-headers"]
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from dedup import ShardedDedupStore, create_store
+
+
+def test_seen_within_ttl():
+    store = ShardedDedupStore(ttl=5, shards=4)
+    assert store.seen(b"a") is False
+    assert store.seen(b"a") is True
+    assert store.seen(b"b") is False
+    assert len(store) == 2
+
+
+def test_keys_expire_after_ttl():
+    store = ShardedDedupStore(ttl=0.05, shards=1)
+    assert store.seen(b"a") is False
+    time.sleep(0.06)
+    assert store.seen(b"a") is False
+    # a chave expirada saiu do shard; só a nova inserção ficou
+    assert len(store) == 1
+
+
+def test_concurrent_writers_see_key_once():
+    store = ShardedDedupStore(ttl=5, shards=8)
+    barrier = threading.Barrier(16)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(store.seen(b"mesmo evento"))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(False) == 1
+
+
+def test_create_store_defaults_to_memory():
+    assert isinstance(create_store('memory', 2.0), ShardedDedupStore)
+
+
+def test_validate_deduplication_scopes_by_client():
+    import main
+
+    body = b'{"event_name":"dedup_client"}'
+    assert main.validate_deduplication(body, {}, client_id="cliente-a") is None
+    assert main.validate_deduplication(body, {}, client_id="cliente-b") is None
+    duplicate = main.validate_deduplication(body, {}, client_id="cliente-a")
+    assert duplicate["status"] == "ERROR" and duplicate["layer"] == "Deduplication"
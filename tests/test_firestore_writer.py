@@ -0,0 +1,161 @@
+import threading
+
+import pytest
+from google.api_core import exceptions as gexc
+
+import firestore_writer
+from fake_firestore import FakeBatch, FakeFirestore
+from firestore_writer import BulkCommitter, iter_documents
+
+
+class RecordingFirestore(FakeFirestore):
+    """FakeFirestore que registra o tamanho de cada commit e pode falhar/bloquear commits."""
+
+    def __init__(self, failures=(), gate=None):
+        super().__init__()
+        self.commits = []
+        self.failures = list(failures)
+        self.gate = gate
+        self.started = 0
+        self._lock = threading.Lock()
+
+    def batch(self):
+        db = self
+
+        class Batch(FakeBatch):
+            def commit(self):
+                with db._lock:
+                    db.started += 1
+                    failure = db.failures.pop(0) if db.failures else None
+                if db.gate is not None:
+                    db.gate.wait(5)
+                if failure is not None:
+                    raise failure
+                super().commit()
+                with db._lock:
+                    db.commits.append(len(self._ops))
+
+        return Batch()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(firestore_writer.time, 'sleep', delays.append)
+    monkeypatch.setattr(firestore_writer.random, 'random', lambda: 0.5)
+    return delays
+
+
+def _set_many(writer, db, count, prefix="doc"):
+    collection = db.collection("rules")
+    for i in range(count):
+        writer.set(collection.document(f"{prefix}{i:05d}"), {"i": i})
+
+
+def test_batches_are_split_at_firestore_limit():
+    db = RecordingFirestore()
+    with BulkCommitter(db, batch_size=1000, concurrency=4) as writer:
+        _set_many(writer, db, 1200)
+
+    assert writer.batch_size == 500
+    assert sorted(db.commits, reverse=True) == [500, 500, 200]
+    assert writer.stats["written"] == 1200 and writer.stats["batches"] == 3
+    assert len(db.documents("rules")) == 1200
+
+
+def test_drain_separates_deletes_from_writes():
+    db = RecordingFirestore()
+    collection = db.collection("rules")
+    collection.document("old").set({"i": -1})
+    with BulkCommitter(db, batch_size=10) as writer:
+        writer.delete(collection.document("old"))
+        writer.drain()
+        assert db.commits == [1]
+        _set_many(writer, db, 3)
+
+    assert writer.stats == {"written": 3, "deleted": 1, "batches": 2, "retries": 0, "errors": 0}
+    assert "old" not in db.documents("rules")
+
+
+def test_transient_errors_are_retried_with_exponential_backoff(no_sleep):
+    db = RecordingFirestore(failures=[gexc.ServiceUnavailable("503"), gexc.Aborted("contenção")])
+    progress = []
+    with BulkCommitter(db, batch_size=10, backoff=0.1, progress=progress.append) as writer:
+        _set_many(writer, db, 5)
+
+    assert no_sleep == pytest.approx([0.1, 0.2])
+    assert writer.stats["retries"] == 2 and writer.stats["errors"] == 0
+    assert db.commits == [5] and len(db.documents("rules")) == 5
+    assert progress[-1]["written"] == 5 and progress[-1]["retries"] == 2
+
+
+def test_retries_are_bounded(no_sleep):
+    db = RecordingFirestore(failures=[gexc.DeadlineExceeded("timeout")] * 3)
+    writer = BulkCommitter(db, batch_size=10, max_retries=2, backoff=0.1)
+    _set_many(writer, db, 2)
+
+    with pytest.raises(gexc.DeadlineExceeded):
+        writer.close()
+    assert len(no_sleep) == 2
+    assert writer.stats["errors"] == 1 and writer.stats["written"] == 0
+    assert db.documents("rules") == {}
+
+
+def test_non_transient_errors_are_not_retried(no_sleep):
+    db = RecordingFirestore(failures=[gexc.PermissionDenied("sem acesso")])
+    writer = BulkCommitter(db, batch_size=10)
+    _set_many(writer, db, 2)
+
+    with pytest.raises(gexc.PermissionDenied):
+        writer.close()
+    assert no_sleep == [] and db.started == 1
+
+
+def test_batches_in_flight_are_bounded():
+    gate = threading.Event()
+    db = RecordingFirestore(gate=gate)
+    writer = BulkCommitter(db, batch_size=1, concurrency=1)
+    added = []
+
+    def produce():
+        collection = db.collection("rules")
+        for i in range(6):
+            writer.set(collection.document(str(i)), {"i": i})
+            added.append(i)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(0.3)
+
+    # concorrência 1 → 2 batches em voo (1 executando + 1 na fila); o produtor espera no terceiro
+    assert producer.is_alive()
+    assert len(added) == 2 and db.started == 1
+
+    gate.set()
+    producer.join(5)
+    writer.close()
+    assert writer.stats["written"] == 6 and len(db.documents("rules")) == 6
+
+
+@pytest.mark.parametrize("count,queries", [(25, 3), (20, 3), (0, 1)])
+def test_iter_documents_pages_in_name_order(count, queries):
+    db = FakeFirestore()
+    collection = db.collection("rules")
+    for i in range(count):
+        collection.document(f"{i:03d}").set({"i": i, "kind": "odd" if i % 2 else "even"})
+    db.reads = 0
+
+    ids = [snap.id for snap in iter_documents(collection, page_size=10)]
+
+    assert ids == [f"{i:03d}" for i in range(count)]
+    assert db.reads == queries
+
+
+def test_iter_documents_keeps_query_filters():
+    db = FakeFirestore()
+    collection = db.collection("rules")
+    for i in range(15):
+        collection.document(f"{i:03d}").set({"kind": "odd" if i % 2 else "even"})
+
+    ids = [snap.id for snap in iter_documents(collection.where("kind", "==", "odd"), page_size=4)]
+    assert ids == [f"{i:03d}" for i in range(1, 15, 2)]
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from ga4_client import GA4Client, build_request, parse_response
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+
+def _message(index, name="bad"):
+    # formato do endpoint de debug: índice na description, fieldPath só "events"
+    return {
+        "fieldPath": "events",
+        "description": f"Event at index: [{index}] has invalid name [{name}]. "
+                       "Names must start with an alphabetic character.",
+        "validationCode": "NAME_INVALID",
+    }
+
+
+def test_messages_go_to_the_event_in_the_description():
+    results = parse_response(200, lambda: {"validationMessages": [_message(1), _message(3)]}, 4)
+
+    assert results[0] is None and results[2] is None
+    assert results[1]["google_feedback"] == [_message(1)]
+    assert results[3]["google_feedback"] == [_message(3)]
+
+
+def test_messages_without_index_apply_to_every_event():
+    message = {"fieldPath": "client_id", "description": "client_id is required.", "validationCode": "VALUE_REQUIRED"}
+    results = parse_response(200, lambda: {"validationMessages": [message, _message(7)]}, 2)
+
+    # índice fora da chamada também vale para todos
+    assert [r["google_feedback"] for r in results] == [[message, _message(7)]] * 2
+
+
+def test_valid_chunk():
+    assert parse_response(200, lambda: {"validationMessages": []}, 3) == [None, None, None]
+
+
+def test_http_errors_are_independent_per_event():
+    results = parse_response(500, lambda: {}, 2)
+    assert results[0] == results[1] == {"status": "ERROR", "layer": "Google Protocol", "message": "⚠️ sHTTP 500"}
+    assert results[0] is not results[1]
+
+
+def test_build_request_groups_events():
+    payloads = [{"measurement_id": "G-1", "api_secret": "s", "client_id": "c", "event_name": f"e{i}",
+                 "params": {"i": i}} for i in range(2)]
+    query, body = build_request(payloads)
+    assert query == {"measurement_id": "G-1", "api_secret": "s"}
+    assert body["client_id"] == "c"
+    assert [event["name"] for event in body["events"]] == ["e0", "e1"]
+
+
+@pytest.fixture
+def stub():
+    from ga4_stub import serve
+
+    server = serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_chunk_against_stub(stub):
+    client = GA4Client(stub)
+    payloads = [{"measurement_id": "G-1", "api_secret": "s", "event_name": name}
+                for name in ("page_view", "invalid_click", "scroll")]
+
+    (positions, chunk), = client.plan(payloads)
+    results = client.validate_chunk(chunk)
+
+    assert positions == [0, 1, 2]
+    assert results[0] is None and results[2] is None
+    assert results[1]["status"] == "ERROR"
+    assert "index: [1]" in results[1]["google_feedback"][0]["description"]
@@ -0,0 +1,87 @@
+import pytest
+
+import main
+from fake_firestore import FakeFirestore
+from map_manifest import SHARD_CAPACITY, SHARD_MAX_BYTES, _entry_size, load_manifest, split_shards
+
+
+def _doc(label, extra=None):
+    params = {"page_path": "/", "section": "menu", "label": label}
+    params.update(extra or {})
+    return {"metadata": {"map_id": "site", "map_version": 3}, "event_name": "click", "params": params}
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(main, 'get_db', lambda: db)
+    return db
+
+
+def _load(events, incremental=True):
+    return main.update_firestore_cache(dict(events), map_id="site", map_version=3, incremental=incremental)
+
+
+def test_first_incremental_load_without_manifest_is_full(firestore):
+    stats = _load({"a": _doc("a"), "b": _doc("b")})
+
+    assert stats["mode"] == "full"
+    assert stats["added"] == 2 and stats["written"] == 2
+    assert set(load_manifest(firestore, "site", 3)) == {"a", "b"}
+    stored = firestore.documents(main.COLLECTION_NAME)
+    assert stored["a"]["lookup_keys"] == main.doc_lookup_keys(_doc("a"))
+
+
+def test_incremental_load_writes_only_the_diff(firestore):
+    _load({"a": _doc("a"), "b": _doc("b"), "c": _doc("c")})
+
+    stats = _load({"a": _doc("a"), "b": _doc("b", {"value": "novo"}), "d": _doc("d")})
+
+    assert stats["mode"] == "incremental"
+    assert {key: stats[key] for key in ("added", "changed", "removed", "unchanged")} == \
+        {"added": 1, "changed": 1, "removed": 1, "unchanged": 1}
+    assert stats["written"] == 2 and stats["deleted"] == 1
+    stored = firestore.documents(main.COLLECTION_NAME)
+    assert set(stored) == {"a", "b", "d"}
+    assert stored["b"]["params"]["value"] == "novo"
+    assert set(load_manifest(firestore, "site", 3)) == {"a", "b", "d"}
+
+
+def test_unchanged_map_writes_nothing(firestore):
+    events = {"a": _doc("a"), "b": _doc("b")}
+    _load(events)
+
+    stats = _load(events)
+    assert stats["unchanged"] == 2 and stats["written"] == 0 and stats["deleted"] == 0
+
+
+def test_full_load_replaces_version(firestore):
+    _load({"a": _doc("a"), "b": _doc("b")})
+
+    stats = _load({"c": _doc("c")}, incremental=False)
+    assert stats["mode"] == "full" and stats["deleted"] == 2
+    assert set(firestore.documents(main.COLLECTION_NAME)) == {"c"}
+    assert set(load_manifest(firestore, "site", 3)) == {"c"}
+
+
+def test_manifest_shards_respect_size_and_capacity():
+    long_ids = {("x" * 200) + str(i): "0123456789abcdef" for i in range(12000)}
+    shards = list(split_shards(long_ids))
+    assert sum(len(shard) for shard in shards) == len(long_ids)
+    assert all(sum(_entry_size(k, v) for k, v in shard.items()) <= SHARD_MAX_BYTES for shard in shards)
+
+    short_ids = {str(i): "0123456789abcdef" for i in range(SHARD_CAPACITY + 1)}
+    assert [len(shard) for shard in split_shards(short_ids)] == [SHARD_CAPACITY, 1]
+    assert list(split_shards({})) == [{}]
+
+
+def test_manifest_round_trip_drops_extra_shards(firestore, monkeypatch):
+    import map_manifest
+
+    monkeypatch.setattr(map_manifest, 'SHARD_CAPACITY', 2)
+    map_manifest.save_manifest(firestore, "site", 3, {str(i): "h" for i in range(5)})
+    map_manifest.save_manifest(firestore, "site", 3, {"0": "h"})
+
+    assert load_manifest(firestore, "site", 3) == {"0": "h"}
+    root = firestore.collection(map_manifest.MANIFEST_COLLECTION).document(map_manifest.manifest_id("site", 3))
+    assert [ref.id for ref in root.collection('shards').list_documents()] == ["0"]
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+import main
+from jobs import JobRegistry, LoadJob
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    calls = []
+
+    def submit(map_id, map_version, run, mode=None):
+        calls.append((map_id, map_version, mode))
+        return LoadJob(map_id, map_version, mode), True
+
+    monkeypatch.setattr(main, 'get_bq_client', lambda: object())
+    monkeypatch.setattr(main.load_jobs, 'submit', submit)
+    return calls
+
+
+@pytest.mark.parametrize("map_version", ["v2", "2.1", 2.5, True, [3], {"v": 3}])
+def test_loadmap_rejects_non_integer_map_version(client, submitted, map_version):
+    response = client.post('/loadmap', json={"map_id": "site", "map_version": map_version})
+
+    assert response.status_code == 400
+    assert "map_version" in response.get_json()["message"]
+    assert submitted == []
+
+
+@pytest.mark.parametrize("map_version,expected", [(3, 3), ("4", 4), (None, None)])
+def test_loadmap_accepts_integer_map_version(client, submitted, map_version, expected):
+    response = client.post('/loadmap', json={"map_id": "site", "map_version": map_version})
+
+    assert response.status_code == 202
+    assert submitted == [("site", expected, main.LOADMAP_DEFAULT_MODE)]
+
+
+def test_loadmap_requires_map_id_and_valid_mode(client, submitted):
+    assert client.post('/loadmap', json={"map_version": 3}).status_code == 400
+    assert client.post('/loadmap', json=["site"]).status_code == 400
+    assert client.post('/loadmap', json={"map_id": "site", "mode": "parcial"}).status_code == 400
+    assert submitted == []
+
+
+@pytest.fixture
+def running_job(monkeypatch):
+    """Registro real com uma carga que fica em andamento até `release.set()`."""
+    release = threading.Event()
+    registry = JobRegistry(max_workers=2)
+    monkeypatch.setattr(main, 'get_bq_client', lambda: object())
+    monkeypatch.setattr(main, 'load_jobs', registry)
+    monkeypatch.setattr(main, 'run_map_load', lambda job: release.wait(5))
+    yield registry
+    release.set()
+    registry._executor.shutdown(wait=True)
+
+
+def test_same_load_is_deduplicated(client, running_job):
+    first = client.post('/loadmap', json={"map_id": "site", "map_version": 4, "mode": "incremental"}).get_json()
+    again = client.post('/loadmap', json={"map_id": "site", "map_version": "4", "mode": "incremental"})
+
+    assert again.status_code == 202
+    assert again.get_json()["deduplicated"] is True
+    assert again.get_json()["job_id"] == first["job_id"]
+
+
+@pytest.mark.parametrize("body", [
+    {"map_id": "site", "map_version": 5, "mode": "incremental"},
+    {"map_id": "site", "map_version": 4, "mode": "full"},
+    {"map_id": "site", "mode": "incremental"},
+])
+def test_load_with_other_parameters_conflicts(client, running_job, body):
+    first = client.post('/loadmap', json={"map_id": "site", "map_version": 4, "mode": "incremental"}).get_json()
+    response = client.post('/loadmap', json=body)
+
+    assert response.status_code == 409
+    data = response.get_json()
+    assert data["job_id"] == first["job_id"]
+    assert data["running"] == {"map_version": 4, "mode": "incremental"}
+
+
+def test_other_map_runs_in_parallel(client, running_job):
+    first = client.post('/loadmap', json={"map_id": "site", "map_version": 4}).get_json()
+    other = client.post('/loadmap', json={"map_id": "app", "map_version": 5})
+
+    assert other.status_code == 202
+    assert other.get_json()["deduplicated"] is False
+    assert other.get_json()["job_id"] != first["job_id"]
+
+
+def test_finished_job_does_not_block_new_load():
+    registry = JobRegistry(max_workers=1)
+    job, created = registry.submit("site", 4, lambda job: None, mode="full")
+    registry._executor.submit(lambda: None).result(5)  # o worker único já terminou o job
+
+    again, created_again = registry.submit("site", 5, lambda job: None, mode="incremental")
+    registry._executor.shutdown(wait=True)
+
+    assert created and created_again and again is not job
+    assert job.status == again.status == "SUCCESS"
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import main
+from fake_firestore import FakeFirestore
+from lookup_cache import AsyncSingleFlight, NegativeCache, SingleFlight
+
+
+def test_negative_cache_ttl_and_size():
+    cache = NegativeCache(ttl=0.05, maxsize=2)
+    cache.put("a", True)
+    assert cache.get("a") is True and cache.hits == 1
+    cache.put("b", True)
+    cache.put("c", True)
+    assert len(cache) == 2
+    time.sleep(0.06)
+    assert cache.get("c") is None
+
+
+def test_negative_cache_disabled():
+    cache = NegativeCache(ttl=0)
+    cache.put("a", True)
+    assert cache.get("a") is None
+
+
+def test_single_flight_runs_once_for_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def read():
+        calls.append(1)
+        release.wait(1)
+        return {"doc": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", read))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while flight.shared < 7:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"doc": 1}] * 8
+    # a chave é liberada ao terminar: a próxima chamada executa de novo
+    assert flight.do("k", lambda: "novo") == "novo"
+
+
+def test_single_flight_propagates_errors_to_followers():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(1)
+        raise RuntimeError("Firestore indisponível")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(1)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flight.shared < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert errors == ["Firestore indisponível"] * 2
+
+
+def test_async_single_flight():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def read():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "regra"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", read) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["regra"] * 5
+    assert len(calls) == 1 and flight.shared == 4
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(main, 'get_db', lambda: db)
+    main.rule_index.invalidate()
+    main.negative_cache.clear()
+    yield db
+    main.rule_index.invalidate()
+    main.negative_cache.clear()
+
+
+def test_undocumented_event_is_cached_until_index_changes(firestore):
+    payload = {"event_name": "evento_sem_regra", "metadata": {"map_id": "site", "map_version": 3}}
+    key = main._schema_lookup_key(payload)
+
+    doc, result = main._resolve_rule(payload, key)
+    assert doc is None and result["status"] == "WARNING"
+    reads = firestore.reads
+    main._resolve_rule(payload, key)
+    assert firestore.reads == reads
+
+    # nova publicação (versão do índice) descarta o cache negativo
+    main.rule_index.invalidate()
+    main._resolve_rule(payload, key)
+    assert firestore.reads == reads + 1
+
+
+def test_rule_read_goes_to_index(firestore):
+    doc_id = main.metadata_doc_id("click", {"map_id": "site", "map_version": 3, "page_path": "/"})
+    firestore.collection(main.COLLECTION_NAME).document(doc_id).set({
+        "event_name": "click", "params": {"page_path": "/"},
+        "metadata": {"map_id": "site", "map_version": 3},
+    })
+    payload = {"event_name": "click", "metadata": {"map_id": "site", "map_version": 3, "page_path": "/"}}
+
+    doc, result = main._resolve_rule(payload, main._schema_lookup_key(payload))
+    assert result is None and doc["event_name"] == "click"
+    reads = firestore.reads
+    assert main._resolve_rule(payload, main._schema_lookup_key(payload))[0] == doc
+    assert firestore.reads == reads
@@ -0,0 +1,131 @@
+import itertools
+import json
+
+import pytest
+
+import rule_index
+from map_registry import MapRegistry
+from rule_index import RuleIndex, map_scope
+
+
+def _doc(version=3, map_id="site", event_name="click", **params):
+    return {"metadata": {"map_id": map_id, "map_version": version}, "event_name": event_name, "params": params}
+
+
+def _size(doc):
+    return len(json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def _put(index, version, label="menu", map_id="site"):
+    doc_id = f"{map_id}_{version}_click_{label}"
+    assert index.put(doc_id, _doc(version, map_id, page_path="/", label=label), index.version)
+    return doc_id
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1)
+    monkeypatch.setattr(rule_index.time, 'monotonic', lambda: float(next(ticks)))
+
+
+class _NoSnapshots:
+    generation = 0
+
+    def latest(self):
+        return {}
+
+
+def test_newest_version_stays_resident_over_budget(clock):
+    index = RuleIndex(budget=1)
+
+    doc_id = _put(index, 3)
+
+    assert index.get(doc_id) is not None
+    assert index.stats()["resident_bytes"] > index.budget
+    assert index.evictions == 0
+
+    # uma versão mais nova torna a anterior fria: ela sai, a nova fica
+    newer = _put(index, 4)
+    assert index.get(doc_id) is None and index.get(newer) is not None
+    assert index.latest() == {"site": "4"}
+    assert index.evictions == 1
+
+
+def test_cold_versions_are_evicted_least_recently_used_first(clock):
+    size = _size(_doc(1, page_path="/", label="menu"))
+    index = RuleIndex(budget=3 * size)
+    v1, v2, v3 = (_put(index, version) for version in (1, 2, 3))
+
+    # v1 usada depois de v2: v2 é a mais fria
+    assert index.get(v1) is not None
+    v4 = _put(index, 4)
+
+    assert index.get(v2) is None
+    assert all(index.get(doc_id) is not None for doc_id in (v1, v3, v4))
+    assert index.find("click", {"page_path": "/", "label": "menu"}, [map_scope("site", 2)]) is None
+
+    # nova versão: a próxima mais fria é v1 (v3 e v4 foram lidas depois)
+    v5 = _put(index, 5)
+    assert index.get(v1) is None
+    assert {doc_id for doc_id in (v3, v4, v5) if index.get(doc_id)} == {v3, v4, v5}
+    assert index.evictions == 2
+    assert index.stats()["resident_bytes"] <= index.budget
+
+
+def test_newest_version_of_each_map_is_kept(clock):
+    index = RuleIndex(budget=1)
+    site = _put(index, 3)
+    app = _put(index, 7, map_id="app")
+
+    assert index.get(site) is not None and index.get(app) is not None
+    assert index.latest() == {"site": "3", "app": "7"}
+
+
+def test_reput_removes_old_lookup_keys():
+    index = RuleIndex()
+    doc_id = "site_3_click_menu"
+    index.put(doc_id, _doc(page_path="/", label="menu"), index.version)
+
+    index.put(doc_id, _doc(page_path="/", label="rodapé"), index.version)
+
+    scopes = [map_scope("site", 3)]
+    assert index.find("click", {"page_path": "/", "label": "menu"}, scopes) is None
+    assert index.find("click", {"page_path": "/", "label": "rodapé"}, scopes)["params"]["label"] == "rodapé"
+    assert index.find("click", {"page_path": "/"}, scopes)["params"]["label"] == "rodapé"
+
+
+def test_reput_hands_shared_key_to_next_document():
+    index = RuleIndex()
+    index.put("site_3_a", _doc(page_path="/", label="a"), index.version)
+    index.put("site_3_b", _doc(page_path="/", label="b"), index.version)
+    scopes = [map_scope("site", 3)]
+    assert index.find("click", {"page_path": "/"}, scopes)["params"]["label"] == "a"
+
+    index.put("site_3_a", _doc(page_path="/outra", label="a"), index.version)
+
+    assert index.find("click", {"page_path": "/"}, scopes)["params"]["label"] == "b"
+    assert index.find("click", {"page_path": "/outra"}, scopes)["params"]["label"] == "a"
+
+
+def test_pinned_client_sees_pinned_version():
+    index = RuleIndex()
+    for version in (3, 4):
+        index.put(f"site_{version}_click_menu", _doc(version, page_path="/", label="menu"), index.version)
+    registry = MapRegistry(index, _NoSnapshots(), pins={"legado": {"site": 3}})
+
+    assert registry.view("legado") == (("site", "3"),)
+    assert registry.view("outro") == registry.view() == (("site", "4"),)
+    params = {"page_path": "/", "label": "menu"}
+    assert index.find("click", params, registry.view("legado"))["metadata"]["map_version"] == 3
+    assert index.find("click", params, registry.view())["metadata"]["map_version"] == 4
+
+
+def test_pick_uses_pinned_version_among_firestore_results():
+    registry = MapRegistry(RuleIndex(), _NoSnapshots(), pins={"legado": {"site": 3}})
+    docs = [("site_4_b", _doc(4)), ("site_3_b", _doc(3)), ("site_3_a", _doc(3)), ("app_7_a", _doc(7, "app"))]
+
+    assert registry.pick(docs, registry.view("legado"))[0] == "app_7_a"
+    assert registry.pick(docs[:3], registry.view("legado"))[0] == "site_3_a"
+    # mapa desconhecido em memória: vale a versão mais nova entre os resultados
+    assert registry.pick(docs[:3], registry.view())[0] == "site_4_b"
+    assert registry.pick([("site_2_a", _doc(2))], registry.view("legado")) is None
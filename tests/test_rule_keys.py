@@ -0,0 +1,19 @@
+import rule_keys
+from rule_keys import check_golden, doc_id
+
+
+def test_golden_corpus():
+    rule_keys._doc_id.cache_clear()
+    assert check_golden() == []
+
+
+def test_cache_distinguishes_equal_values_of_other_types():
+    rule_keys._doc_id.cache_clear()
+    assert doc_id('site', 3, 'click', '/', section='a', label='b') == 'site_3_click_a_b'
+    assert doc_id('site', 3.0, 'click', '/', section='a', label='b') == 'site_3_0_click_a_b'
+    assert doc_id('site', 3, 'click', '/', section='a', label='b', outbound=True) == 'site_3_click_a_b_true'
+    assert doc_id('site', 3, 'click', '/', section='a', label='b', outbound=1) == 'site_3_click_a_b_1'
+
+
+def test_unhashable_values_skip_cache():
+    assert doc_id('site', 3, 'click', ['/'], section='a') == 'site_3_click_a'
@@ -0,0 +1,140 @@
+import pytest
+
+import main
+from fake_firestore import FakeFirestore
+from map_manifest import MANIFEST_COLLECTION, LookupKeysVersions, save_manifest
+from rule_index import LOOKUP_KEYS_FIELD, doc_lookup_keys, lookup_hash, lookup_tuple, map_scope
+
+PARAMS = {"page_path": "/", "section": "header", "label": "menu"}
+LOOKUP = lookup_tuple("click", PARAMS)
+
+
+def _doc(map_id="site", version=3, lookup_keys=True, **params):
+    doc = {"metadata": {"map_id": map_id, "map_version": version}, "event_name": "click",
+           "params": dict(PARAMS, **params)}
+    if lookup_keys:
+        doc[LOOKUP_KEYS_FIELD] = doc_lookup_keys(doc)
+    return doc
+
+
+def _add(db, doc_id, doc):
+    db.collection(main.COLLECTION_NAME).document(doc_id).set(doc)
+
+
+def _view(*scopes):
+    return tuple(sorted(map_scope(m, v) for m, v in scopes))
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
+
+
+def test_view_keys_are_split_in_chunks_of_30(db):
+    view = _view(*((f"mapa{i:02d}", 1) for i in range(65)))
+
+    scoped, _ = main._rule_lookup_queries(db.collection(main.COLLECTION_NAME), LOOKUP, view)
+
+    assert [len(query.filters[0][2]) for query in scoped] == [30, 30, 5]
+    assert all(query.filters[0][:2] == (LOOKUP_KEYS_FIELD, 'array_contains_any') for query in scoped)
+    assert all(query._limit == 1 and query.orders == (('__name__', 'ASCENDING'),) for query in scoped)
+    keys = [key for query in scoped for key in query.filters[0][2]]
+    assert keys == [lookup_hash(LOOKUP, scope) for scope in view]
+
+
+def test_unknown_maps_query_excludes_view_maps(db):
+    collection = db.collection(main.COLLECTION_NAME)
+
+    _, unknown = main._rule_lookup_queries(collection, LOOKUP, _view(("site", 3), ("site", 4), ("app", 7)))
+    assert unknown.filters == ((LOOKUP_KEYS_FIELD, 'array_contains', lookup_hash(LOOKUP)),
+                               ('metadata.map_id', 'not-in', ['app', 'site']))
+    assert unknown.orders[:2] == (('metadata.map_id', 'ASCENDING'), ('metadata.map_version', 'DESCENDING'))
+    assert unknown._limit == 1
+
+    # acima do limite do `not-in` (e com a visão vazia) o filtro fica em `_pick_lookup`
+    _, unknown = main._rule_lookup_queries(collection, LOOKUP, _view(*((f"m{i}", 1) for i in range(11))))
+    assert [f[1] for f in unknown.filters] == ['array_contains']
+    _, unknown = main._rule_lookup_queries(collection, LOOKUP, ())
+    assert [f[1] for f in unknown.filters] == ['array_contains']
+
+
+def test_pick_lookup():
+    view = _view(("site", 3))
+    site = ("site_3_b", _doc())
+    app = ("app_7_a", _doc("app", 7))
+
+    assert main._pick_lookup([site, ("site_3_a", _doc())], app, view)[0] == "site_3_a"
+    assert main._pick_lookup([], app, view) == app
+    # mapa da visão já consultado pela versão dela: a versão mais nova não vale
+    assert main._pick_lookup([], ("site_4_a", _doc(version=4)), view) is None
+    assert main._pick_lookup([], None, view) is None
+
+
+def test_lookup_rule_uses_view_version(db):
+    _add(db, "site_3_b", _doc())
+    _add(db, "site_3_a", _doc())
+    _add(db, "site_4_a", _doc(version=4))
+    _add(db, "site_3_outro", _doc(label="outro"))
+    collection = db.collection(main.COLLECTION_NAME)
+
+    assert main._lookup_rule(collection, LOOKUP, _view(("site", 3)))[0] == "site_3_a"
+    assert main._lookup_rule(collection, LOOKUP, _view(("site", 4)))[0] == "site_4_a"
+    # mapa desconhecido em memória: versão mais nova
+    assert main._lookup_rule(collection, LOOKUP, ())[0] == "site_4_a"
+    assert main._lookup_rule(collection, LOOKUP, _view(("site", 5))) is None
+
+
+def test_lookup_keys_versions_from_manifests(db):
+    save_manifest(db, "site", 4, {"site_4_a": "h"})
+    # manifesto gravado antes da marca
+    db.collection(MANIFEST_COLLECTION).document("site__3").set({"map_id": "site", "map_version": 3})
+    versions = LookupKeysVersions()
+
+    assert not versions.covers(_view(("site", 4)))
+    versions.reload(db)
+    assert versions.covers(_view(("site", 4)))
+    assert not versions.covers(_view(("site", 3)))
+    assert not versions.covers(_view(("site", 4), ("app", 7)))
+    assert not versions.covers(())
+
+    versions.add("app", 7)
+    assert versions.covers(_view(("site", 4), ("app", 7)))
+    versions.clear()
+    assert not versions.covers(_view(("site", 4)))
+
+
+@pytest.fixture
+def firestore(db, monkeypatch):
+    monkeypatch.setattr(main, 'get_db', lambda: db)
+    monkeypatch.setattr(main, 'lookup_keys_versions', LookupKeysVersions())
+    main.rule_index.invalidate()
+    main.negative_cache.clear()
+    yield db
+    main.rule_index.invalidate()
+    main.negative_cache.clear()
+
+
+def _read(view):
+    return main._read_rule('query', LOOKUP, view, "click", PARAMS, main.rule_index.version)
+
+
+@pytest.mark.parametrize("mode,covered,legacy_query", [
+    ("auto", False, True),
+    ("auto", True, False),
+    ("true", True, True),
+    ("false", False, False),
+])
+def test_legacy_fallback_only_for_versions_without_lookup_keys(firestore, monkeypatch, mode, covered, legacy_query):
+    monkeypatch.setattr(main, 'RULE_LOOKUP_LEGACY_FALLBACK', mode)
+    _add(firestore, "site_3_a", _doc(lookup_keys=False))
+    if covered:
+        save_manifest(firestore, "site", 3, {"site_3_a": "h"})
+    main.lookup_keys_versions.reload(firestore)
+    reads = firestore.reads
+
+    doc, result = _read(_view(("site", 3)))
+
+    # lookup_keys: consulta da visão + mapas desconhecidos; o fallback é a terceira
+    assert firestore.reads - reads == (3 if legacy_query else 2)
+    assert (doc is not None) == legacy_query
+    assert result is None if legacy_query else result["status"] == "WARNING"
@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+import shedding
+from shedding import LoadShedder, Sampler
+
+
+def _payloads(n=2000):
+    return [json.dumps({"event_name": "click", "params": {"i": i}}) for i in range(n)]
+
+
+def test_sampling_is_deterministic_and_nested():
+    sampler = Sampler({"schema": {"default": 0.1}, "google_mp": {"default": 0.2}})
+    payloads = _payloads()
+
+    schema = {raw for raw in payloads if sampler.skip_reason("schema", raw) is None}
+    ga4 = {raw for raw in payloads if sampler.skip_reason("google_mp", raw) is None}
+
+    assert schema == {raw for raw in payloads if sampler.skip_reason("schema", raw) is None}
+    # a mesma amostra vale para as duas layers: quem roda o Schema também roda o GA4
+    assert schema <= ga4
+    assert 0.05 < len(schema) / len(payloads) < 0.15
+    assert 0.15 < len(ga4) / len(payloads) < 0.25
+    assert sampler.skip_reason("schema", payloads[0].encode('utf-8')) == sampler.skip_reason("schema", payloads[0])
+
+
+def test_sampling_overrides_take_lowest_rate():
+    sampler = Sampler({"google_mp": {"default": 0.5, "events": {"purchase": 1, "scroll": 0.2},
+                                     "clients": {"app-x": 0.01}}})
+
+    assert sampler.rate("google_mp", "purchase") == 1.0
+    assert sampler.rate("google_mp", "purchase", "app-x") == 0.01
+    assert sampler.rate("google_mp", "scroll", "app-y") == 0.2
+    assert sampler.rate("google_mp", "click") == 0.5
+    assert sampler.rate("schema", "click") == 1.0
+    assert sampler.skip_reason("google_mp", "{}", "purchase") is None
+    assert Sampler({"google_mp": {"default": 0}}).skip_reason("google_mp", "{}") == "Fora da amostragem (taxa 0)."
+    assert not Sampler({}).enabled
+
+
+def test_max_inflight_rejects_and_counts():
+    shedder = LoadShedder(max_inflight=2)
+
+    assert shedder.try_acquire() and shedder.try_acquire()
+    assert not shedder.try_acquire()
+    assert (shedder.inflight, shedder.rejected) == (2, 1)
+    shedder.release()
+    assert shedder.try_acquire()
+
+
+def test_latency_probe_passes_once_per_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(shedding.time, 'monotonic', lambda: now[0])
+    shedder = LoadShedder(latency_ms={"google_mp": 100}, probe_interval=1.0)
+
+    assert shedder.skip_reason("google_mp") is None
+    shedder.observe("google_mp", 0.5)
+    # acima do limite: a primeira chamada é a sonda, as seguintes são puladas até o próximo intervalo
+    assert shedder.skip_reason("google_mp") is None
+    assert shedder.skip_reason("google_mp") == "Latência alta (500 ms, limite 100 ms)."
+    now[0] += 0.5
+    assert shedder.skip_reason("google_mp") is not None
+    now[0] += 0.5
+    assert shedder.skip_reason("google_mp") is None
+    assert shedder.skip_reason("google_mp") is not None
+
+    # sondas rápidas trazem a EWMA de volta para baixo do limite
+    for _ in range(20):
+        shedder.observe("google_mp", 0.01)
+    assert shedder.skip_reason("google_mp") is None
+    assert shedder.skip_reason("google_mp") is None
+    assert shedder.skip_reason("schema") is None
+
+
+@pytest.fixture
+def shedder(monkeypatch):
+    shedder = LoadShedder(max_inflight=1, degrade_inflight=1, retry_after=main.SHED_RETRY_AFTER)
+    monkeypatch.setattr(main, 'load_shedder', shedder)
+    return shedder
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def test_over_limit_returns_429_with_retry_after(client, shedder):
+    assert shedder.try_acquire()
+
+    response = client.post('/validate', json={"event_name": "click"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(main.SHED_RETRY_AFTER)
+    assert response.get_json() == main.OVERLOADED
+    assert (shedder.inflight, shedder.rejected) == (1, 1)
+
+
+def test_high_load_skips_ga4_and_firestore(shedder, monkeypatch):
+    payload = {"event_name": "click", "measurement_id": "G-X", "api_secret": "s",
+               "metadata": {"map_id": "site", "map_version": 3}}
+    assert main.skipped_layers(json.dumps(payload), payload) == {}
+
+    shedder.inflight = 2
+    skipped = main.skipped_layers(json.dumps(payload), payload)
+    assert skipped["google_mp"]["status"] == "SKIPPED"
+    assert "Carga alta (2 validações em andamento)" in skipped["google_mp"]["message"]
+    assert "schema" not in skipped
+
+    # o Schema continua com as regras em memória, mas não vai ao Firestore
+    reads = []
+    monkeypatch.setattr(main, 'get_db', lambda: reads.append(1) or object())
+    main.rule_index.invalidate()
+    main.negative_cache.clear()
+    doc, result = main._resolve_rule(payload, main._schema_lookup_key(payload))
+    assert doc is None and result["status"] == "SKIPPED" and result["layer"] == "Schema"
+    assert result["message"].startswith("Regra fora da memória")
+
+
+def _batch(n):
+    return "\n".join(json.dumps({"event_name": f"shed_batch_{i}", "params": {}}) for i in range(n)) + "\n"
+
+
+def test_batch_slot_is_released_after_streaming(client, shedder):
+    response = client.post('/validate/batch', data=_batch(3), content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    assert len(response.get_data().splitlines()) == 3
+    assert shedder.inflight == 0
+    assert client.post('/validate/batch', data=_batch(1), content_type='application/x-ndjson').status_code == 200
+    assert (shedder.inflight, shedder.rejected) == (0, 0)
+
+
+def test_batch_slot_is_released_when_client_disconnects(client, shedder):
+    response = client.post('/validate/batch', data=_batch(3), content_type='application/x-ndjson',
+                           buffered=False)
+    lines = iter(response.response)
+    next(lines)
+    assert shedder.inflight == 1
+
+    response.close()
+    assert shedder.inflight == 0
+
+
+def test_asgi_validate_releases_slot(shedder):
+    import asgi
+
+    async def post():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post('/validate', json={"event_name": "click"})
+
+    assert asyncio.run(post()).status_code != 429
+    assert shedder.inflight == 0
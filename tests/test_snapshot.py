@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+import snapshot
+from snapshot import MAGIC, Snapshot, SnapshotStore, read_header
+
+
+def _doc(event_name="click", version=3, **params):
+    return {"metadata": {"map_id": "site", "map_version": version}, "event_name": event_name, "params": params}
+
+
+RULES = {
+    "site_3_click_header_menu": _doc(page_path="/", section="header", label="menu"),
+    "site_3_click_footer_parceiro": _doc(page_path="/", section="footer", label="parceiro"),
+    "site_3_view_home": _doc("page_view", page_path="/", title="Home"),
+    "site_3_click_ação": _doc(page_path="/promoções", section="header", label="ação"),
+}
+
+
+def _write(store, version=3, docs=RULES, token="t1"):
+    writer = store.writer("site", version)
+    for doc_id, doc in docs.items():
+        writer.add(doc_id, doc)
+    path = writer.commit(token)
+    store.load()
+    return path
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path), keep_versions=2)
+
+
+def test_round_trip_by_doc_id(store):
+    path = _write(store)
+
+    header = read_header(path)
+    assert header["count"] == len(RULES) and header["token"] == "t1"
+    assert (header["map_id"], header["map_version"]) == ("site", 3)
+
+    reader = Snapshot(path)
+    assert len(reader) == len(RULES)
+    for doc_id, doc in RULES.items():
+        assert reader.get(doc_id) == doc
+    assert reader.get("site_3_inexistente") is None
+
+
+def test_find_by_lookup_key(store):
+    reader = Snapshot(_write(store))
+
+    assert reader.find("click", {"page_path": "/", "section": "footer", "label": "parceiro"}) == \
+        ("site_3_click_footer_parceiro", RULES["site_3_click_footer_parceiro"])
+    assert reader.find("page_view", {"page_path": "/", "title": "Home"})[0] == "site_3_view_home"
+    assert reader.find("click", {"page_path": "/promoções", "label": "ação"})[0] == "site_3_click_ação"
+    # campos ausentes no evento são curinga; entre regras empatadas vale o menor doc_id
+    assert reader.find("click", {"page_path": "/"})[0] == "site_3_click_footer_parceiro"
+    assert reader.find("click", {"page_path": "/", "section": "rodapé"}) is None
+    assert reader.find("scroll", {"page_path": "/"}) is None
+
+
+def test_hash_collisions_are_checked_against_the_record(store, monkeypatch):
+    monkeypatch.setattr(snapshot, '_h64', lambda text: 7)
+    reader = Snapshot(_write(store))
+
+    assert reader.get("site_3_view_home") == RULES["site_3_view_home"]
+    # na tabela secundária a chave que colide vira miss (vai ao Firestore), nunca a regra de outra chave
+    assert reader.find("click", {"page_path": "/", "section": "header", "label": "menu"}) is None
+    assert reader.find("click", {"page_path": "/promoções", "section": "header", "label": "ação"})[0] == \
+        "site_3_click_ação"
+
+
+def test_store_serves_active_version(store):
+    _write(store)
+
+    assert store.latest() == {"site": "3"}
+    assert store.get("site_3_view_home", "site", 3) == RULES["site_3_view_home"]
+    assert store.find("click", {"page_path": "/", "section": "header", "label": "menu"}, [("site", "3")])[0] == \
+        "site_3_click_header_menu"
+    assert store.hits == 2
+
+
+def test_token_mismatch_rejects_snapshot(store):
+    _write(store, token="t1")
+
+    store.sync("t2")
+    assert not store.loaded
+    assert store.get("site_3_view_home", "site", 3) is None
+
+    store.sync("t1")
+    assert store.loaded
+
+
+def test_older_version_does_not_replace_active_pointer(store):
+    _write(store, version=4, docs={"site_4_view_home": _doc("page_view", version=4, page_path="/")})
+    _write(store, version=3)
+
+    assert store.latest() == {"site": "4"}
+    # a versão anterior continua disponível sob demanda (ex.: cliente fixado)
+    assert store.get("site_3_view_home", "site", 3) == RULES["site_3_view_home"]
+
+
+def test_old_versions_are_pruned(store):
+    paths = [_write(store, version=version) for version in (1, 2, 3, 4)]
+
+    remaining = sorted(name for name in os.listdir(store.directory) if name.endswith(".snap"))
+    assert remaining == sorted(os.path.basename(path) for path in paths[2:])
+    assert set(store.stats()["maps"]["site"]["versions"]) == {"3", "4"}
+
+
+def test_reload_of_same_version_swaps_file(store):
+    first = _write(store, docs={"site_3_view_home": _doc("page_view", page_path="/")})
+    second = _write(store)
+
+    assert first != second
+    assert store.get("site_3_click_header_menu", "site", 3) is not None
+    assert os.path.basename(second) in os.listdir(store.directory)
+
+
+def test_invalid_file_is_rejected(tmp_path):
+    path = tmp_path / "site__3.bad.snap"
+    path.write_bytes(MAGIC + b"x" * 64)
+
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+    store = SnapshotStore(str(tmp_path))
+    store.load()
+    assert not store.loaded
+
+
+def test_aborted_writer_leaves_nothing(store):
+    writer = store.writer("site", 3)
+    writer.add("site_3_view_home", RULES["site_3_view_home"])
+    writer.abort()
+
+    assert os.listdir(store.directory) == []
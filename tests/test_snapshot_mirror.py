@@ -0,0 +1,202 @@
+import json
+import os
+
+import pytest
+from google.api_core import exceptions as gexc
+
+from snapshot import SnapshotStore
+from snapshot_mirror import GCSSnapshotMirror
+
+
+class FakeBlob:
+    def __init__(self, bucket, name, generation=None, metadata=None):
+        self.bucket = bucket
+        self.name = name
+        self.generation = generation
+        self.metadata = metadata
+
+    def _store(self, data, if_generation_match=None):
+        current = self.bucket.objects.get(self.name)
+        if if_generation_match is not None and (current[1] if current else 0) != if_generation_match:
+            raise gexc.PreconditionFailed(self.name)
+        self.bucket.generation += 1
+        self.bucket.objects[self.name] = (data, self.bucket.generation, dict(self.metadata or {}))
+
+    def upload_from_filename(self, path, content_type=None, if_generation_match=None):
+        with open(path, 'rb') as f:
+            self._store(f.read(), if_generation_match)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        self._store(data.encode('utf-8') if isinstance(data, str) else data, if_generation_match)
+
+    def _data(self):
+        if self.name not in self.bucket.objects:
+            raise gexc.NotFound(self.name)
+        return self.bucket.objects[self.name][0]
+
+    def download_as_bytes(self):
+        return self._data()
+
+    def download_to_filename(self, path):
+        data = self._data()
+        self.bucket.downloads.append(self.name)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def delete(self):
+        if self.bucket.objects.pop(self.name, None) is None:
+            raise gexc.NotFound(self.name)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.generation = 0
+        self.downloads = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        if name not in self.objects:
+            return None
+        _, generation, metadata = self.objects[name]
+        return FakeBlob(self, name, generation, metadata)
+
+    def list_blobs(self, prefix=''):
+        return [self.get_blob(name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+
+class FakeStorage:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket())
+
+
+def _doc(label, version=3):
+    return {"metadata": {"map_id": "site", "map_version": version}, "event_name": "click",
+            "params": {"page_path": "/", "section": "menu", "label": label}}
+
+
+def _load(store, version, labels, token="t1"):
+    writer = store.writer("site", version)
+    for label in labels:
+        writer.add(f"site_{version}_{label}", _doc(label, version))
+    writer.commit(token)
+    store.load()
+    return writer.filename
+
+
+@pytest.fixture
+def storage():
+    return FakeStorage()
+
+
+@pytest.fixture
+def instances(tmp_path, storage):
+    """Duas instâncias com diretórios locais próprios e o mesmo bucket."""
+    def make(name):
+        mirror = GCSSnapshotMirror(lambda: storage, "snapshots-bucket", "snapshots")
+        return SnapshotStore(str(tmp_path / name), keep_versions=2, mirror=mirror)
+    return make("loader"), make("fresh")
+
+
+def test_new_instance_downloads_active_snapshot(instances, storage):
+    loader, fresh = instances
+    filename = _load(loader, 3, ["a", "b"])
+
+    fresh.sync("t1")
+
+    assert fresh.loaded and fresh.latest() == {"site": "3"}
+    assert fresh.get("site_3_a", "site", 3)["params"]["label"] == "a"
+    assert os.listdir(fresh.directory).count(filename) == 1
+    assert fresh.stats()["mirror"] == "gs://snapshots-bucket/snapshots/"
+
+
+def test_pull_only_downloads_new_pointers(instances, storage):
+    loader, fresh = instances
+    _load(loader, 3, ["a"])
+    bucket = storage.bucket("snapshots-bucket")
+
+    fresh.pull()
+    fresh.pull()
+    assert len(bucket.downloads) == 1
+
+    _load(loader, 4, ["a", "b"])
+    fresh.pull()
+    assert len(bucket.downloads) == 2
+    assert fresh.latest() == {"site": "4"}
+
+
+def test_snapshot_from_another_publication_is_not_used(instances):
+    loader, fresh = instances
+    _load(loader, 3, ["a"], token="t1")
+
+    fresh.sync("t2")
+
+    assert not fresh.loaded
+    assert fresh.get("site_3_a", "site", 3) is None
+
+
+def test_older_version_does_not_move_bucket_pointer(instances, storage, tmp_path):
+    loader, fresh = instances
+    _load(loader, 5, ["a"])
+    other = SnapshotStore(str(tmp_path / "other"), mirror=GCSSnapshotMirror(storage, "snapshots-bucket", "snapshots"))
+    _load(other, 4, ["a"])
+
+    pointer = storage.bucket("snapshots-bucket").objects["snapshots/site.current"][0]
+    assert json.loads(pointer)["map_version"] == 5
+    fresh.pull()
+    assert fresh.latest() == {"site": "5"}
+
+
+def test_concurrent_pointer_change_is_retried(storage, tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path / "loader"), mirror=GCSSnapshotMirror(storage, "snapshots-bucket"))
+    bucket = storage.bucket("snapshots-bucket")
+    original = FakeBlob.upload_from_string
+    raced = []
+
+    def racing_upload(self, data, content_type=None, if_generation_match=None):
+        if not raced:
+            # outra instância troca o ponteiro entre a leitura e a gravação
+            raced.append(True)
+            original(FakeBlob(bucket, self.name), json.dumps({"map_id": "site", "map_version": 1, "file": "x"}))
+        return original(self, data, content_type, if_generation_match)
+
+    monkeypatch.setattr(FakeBlob, 'upload_from_string', racing_upload)
+    filename = _load(store, 3, ["a"])
+
+    assert raced and json.loads(bucket.objects["site.current"][0])["file"] == filename
+
+
+def test_bucket_keeps_same_versions_as_local_directory(instances, storage):
+    loader, _ = instances
+    for version in (1, 2, 3):
+        _load(loader, version, ["a"])
+
+    names = {name for name in storage.bucket("snapshots-bucket").objects if name.endswith(".snap")}
+    local = {f"snapshots/{name}" for name in os.listdir(loader.directory) if name.endswith(".snap")}
+    assert names == local
+    assert len(names) == 2
+
+
+def test_push_failure_keeps_local_snapshot(tmp_path):
+    mirror = GCSSnapshotMirror(lambda: None, "snapshots-bucket")
+    store = SnapshotStore(str(tmp_path / "loader"), mirror=mirror)
+
+    _load(store, 3, ["a"])
+
+    assert store.get("site_3_a", "site", 3) is not None
+
+
+def test_clear_removes_bucket_objects(instances, storage):
+    loader, fresh = instances
+    _load(loader, 3, ["a"])
+
+    loader.clear()
+
+    assert storage.bucket("snapshots-bucket").objects == {}
+    fresh.sync("t1")
+    assert not fresh.loaded
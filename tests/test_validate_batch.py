@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def _ndjson(events):
+    return "\n".join(event if isinstance(event, str) else json.dumps(event) for event in events) + "\n"
+
+
+def _reports(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data().splitlines()]
+
+
+def test_failed_event_does_not_affect_window(client):
+    body = _ndjson([
+        {"event_name": "batch_ok_1", "params": {"a": "b"}},
+        {"event_name": "batch_bad", "params": [1, 2]},
+        "{json quebrado",
+        {"event_name": "batch_ok_2", "params": {}},
+    ])
+    reports = _reports(client.post('/validate/batch', data=body))
+
+    assert [r["index"] for r in reports] == [0, 1, 2, 3]
+    assert reports[0]["event"] == "batch_ok_1" and "layers" in reports[0]
+    assert reports[1] == {"event": "batch_bad", "index": 1, "valid": False,
+                          "error": "Erro interno no servidor", "details": reports[1]["details"]}
+    assert reports[2]["error"].startswith("JSON inválido")
+    assert reports[3]["event"] == "batch_ok_2" and reports[3]["layers"]["deduplication"] == {"status": "OK"}
+
+
+def test_json_array_body(client):
+    body = json.dumps([{"event_name": "batch_array_1"}, "texto", {"event_name": "batch_array_2"}])
+    reports = _reports(client.post('/validate/batch', data=body, content_type='application/json'))
+
+    assert [r.get("event") for r in reports] == ["batch_array_1", None, "batch_array_2"]
+    assert reports[1]["error"] == "Evento deve ser um objeto JSON."
+
+
+def test_rule_lookups_are_scoped_to_each_window(client, monkeypatch):
+    monkeypatch.setattr(main, 'BATCH_WINDOW_SIZE', 2)
+    windows = []
+    build_reports = main.build_reports
+
+    def spy(items, lookups=None, with_timings=False):
+        assert lookups == {}
+        windows.append((len(items), lookups))
+        return build_reports(items, lookups, with_timings)
+
+    monkeypatch.setattr(main, 'build_reports', spy)
+    reports = _reports(client.post('/validate/batch', data=_ndjson(
+        [{"event_name": "batch_window", "params": {"n": i}} for i in range(5)])))
+
+    assert [r["index"] for r in reports] == list(range(5))
+    assert [size for size, _ in windows] == [2, 2, 1]
+    assert len({id(lookups) for _, lookups in windows}) == 3
+
+
+def test_duplicates_inside_batch(client):
+    event = {"event_name": "batch_dup", "client_id": "batch-dup", "params": {}}
+    reports = _reports(client.post('/validate/batch', data=_ndjson([event, event])))
+
+    assert reports[0]["layers"]["deduplication"] == {"status": "OK"}
+    assert reports[1]["valid"] is False
+    assert reports[1]["layers"]["deduplication"]["status"] == "ERROR"
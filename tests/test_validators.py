@@ -0,0 +1,139 @@
+import pytest
+
+import main
+from validators import ValidatorCache, compile_rule
+
+
+def _issues(params, **received):
+    return compile_rule({"params": params}).validate(received)
+
+
+def _legacy_check_params(expected_params, params):
+    """Comparação original da Layer 3 (antes dos validadores compilados)."""
+    issues = []
+    for key, value in expected_params.items():
+        if key not in params:
+            issues.append(f"Parâmetro esperado ausente: {key}")
+            continue
+        if params.get(key) != value:
+            issues.append(f"Valor de '{key}' inválido. Esperado: {value}, recebido: {params.get(key)}")
+    return issues
+
+
+@pytest.mark.parametrize("received", [
+    {"page_path": "/", "section": "header", "label": "menu"},
+    {"page_path": "/", "section": "footer", "label": "menu"},
+    {"section": "footer"},
+    {},
+    {"page_path": "/", "section": "header", "label": "menu", "extra": 1},
+    {"page_path": "/", "label": 3},
+])
+def test_plain_columns_keep_original_equality(received):
+    expected = {"page_path": "/", "section": "header", "label": "menu"}
+
+    assert compile_rule({"params": expected}).validate(received) == _legacy_check_params(expected, received)
+
+
+@pytest.mark.parametrize("type_name,good,bad,bad_type", [
+    ("string", "abc", 1, "int"),
+    ("number", 1.5, "1.5", "str"),
+    ("integer", 3, 3.0, "float"),
+    ("boolean", False, 0, "int"),
+    ("array", [1], (1,), "tuple"),
+    ("object", {"a": 1}, [], "list"),
+    ("int64", 3, True, "bool"),
+    ("FLOAT", 2, None, "NoneType"),
+])
+def test_type_check(type_name, good, bad, bad_type):
+    expected = "integer" if type_name == "int64" else "number" if type_name == "FLOAT" else type_name
+    assert _issues({"value__type": type_name}, value=good) == []
+    assert _issues({"value__type": type_name}, value=bad) == \
+        [f"Tipo de 'value' inválido. Esperado: {expected}, recebido: {bad_type}"]
+
+
+def test_unknown_type_is_ignored():
+    assert _issues({"value__type": "decimal"}, value="x") == []
+
+
+def test_regex_must_match_whole_value():
+    rule = {"item_id__regex": "[0-9]+"}
+
+    assert _issues(rule, item_id="123") == []
+    assert _issues(rule, item_id=123) == []
+    assert _issues(rule, item_id="123a") == ["Valor de 'item_id' não corresponde ao padrão [0-9]+"]
+
+
+def test_invalid_regex_is_ignored():
+    assert _issues({"item_id__regex": "[0-9"}, item_id="x") == []
+
+
+def test_enum_from_text_and_list():
+    assert _issues({"tier__enum": "gold, silver"}, tier="gold") == []
+    assert _issues({"tier__enum": "gold, silver"}, tier="bronze") == \
+        ["Valor de 'tier' fora dos valores permitidos: ['gold', 'silver']"]
+    # valores do evento comparados também como texto (ex.: enum numérico vindo do BigQuery como string)
+    assert _issues({"qty__enum": "1,2"}, qty=2) == []
+    assert _issues({"qty__enum": [1, 2]}, qty=3) == ["Valor de 'qty' fora dos valores permitidos: ['1', '2']"]
+    assert _issues({"qty__enum": [1, 2]}, qty=[1]) == ["Valor de 'qty' fora dos valores permitidos: ['1', '2']"]
+
+
+def test_missing_parameter():
+    assert _issues({"value__type": "number"}) == ["Parâmetro esperado ausente: value"]
+    assert _issues({"value__type": "number", "value__required": "false"}) == []
+    assert _issues({"value__type": "number", "value__required": "false"}, value="x") == \
+        ["Tipo de 'value' inválido. Esperado: number, recebido: str"]
+    assert _issues({"value__required": True}) == ["Parâmetro esperado ausente: value"]
+
+
+def test_suffix_only_parameter_is_not_compared_by_equality():
+    assert _issues({"value__type": "number"}, value=42) == []
+
+
+def test_literal_and_suffix_rules_combine():
+    rule = {"currency": "BRL", "currency__regex": "[A-Z]{3}"}
+
+    assert _issues(rule, currency="BRL") == []
+    assert _issues(rule, currency="USD") == ["Valor de 'currency' inválido. Esperado: BRL, recebido: USD"]
+
+
+def test_issues_follow_rule_order():
+    rule = {"a": 1, "b__type": "string", "c": "x", "d__enum": "y"}
+
+    assert _issues(rule, b=2, d="z") == [
+        "Parâmetro esperado ausente: a",
+        "Tipo de 'b' inválido. Esperado: string, recebido: int",
+        "Parâmetro esperado ausente: c",
+        "Valor de 'd' fora dos valores permitidos: ['y']",
+    ]
+
+
+def test_narrow_columns_are_plain_parameters():
+    # `param_type`/`regex_pattern` não têm sufixo: são parâmetros esperados por igualdade
+    rule = {"item_id": "1", "param_type": "string", "regex_pattern": "[0-9]+"}
+
+    assert _issues(rule, item_id="1") == ["Parâmetro esperado ausente: param_type",
+                                          "Parâmetro esperado ausente: regex_pattern"]
+
+
+def test_unknown_suffix_is_plain_parameter():
+    assert _issues({"page__title": "Home"}, page__title="Home") == []
+    assert _issues({"__type": "string"}, __type="string") == []
+
+
+def test_validator_cache_compiles_once_per_document():
+    cache = ValidatorCache(maxsize=2)
+    doc = {"params": {"value__type": "number"}}
+
+    assert cache.get(doc) is cache.get(doc)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get(dict(doc)) is not cache.get(doc)
+
+
+def test_check_params_reports_schema_error():
+    doc = {"params": {"value__type": "number"}}
+
+    assert main.check_params(doc, {"value": 1}) is None
+    assert main.check_params(doc, {"value": "1"}) == {
+        "status": "ERROR", "layer": "Schema",
+        "issues": ["Tipo de 'value' inválido. Esperado: number, recebido: str"],
+    }